@@ -0,0 +1,119 @@
+"""Measure batch throughput: a pasted list or document of queries, one per line.
+
+    python -m benchmarks.batch --lines 10000
+    python -m benchmarks.batch --distinct 500 --shared-groups 0.8
+
+Lines are drawn from a pool of `--distinct` queries, part of them built from a few shared parenthesised
+sub-expressions, like a column of calculations over the same values. The batch path is compared with processing
+every line on its own, caches are off in both, so the difference comes from deduplication and shared groups.
+"""
+import argparse
+import asyncio
+import random
+import sys
+import typing as tp
+from time import perf_counter
+
+from loguru import logger as log
+
+from benchmarks.corpus import NUMBERS, generate_corpus
+from calculator_bot.batch_processor import (BatchProcessor, iter_lines,
+                                            pack_messages)
+from calculator_bot.query_processor import QueryProcessor
+
+PARENTHESES_LIMIT = 100
+RESULT_BITS_LIMIT = 1024
+SLICE_OPERATIONS = 1000
+SLICE_SECONDS = 0.002
+
+
+def build_lines(seed: int, lines: int, distinct: int, shared_groups: float) -> list[str]:
+    # Seeded so runs are reproducible, not used for security
+    rng = random.Random(seed)  # nosec B311
+    corpus = [
+        query for name, queries in generate_corpus(seed, distinct).items()
+        if name != "inline_prefixes" for query in queries
+    ]
+    groups = [f"({rng.choice(NUMBERS)}{rng.choice('+-*/')}{rng.choice(NUMBERS)})" for _ in range(8)]
+    pool = []
+    for _ in range(distinct):
+        if rng.random() < shared_groups:
+            parts = [f"({rng.choice(groups)}*{rng.choice(groups)}-{rng.choice(NUMBERS)})" for _ in range(4)]
+            pool.append("+".join(parts) + f"*{rng.choice(NUMBERS)}")
+        else:
+            pool.append(rng.choice(corpus))
+    return [rng.choice(pool) for _ in range(lines)]
+
+
+def make_processor() -> QueryProcessor:
+    return QueryProcessor(
+        PARENTHESES_LIMIT,
+        result_bits_limit=RESULT_BITS_LIMIT,
+        slice_operations=SLICE_OPERATIONS,
+        slice_seconds=SLICE_SECONDS,
+    )
+
+
+async def run_lines(lines: list[str]) -> list[str]:
+    processor = make_processor()
+    return [(await processor.process(line)).message for line in lines]
+
+
+async def run_batch(lines: list[str], chunk_size: int, concurrency: int) -> list[str]:
+    batch_processor = BatchProcessor(make_processor(), chunk_size, concurrency)
+    return [query_result.message async for query_result in batch_processor.process(iter_lines("\n".join(lines)))]
+
+
+async def measure(scenario: tp.Callable[[], tp.Awaitable[list[str]]], repeat: int) -> tuple[float, list[str]]:
+    elapsed = float("inf")
+    messages: list[str] = []
+    for _ in range(repeat):
+        started = perf_counter()
+        messages = await scenario()
+        elapsed = min(elapsed, perf_counter() - started)
+    return elapsed, messages
+
+
+async def count_replies(messages: list[str]) -> int:
+    async def texts() -> tp.AsyncIterator[str]:
+        for message in messages:
+            yield message
+
+    return len([reply async for reply in pack_messages(texts())])
+
+
+async def run(args: argparse.Namespace) -> bool:
+    lines = build_lines(args.seed, args.lines, args.distinct, args.shared_groups)
+    print(f"{len(lines)} lines, {len(set(lines))} distinct")
+
+    elapsed, expected = await measure(lambda: run_lines(lines), args.repeat)
+    print(f"{'line by line':<16}{len(lines) / elapsed:>12.1f} lines/s{elapsed:>10.3f}s")
+    elapsed, messages = await measure(lambda: run_batch(lines, args.chunk_size, args.concurrency), args.repeat)
+    print(f"{'batch':<16}{len(lines) / elapsed:>12.1f} lines/s{elapsed:>10.3f}s")
+    print(f"Answered with {await count_replies(messages)} messages")
+
+    if messages != expected:
+        mismatches = sum(message != other for message, other in zip(messages, expected))
+        print(f"Batch results differ from line by line ones: {mismatches} lines")
+        return False
+    return True
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Batch evaluation throughput benchmark")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--lines", type=int, default=10000, help="Lines in the batch")
+    parser.add_argument("--distinct", type=int, default=2000, help="Distinct queries the lines are drawn from")
+    parser.add_argument("--shared-groups", type=float, default=0.5, help="Share of queries built of shared groups")
+    parser.add_argument("--chunk-size", type=int, default=256)
+    parser.add_argument("--concurrency", type=int, default=4)
+    parser.add_argument("--repeat", type=int, default=3, help="Passes, the fastest one is reported")
+    args = parser.parse_args()
+
+    log.remove()
+    if not asyncio.run(run(args)):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,64 @@
+import random
+
+ACTIONS = ("+", "-", "*", "/", "//", "^")
+NUMBERS = ("1", "2", "3", "7", "10", "0.5", "2.5", "42", "1000", "3.14")
+INLINE_EXPRESSIONS = (
+    "2+2*2",
+    "12*(3+4.5)/2-7",
+    "(1200-350)*0.87",
+    "2**10 - 24",
+    "100/3",
+    "15,5*4 + 2",
+    "(2+3)*(4-1)/-(1+1)",
+    "1024//10",
+)
+
+
+def generate_corpus(seed: int = 0, size: int = 200, parentheses_limit: int = 100) -> dict[str, list[str]]:
+    """Build reproducible query sets, one per kind of load the bot sees or has to survive."""
+    # Seeded so runs are reproducible, not used for security
+    rng = random.Random(seed)  # nosec B311
+    return {
+        "flat_chain": [flat_chain(rng, rng.randint(50, 200)) for _ in range(size)],
+        "nested": [nested(rng, rng.randint(1, parentheses_limit)) for _ in range(size)],
+        "unary_minus": [unary_minus(rng, rng.randint(10, 50)) for _ in range(size)],
+        "large_exponents": [large_exponent(rng) for _ in range(size)],
+        "inline_prefixes": inline_prefixes(rng, size),
+    }
+
+
+def flat_chain(rng: random.Random, length: int) -> str:
+    parts = [rng.choice(NUMBERS)]
+    for _ in range(length):
+        parts.extend((rng.choice(ACTIONS[:4]), rng.choice(NUMBERS)))
+    return "".join(parts)
+
+
+def nested(rng: random.Random, depth: int) -> str:
+    query = rng.choice(NUMBERS)
+    for _ in range(depth):
+        query = f"({query}{rng.choice(ACTIONS[:4])}{rng.choice(NUMBERS)})"
+    return query
+
+
+def unary_minus(rng: random.Random, length: int) -> str:
+    parts = [f"-{rng.choice(NUMBERS)}"]
+    for _ in range(length):
+        operand = rng.choice((f"-{rng.choice(NUMBERS)}", f"-(-{rng.choice(NUMBERS)})", rng.choice(NUMBERS)))
+        parts.extend((rng.choice(("+", "-", "*")), operand))
+    return "".join(parts)
+
+
+def large_exponent(rng: random.Random) -> str:
+    base = rng.choice(("2", "1.5", "10", "-3", "0.5", "7"))
+    exponent = rng.choice(("100", "300", "1000", "5000", "2^10", "-500"))
+    return f"{base}^{exponent}{rng.choice(ACTIONS[:4])}{rng.choice(NUMBERS)}"
+
+
+def inline_prefixes(rng: random.Random, size: int) -> list[str]:
+    """Every prefix of an expression, the way inline queries arrive while the user types."""
+    queries: list[str] = []
+    while len(queries) < size:
+        expression = rng.choice(INLINE_EXPRESSIONS)
+        queries.extend(expression[:end] for end in range(1, len(expression) + 1))
+    return queries[:size]
@@ -0,0 +1,125 @@
+"""Local stand-in for the Bot API endpoints the bot uses, so it can be load tested without Telegram.
+
+The bot is pointed at it with `TG_API_SERVER=http://localhost:<port>`. Updates are queued with `push_message` and
+`push_inline_query` and handed out by getUpdates; every sendMessage and answerInlineQuery is reported to
+`on_answer` with the id of the update it answers.
+"""
+import asyncio
+import itertools
+import json
+import typing as tp
+from time import time
+
+from aiohttp import web
+
+# Accepted only by the fake Bot API
+FAKE_TOKEN = "123456:fake-load-test-token"  # nosec B105
+BOT_USER = {"id": 123456, "is_bot": True, "first_name": "Calculator", "username": "calculator_load_bot"}
+UPDATES_LIMIT = 100
+
+AnswerCallback = tp.Callable[[int, str], None]
+
+
+class FakeTelegramServer:
+    def __init__(self, host: str = "localhost", port: int = 8081, on_answer: AnswerCallback | None = None) -> None:
+        self.host = host
+        self.port = port
+        self.on_answer = on_answer
+        self.polling = asyncio.Event()
+        self._updates: list[dict[str, tp.Any]] = []
+        self._updates_available = asyncio.Event()
+        self._update_ids = itertools.count(1)
+        self._message_ids = itertools.count(1_000_000_000)
+        self._runner: web.AppRunner | None = None
+
+    async def start(self) -> None:
+        app = web.Application()
+        app.router.add_post("/bot{token}/{method}", self._handle)
+        self._runner = web.AppRunner(app, access_log=None)
+        await self._runner.setup()
+        await web.TCPSite(self._runner, self.host, self.port).start()
+
+    async def stop(self) -> None:
+        if self._runner is not None:
+            await self._runner.cleanup()
+
+    def push_message(self, text: str, user_id: int) -> int:
+        update = make_message_update(next(self._update_ids), text, user_id)
+        self._push(update)
+        return update["update_id"]
+
+    def push_inline_query(self, query: str, user_id: int) -> int:
+        update = make_inline_query_update(next(self._update_ids), query, user_id)
+        self._push(update)
+        return update["update_id"]
+
+    def _push(self, update: dict[str, tp.Any]) -> None:
+        self._updates.append(update)
+        self._updates_available.set()
+
+    async def _handle(self, request: web.Request) -> web.Response:
+        method = request.match_info["method"]
+        data: dict[str, tp.Any] = dict(await request.post())
+        if method == "getUpdates":
+            return ok(await self._get_updates(data))
+        if method == "getMe":
+            return ok(BOT_USER)
+
+        if method == "sendMessage":
+            # Messages are created with message_id equal to the update_id, so a reply points at its update
+            self._answer(data.get("reply_to_message_id"), method)
+            return ok({
+                "message_id": next(self._message_ids),
+                "date": int(time()),
+                "chat": {"id": int(data["chat_id"]), "type": "private"},
+                "from": BOT_USER,
+                "text": data.get("text", ""),
+            })
+        if method == "answerInlineQuery":
+            self._answer(data.get("inline_query_id"), method)
+        return ok(True)
+
+    def _answer(self, update_id: tp.Any, method: str) -> None:
+        if update_id is not None and self.on_answer is not None:
+            self.on_answer(int(update_id), method)
+
+    async def _get_updates(self, data: dict[str, tp.Any]) -> list[dict[str, tp.Any]]:
+        self.polling.set()
+        # Updates below the offset are confirmed by the bot, the rest are returned again until they are
+        offset = int(data.get("offset") or 0)
+        self._updates = [update for update in self._updates if update["update_id"] >= offset]
+        if not self._updates:
+            self._updates_available.clear()
+            try:
+                await asyncio.wait_for(self._updates_available.wait(), float(data.get("timeout") or 0) or None)
+            except asyncio.TimeoutError:
+                return []
+        return self._updates[:int(data.get("limit") or UPDATES_LIMIT)]
+
+
+def ok(result: tp.Any) -> web.Response:
+    return web.Response(text=json.dumps({"ok": True, "result": result}), content_type="application/json")
+
+
+def make_user(user_id: int) -> dict[str, tp.Any]:
+    return {"id": user_id, "is_bot": False, "first_name": f"User {user_id}"}
+
+
+def make_message_update(update_id: int, text: str, user_id: int) -> dict[str, tp.Any]:
+    return {
+        "update_id": update_id,
+        "message": {
+            "message_id": update_id,
+            "date": int(time()),
+            "chat": {"id": user_id, "type": "private"},
+            "from": make_user(user_id),
+            "text": text,
+        },
+    }
+
+
+def make_inline_query_update(update_id: int, query: str, user_id: int) -> dict[str, tp.Any]:
+    return {
+        "update_id": update_id,
+        "inline_query": {"id": str(update_id), "from": make_user(user_id), "query": query, "offset": ""},
+    }
@@ -0,0 +1,290 @@
+"""End-to-end load test of the bot against the fake Bot API server.
+
+    python -m benchmarks.load --rate 200 --duration 30 --inline-share 0.5
+    python -m benchmarks.load --mode webhook --workers 4
+
+The bot is started with `python -m calculator_bot.app` and pointed at `benchmarks.fake_telegram`. Direct messages
+and inline sessions (every prefix of an expression, sent one keystroke at a time) are replayed at `--rate`
+updates per second on a fixed schedule, independent of how fast the bot answers. In polling mode updates are
+handed out by getUpdates, in webhook mode they are posted to the bot and answers are read from the response.
+
+Intermediate keystrokes may be superseded by the inline coalescer without an answer, that is expected. Direct
+messages and the last keystroke of a session must be answered, the script exits with 1 if any of them is dropped
+or `--max-p99-ms` is exceeded.
+"""
+import argparse
+import asyncio
+import itertools
+import os
+import random
+import signal
+# Starts the bot under test
+import subprocess  # nosec B404
+import sys
+import typing as tp
+from dataclasses import dataclass, field
+from time import perf_counter
+
+from aiohttp import ClientError, ClientSession, MultipartReader
+
+from benchmarks.corpus import INLINE_EXPRESSIONS, generate_corpus
+from benchmarks.fake_telegram import (FAKE_TOKEN, FakeTelegramServer,
+                                      make_inline_query_update,
+                                      make_message_update)
+
+DIRECT = "direct"
+INLINE = "inline"
+READY_TIMEOUT = 30.0
+STOP_TIMEOUT = 10.0
+
+
+@dataclass(frozen=True)
+class Event:
+    at: float
+    kind: str
+    text: str
+    user_id: int
+    # Direct messages and the last keystroke of an inline session have to be answered
+    final: bool
+
+
+@dataclass
+class Sent:
+    kind: str
+    final: bool
+    sent_at: float
+    latency: float | None = None
+
+
+@dataclass
+class LoadReport:
+    sent: dict[int, Sent] = field(default_factory=dict)
+    max_lag: float = 0.0
+    started: float = 0.0
+    last_answer: float = 0.0
+
+    def answer(self, update_id: int, _method: str = "") -> None:
+        sent = self.sent.get(update_id)
+        if sent is not None and sent.latency is None:
+            self.last_answer = perf_counter()
+            sent.latency = self.last_answer - sent.sent_at
+
+
+def build_schedule(
+        seed: int,
+        rate: float,
+        duration: float,
+        inline_share: float,
+        keystroke_interval: float,
+) -> list[Event]:
+    """Spread sessions so the updates they send add up to `rate` per second, every session from a new user."""
+    # Seeded so runs are reproducible, not used for security
+    rng = random.Random(seed)  # nosec B311
+    direct_queries = [
+        query for name, corpus in generate_corpus(seed, 100).items() if name != "inline_prefixes" for query in corpus
+    ]
+    events: list[Event] = []
+    started_at = 0.0
+    for user_id in itertools.count(1):
+        if started_at >= duration:
+            break
+
+        if rng.random() < inline_share:
+            expression = rng.choice(INLINE_EXPRESSIONS)
+            events.extend(
+                Event(started_at + idx * keystroke_interval, INLINE, expression[:idx + 1], user_id,
+                      final=idx == len(expression) - 1)
+                for idx in range(len(expression))
+            )
+            started_at += len(expression) / rate
+        else:
+            events.append(Event(started_at, DIRECT, rng.choice(direct_queries), user_id, final=True))
+            started_at += 1 / rate
+
+    events.sort(key=lambda event: event.at)
+    return events
+
+
+async def replay(events: list[Event], send: tp.Callable[[Event], int], report: LoadReport) -> None:
+    report.started = perf_counter()
+    for event in events:
+        delay = report.started + event.at - perf_counter()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        else:
+            report.max_lag = max(report.max_lag, -delay)
+        update_id = send(event)
+        report.sent[update_id] = Sent(event.kind, event.final, perf_counter())
+
+
+def start_bot(port: int, mode: str = "polling", webhook_port: int = 8080, workers: int = 1) -> subprocess.Popen[bytes]:
+    """Start the bot with `python -m calculator_bot.app`, talking to the fake Bot API on `port`."""
+    env = dict(os.environ)
+    env.pop("DOPPLER_TOKEN", None)
+    env.update({
+        "TG_BOT_API_TOKEN": FAKE_TOKEN,
+        "TG_API_SERVER": f"http://localhost:{port}",
+        "TG_MODE": mode,
+        "TG_WEBHOOK_HOST": "localhost",
+        "TG_WEBHOOK_PORT": str(webhook_port),
+        "TG_WEBHOOK_URL": "",
+        "APP_WORKERS": str(workers),
+        # Incomplete keystrokes are logged as errors, which would flood the output
+        "LOG_LEVEL": env.get("LOG_LEVEL", "CRITICAL"),
+    })
+    # The command is fixed, only the environment is ours
+    return subprocess.Popen([sys.executable, "-m", "calculator_bot.app"], env=env)  # nosec B603
+
+
+def stop_bot(process: subprocess.Popen[bytes]) -> None:
+    process.send_signal(signal.SIGINT)
+    try:
+        process.wait(STOP_TIMEOUT)
+    except subprocess.TimeoutExpired:
+        process.kill()
+        process.wait()
+
+
+async def wait_for_webhook(session: ClientSession, url: str) -> None:
+    deadline = perf_counter() + READY_TIMEOUT
+    while True:
+        try:
+            # Any response, even 405 for a GET, means the server is listening
+            async with session.get(url):
+                return
+        except ClientError:
+            if perf_counter() > deadline:
+                raise
+            await asyncio.sleep(0.2)
+
+
+async def run(args: argparse.Namespace, events: list[Event]) -> LoadReport:
+    report = LoadReport()
+    server = FakeTelegramServer(port=args.port, on_answer=report.answer)
+    await server.start()
+    process = None if args.external else start_bot(args.port, args.mode, args.webhook_port, args.workers)
+    try:
+        async with ClientSession() as session:
+            if args.mode == "webhook":
+                await _run_webhook(args, events, report, session)
+            else:
+                await asyncio.wait_for(server.polling.wait(), READY_TIMEOUT)
+                await replay(events, lambda event: _push(server, event), report)
+                await _wait_for_answers(report, args.grace)
+    finally:
+        if process is not None:
+            stop_bot(process)
+        await server.stop()
+    return report
+
+
+async def _run_webhook(
+        args: argparse.Namespace,
+        events: list[Event],
+        report: LoadReport,
+        session: ClientSession,
+) -> None:
+    url = f"http://localhost:{args.webhook_port}/webhook"
+    update_ids = itertools.count(1)
+    requests: set[asyncio.Task[None]] = set()
+
+    async def post(update: dict[str, tp.Any]) -> None:
+        # Answers come back in the webhook response as form data, a response without a method means no answer
+        async with session.post(url, json=update) as response:
+            if not response.content_type.startswith("multipart/"):
+                return
+            reader = MultipartReader.from_response(response)
+            while (part := await reader.next()) is not None:
+                if getattr(part, "name", None) == "method":
+                    report.answer(update["update_id"])
+                    return
+
+    def send(event: Event) -> int:
+        update_id = next(update_ids)
+        update = (
+            make_message_update(update_id, event.text, event.user_id) if event.kind == DIRECT
+            else make_inline_query_update(update_id, event.text, event.user_id)
+        )
+        task = asyncio.create_task(post(update))
+        requests.add(task)
+        task.add_done_callback(requests.discard)
+        return update_id
+
+    await wait_for_webhook(session, url)
+    await replay(events, send, report)
+    await _wait_for_answers(report, args.grace)
+    for task in requests:
+        task.cancel()
+
+
+def _push(server: FakeTelegramServer, event: Event) -> int:
+    if event.kind == DIRECT:
+        return server.push_message(event.text, event.user_id)
+    return server.push_inline_query(event.text, event.user_id)
+
+
+async def _wait_for_answers(report: LoadReport, grace: float) -> None:
+    deadline = perf_counter() + grace
+    while perf_counter() < deadline:
+        if all(sent.latency is not None for sent in report.sent.values() if sent.final):
+            return
+        await asyncio.sleep(0.05)
+
+
+def percentile(values: list[float], share: float) -> float:
+    return values[min(int(len(values) * share), len(values) - 1)] if values else float("nan")
+
+
+def print_report(report: LoadReport, late_after: float) -> tuple[int, float]:
+    """Print the report, returning the amount of dropped answers and the p99 latency in ms."""
+    elapsed = max(report.last_answer - report.started, 1e-9)
+    answered = [sent for sent in report.sent.values() if sent.latency is not None]
+    dropped = sum(1 for sent in report.sent.values() if sent.final and sent.latency is None)
+    superseded = sum(1 for sent in report.sent.values() if not sent.final and sent.latency is None)
+    late = sum(1 for sent in answered if tp.cast(float, sent.latency) > late_after)
+
+    print(f"{'updates':<12}{'answered':>10}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'max ms':>10}")
+    p99 = float("nan")
+    for kind in (DIRECT, INLINE, None):
+        sent = [item for item in report.sent.values() if kind is None or item.kind == kind]
+        latencies = sorted(item.latency * 1000 for item in sent if item.latency is not None)
+        if kind is None:
+            p99 = percentile(latencies, 0.99)
+        print(
+            f"{kind or 'total':<12}{len(latencies):>10}{percentile(latencies, 0.5):>10.2f}"
+            f"{percentile(latencies, 0.95):>10.2f}{percentile(latencies, 0.99):>10.2f}"
+            f"{latencies[-1] if latencies else float('nan'):>10.2f}"
+        )
+
+    print(f"Sent {len(report.sent)} updates in {elapsed:.1f}s, {len(answered) / elapsed:.1f} answers/s")
+    print(f"Dropped {dropped}, late (over {late_after * 1000:.0f} ms) {late}, superseded keystrokes {superseded}")
+    print(f"Generator lag {report.max_lag * 1000:.1f} ms at most")
+    return dropped, p99
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="End-to-end bot load test against a fake Bot API")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--rate", type=float, default=100, help="Updates per second")
+    parser.add_argument("--duration", type=float, default=10, help="Seconds of load")
+    parser.add_argument("--inline-share", type=float, default=0.5, help="Share of sessions that are inline")
+    parser.add_argument("--keystroke-interval", type=float, default=0.08, help="Seconds between inline keystrokes")
+    parser.add_argument("--late-after", type=float, default=0.5, help="Seconds after which an answer is late")
+    parser.add_argument("--grace", type=float, default=5, help="Seconds to wait for answers after the last update")
+    parser.add_argument("--max-p99-ms", type=float, default=0, help="Fail above this p99 latency, 0 disables")
+    parser.add_argument("--mode", choices=("polling", "webhook"), default="polling")
+    parser.add_argument("--workers", type=int, default=1, help="Bot worker processes, webhook mode only")
+    parser.add_argument("--port", type=int, default=8081, help="Port of the fake Bot API")
+    parser.add_argument("--webhook-port", type=int, default=8080)
+    parser.add_argument("--external", action="store_true", help="Don't start the bot, it is already running")
+    args = parser.parse_args()
+
+    events = build_schedule(args.seed, args.rate, args.duration, args.inline_share, args.keystroke_interval)
+    report = asyncio.run(run(args, events))
+    dropped, p99 = print_report(report, args.late_after)
+    if dropped or (args.max_p99_ms and p99 > args.max_p99_ms):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,246 @@
+"""Benchmark the calculator engine and QueryProcessor against a stored baseline.
+
+    python -m benchmarks.run                    # compare with benchmarks/baseline.json, exit 1 on regression
+    python -m benchmarks.run --update-baseline  # store the current numbers as the new baseline
+
+Timings depend on the machine, so a short fixed pure Python workload is timed before every pass of a benchmark and
+its fastest time is kept as the benchmark's `reference_ms`. Every benchmark is scored by its timings divided by the
+reference, which makes a baseline stored on one machine comparable with runs on another. The whole suite runs
+`--runs` times and each benchmark is gated on its median score, with a tolerance of its own: the run to run spread
+of the score seen when the baseline was stored, clamped between `--tolerance` and `MAX_TOLERANCE`. Memory peaks
+don't depend on the machine and are gated on `--tolerance` alone. The geometric mean over all benchmarks is only
+reported.
+"""
+import argparse
+import asyncio
+import json
+import statistics
+import sys
+import tracemalloc
+import typing as tp
+from pathlib import Path
+from time import perf_counter
+
+from loguru import logger as log
+
+from benchmarks.corpus import generate_corpus
+from calculator_bot.libs.calculator import Calculator
+from calculator_bot.libs.calculator.errors import CalcError
+from calculator_bot.query_processor import (QueryProcessor,
+                                            init_compiled_cache,
+                                            init_result_cache)
+
+BASELINE_PATH = Path(__file__).parent / "baseline.json"
+PARENTHESES_LIMIT = 100
+RESULT_BITS_LIMIT = 1024
+SLICE_OPERATIONS = 1000
+SLICE_SECONDS = 0.002
+REFERENCE_LOOPS = 5_000
+MIN_MEASURE_SECONDS = 0.5
+TIMING_METRICS = ("throughput", "p50_ms", "p99_ms")
+PEAK_METRIC = "peak_kib"
+REFERENCE_METRIC = "reference_ms"
+SCORE_KEY = "score"
+TOLERANCE_KEY = "tolerance"
+# Tolerance in median absolute deviations of the score, which keeps false alarms rare on a noisy machine
+NOISE_DEVIATIONS = 3
+# Even the noisiest benchmark fails when it gets 1.5 times slower
+MAX_TOLERANCE = 0.45
+
+Scenario = tp.Callable[[str], tp.Awaitable[tp.Any]]
+
+
+def calculator_scenario() -> Scenario:
+    calculator = Calculator(
+        PARENTHESES_LIMIT,
+        result_bits_limit=RESULT_BITS_LIMIT,
+        slice_operations=SLICE_OPERATIONS,
+        slice_seconds=SLICE_SECONDS,
+    )
+
+    async def solve(query: str) -> float | None:
+        try:
+            return await calculator.solve(query)
+        except (CalcError, ArithmeticError, TypeError):
+            return None
+
+    return solve
+
+
+def processor_scenario(cached: bool) -> Scenario:
+    processor = QueryProcessor(
+        PARENTHESES_LIMIT,
+        compiled_cache=init_compiled_cache(1024) if cached else None,
+        result_cache=init_result_cache(4096, None, None) if cached else None,
+        result_bits_limit=RESULT_BITS_LIMIT,
+        slice_operations=SLICE_OPERATIONS,
+        slice_seconds=SLICE_SECONDS,
+    )
+    return processor.process
+
+
+async def measure(make_scenario: tp.Callable[[], Scenario], queries: list[str], repeat: int) -> dict[str, float]:
+    """Time `repeat` passes over the queries, then trace the peak memory of a single pass on a fresh scenario.
+
+    Passes go on until they take `MIN_MEASURE_SECONDS` in total, so the corpora of short queries are timed long
+    enough to average out the scheduler. The cached scenario keeps its caches between passes, so its numbers show
+    the warm path.
+    """
+    scenario = make_scenario()
+    # The fastest of the passes is kept for every query, which filters out most scheduler and GC noise
+    latencies = [float("inf")] * len(queries)
+    elapsed = float("inf")
+    passes, measured, reference = 0, 0.0, float("inf")
+    while passes < repeat or measured < MIN_MEASURE_SECONDS:
+        reference = min(reference, reference_ms())
+        passes += 1
+        started = perf_counter()
+        for idx, query in enumerate(queries):
+            query_started = perf_counter()
+            await scenario(query)
+            latencies[idx] = min(latencies[idx], perf_counter() - query_started)
+        elapsed = min(elapsed, perf_counter() - started)
+        measured += perf_counter() - started
+    reference = min(reference, reference_ms())
+
+    scenario = make_scenario()
+    tracemalloc.start()
+    for query in queries:
+        await scenario(query)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    latencies.sort()
+    return {
+        "throughput": round(len(queries) / elapsed, 1),
+        "p50_ms": round(latencies[len(latencies) // 2] * 1000, 4),
+        "p99_ms": round(latencies[int(len(latencies) * 0.99)] * 1000, 4),
+        "peak_kib": round(peak / 1024, 1),
+        REFERENCE_METRIC: round(reference, 4),
+    }
+
+
+def reference_ms() -> float:
+    """Time of a fixed workload of float arithmetic, list and dict operations, in milliseconds."""
+    started = perf_counter()
+    operands: list[float] = []
+    counts: dict[int, int] = {}
+    for idx in range(REFERENCE_LOOPS):
+        operands.append(idx * 0.5)
+        if len(operands) > 2:
+            right = operands.pop()
+            operands[-1] = operands[-1] / (right + 1.0) + right
+        counts[idx & 63] = counts.get(idx & 63, 0) + 1
+    return (perf_counter() - started) * 1000
+
+
+async def run(seed: int, size: int, repeat: int) -> dict[str, dict[str, float]]:
+    corpus = generate_corpus(seed, size, PARENTHESES_LIMIT)
+    scenarios: dict[str, tp.Callable[[], Scenario]] = {
+        "calculator": calculator_scenario,
+        "processor": lambda: processor_scenario(cached=False),
+        "processor_cached": lambda: processor_scenario(cached=True),
+    }
+
+    results = {}
+    for scenario_name, make_scenario in scenarios.items():
+        for corpus_name, queries in corpus.items():
+            results[f"{scenario_name}.{corpus_name}"] = await measure(make_scenario, queries, repeat)
+    return results
+
+
+def score(metrics: dict[str, float]) -> float:
+    """Geometric mean of the timings of a benchmark in units of its reference time, lower is better."""
+    reference = metrics[REFERENCE_METRIC]
+    return statistics.geometric_mean([
+        1 / (metrics[metric] * reference) if metric == "throughput" else metrics[metric] / reference
+        for metric in TIMING_METRICS
+    ])
+
+
+def summarize(runs: list[dict[str, dict[str, float]]]) -> dict[str, dict[str, float]]:
+    """Median of every metric and of the score over the runs, plus the spread of the score as its tolerance."""
+    summary = {}
+    for name in runs[0]:
+        metrics = {metric: round(statistics.median(run[name][metric] for run in runs), 4) for metric in runs[0][name]}
+        scores = [score(run[name]) for run in runs]
+        median_score = statistics.median(scores)
+        spread = statistics.median(abs(value / median_score - 1) for value in scores)
+        summary[name] = {
+            **metrics,
+            SCORE_KEY: round(median_score, 6),
+            TOLERANCE_KEY: round(NOISE_DEVIATIONS * spread, 4),
+        }
+    return summary
+
+
+def compare(
+        summary: dict[str, dict[str, float]],
+        baseline: dict[str, dict[str, float]],
+        min_tolerance: float,
+) -> tuple[dict[str, tuple[float, float]], list[str]]:
+    """Score ratios to the baseline with their tolerances by benchmark, and the regressions among them."""
+    ratios, regressions = {}, []
+    for name, metrics in summary.items():
+        expected = baseline.get(name)
+        if expected is None:
+            continue
+
+        ratio = metrics[SCORE_KEY] / expected[SCORE_KEY]
+        tolerance = min(max(expected.get(TOLERANCE_KEY, 0.0), min_tolerance), MAX_TOLERANCE)
+        ratios[name] = ratio, tolerance
+        if ratio > 1 + tolerance:
+            regressions.append(f"{name} timings: {ratio:.2f}x baseline, tolerance {tolerance:.2f}")
+        peak_ratio = metrics[PEAK_METRIC] / expected[PEAK_METRIC]
+        if peak_ratio > 1 + min_tolerance:
+            regressions.append(f"{name} {PEAK_METRIC}: {peak_ratio:.2f}x baseline")
+    return ratios, regressions
+
+
+def print_results(results: dict[str, dict[str, float]]) -> None:
+    print(f"{'benchmark':<36}{'queries/s':>12}{'p50 ms':>10}{'p99 ms':>10}{'peak KiB':>10}{'ref ms':>10}")
+    for name, metrics in results.items():
+        print(
+            f"{name:<36}{metrics['throughput']:>12}{metrics['p50_ms']:>10}"
+            f"{metrics['p99_ms']:>10}{metrics['peak_kib']:>10}{metrics[REFERENCE_METRIC]:>10}"
+        )
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Calculator performance benchmarks")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--size", type=int, default=200, help="Queries per corpus")
+    parser.add_argument("--repeat", type=int, default=3, help="Passes over every corpus in a run")
+    parser.add_argument("--runs", type=int, default=7, help="Runs of the whole suite, gated on their median")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="Smallest allowed relative regression")
+    parser.add_argument("--baseline", type=Path, default=BASELINE_PATH)
+    parser.add_argument("--update-baseline", action="store_true")
+    args = parser.parse_args()
+
+    log.remove()
+    summary = summarize([asyncio.run(run(args.seed, args.size, args.repeat)) for _ in range(args.runs)])
+    print_results(summary)
+
+    if args.update_baseline:
+        args.baseline.write_text(json.dumps(summary, indent=2, sort_keys=True) + "\n")
+        print(f"Baseline stored in {args.baseline}")
+        return
+
+    if not args.baseline.exists():
+        print(f"No baseline at {args.baseline}, run with --update-baseline first", file=sys.stderr)
+        sys.exit(2)
+
+    ratios, regressions = compare(summary, json.loads(args.baseline.read_text()), args.tolerance)
+    for name, (ratio, tolerance) in ratios.items():
+        print(f"{name:<36}{ratio:>8.2f}x baseline, tolerance {tolerance:.2f}")
+    if ratios:
+        overall = statistics.geometric_mean([ratio for ratio, _ in ratios.values()])
+        print(f"Timings overall: {overall:.2f}x baseline")
+    for regression in regressions:
+        print(f"REGRESSION {regression}")
+    if regressions:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,61 @@
+"""Measure how long a cold start takes until the bot answers its first update.
+
+    python -m benchmarks.startup --repeat 5
+    python -m benchmarks.startup --max-seconds 3   # exit 1 when the median start is slower
+
+A direct message is queued on the fake Bot API before the bot process is spawned, so the time to the answer
+covers imports, settings, Doppler secrets, the first getUpdates and the first query.
+"""
+import argparse
+import asyncio
+import statistics
+import sys
+from time import perf_counter
+
+from benchmarks.fake_telegram import FakeTelegramServer
+from benchmarks.load import READY_TIMEOUT, start_bot, stop_bot
+
+FIRST_QUERY = "2+2*2"
+
+
+async def measure_start(port: int) -> tuple[float, float]:
+    """Return the seconds to the first getUpdates and to the answer of the first update."""
+    answered = asyncio.Event()
+    server = FakeTelegramServer(port=port, on_answer=lambda update_id, method: answered.set())
+    await server.start()
+    server.push_message(FIRST_QUERY, user_id=1)
+
+    started = perf_counter()
+    process = start_bot(port)
+    try:
+        await asyncio.wait_for(server.polling.wait(), READY_TIMEOUT)
+        polling = perf_counter() - started
+        await asyncio.wait_for(answered.wait(), READY_TIMEOUT)
+        return polling, perf_counter() - started
+    finally:
+        stop_bot(process)
+        await server.stop()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Bot time-to-first-update benchmark")
+    parser.add_argument("--repeat", type=int, default=5, help="Cold starts to measure")
+    parser.add_argument("--port", type=int, default=8081, help="Port of the fake Bot API")
+    parser.add_argument("--max-seconds", type=float, default=0, help="Fail above this median, 0 disables")
+    args = parser.parse_args()
+
+    polling_times, answer_times = [], []
+    for idx in range(args.repeat):
+        polling, answer = asyncio.run(measure_start(args.port))
+        polling_times.append(polling)
+        answer_times.append(answer)
+        print(f"Start {idx + 1}: polling after {polling:.3f}s, first answer after {answer:.3f}s")
+
+    median = statistics.median(answer_times)
+    print(f"Median: polling after {statistics.median(polling_times):.3f}s, first answer after {median:.3f}s")
+    if args.max_seconds and median > args.max_seconds:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
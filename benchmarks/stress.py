@@ -0,0 +1,87 @@
+"""Concurrency stress test for a single shared Calculator.
+
+    python -m benchmarks.stress
+
+The same corpus is solved serially by a private calculator, then concurrently through one shared calculator
+(with a small shared compiled cache to force constant evictions) from a thread pool and from asyncio tasks.
+Every concurrent outcome has to match the serial one, the script exits with 1 otherwise.
+"""
+import argparse
+import asyncio
+import sys
+from concurrent.futures import ThreadPoolExecutor
+
+from loguru import logger as log
+
+from benchmarks.corpus import generate_corpus
+from calculator_bot.libs.calculator import Calculator
+from calculator_bot.query_processor import init_compiled_cache
+
+PARENTHESES_LIMIT = 100
+RESULT_BITS_LIMIT = 1024
+
+Outcome = tuple[str, str]
+
+
+def solve(calculator: Calculator, query: str) -> Outcome:
+    try:
+        return "ok", calculator.solve_sync(query).hex()
+    except Exception as exc:  # pylint: disable=W0703
+        return "error", f"{exc.__class__.__name__}: {exc}"
+
+
+async def solve_async(calculator: Calculator, query: str) -> Outcome:
+    try:
+        return "ok", (await calculator.solve(query)).hex()
+    except Exception as exc:  # pylint: disable=W0703
+        return "error", f"{exc.__class__.__name__}: {exc}"
+
+
+async def solve_in_tasks(calculator: Calculator, queries: list[str]) -> list[Outcome]:
+    return await asyncio.gather(*(solve_async(calculator, query) for query in queries))
+
+
+def make_calculator(cache_size: int) -> Calculator:
+    return Calculator(
+        PARENTHESES_LIMIT,
+        init_compiled_cache(cache_size) if cache_size else None,
+        RESULT_BITS_LIMIT,
+        slice_operations=7,
+    )
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Shared Calculator concurrency stress test")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--size", type=int, default=200, help="Queries per corpus")
+    parser.add_argument("--threads", type=int, default=16)
+    parser.add_argument("--rounds", type=int, default=5)
+    parser.add_argument("--cache-size", type=int, default=64)
+    args = parser.parse_args()
+
+    log.remove()
+    # Switch threads as often as possible to maximize interleaving on GIL builds
+    sys.setswitchinterval(1e-6)
+    queries = [query for corpus in generate_corpus(args.seed, args.size).values() for query in corpus]
+    expected = [solve(make_calculator(0), query) for query in queries]
+
+    shared = make_calculator(args.cache_size)
+    failures = 0
+    with ThreadPoolExecutor(args.threads) as executor:
+        for round_idx in range(args.rounds):
+            threaded = list(executor.map(lambda query: solve(shared, query), queries))
+            tasks = asyncio.run(solve_in_tasks(shared, queries))
+            for query, outcome, threaded_outcome, task_outcome in zip(queries, expected, threaded, tasks):
+                if outcome != threaded_outcome or outcome != task_outcome:
+                    failures += 1
+                    print(f"MISMATCH {query!r}: {outcome} / thread {threaded_outcome} / task {task_outcome}")
+            print(f"Round {round_idx + 1}: {len(queries)} queries from {args.threads} threads and as many tasks")
+
+    if failures:
+        print(f"{failures} mismatches")
+        sys.exit(1)
+    print("All concurrent results match")
+
+
+if __name__ == "__main__":
+    main()
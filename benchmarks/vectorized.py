@@ -0,0 +1,101 @@
+"""Check that NumPy batch and sweep evaluation returns the same results as the scalar engine.
+
+    python -m benchmarks.vectorized
+
+Queries are solved one by one with `Calculator.solve_sync` and at once with `Calculator.solve_many`, sweeps are
+compared point by point with the expression solved for the value substituted. Failures must match exactly, values
+up to `RELATIVE_TOLERANCE`, as `np.power` may round the last bit differently from `pow`. The script exits with 1
+on any difference.
+"""
+import argparse
+import math
+import random
+import sys
+
+from loguru import logger as log
+
+from benchmarks.corpus import ACTIONS, NUMBERS, generate_corpus
+from calculator_bot.libs.calculator import Calculator
+from calculator_bot.libs.calculator.errors import CalcError
+
+PARENTHESES_LIMIT = 100
+RESULT_BITS_LIMIT = 1024
+EXPONENTS = ("-9", "-2", "-0.5", "0.5", "1.5", "3", "(1/3)", "0", "-1")
+SWEEP_EXPRESSIONS = ("10^(x*100)", "x^2+3*x", "1/x", "(x-1)^0.5", "2^x-x^2", "x//3*x")
+SWEEP_RANGES = ("x=0..1..0.05", "x=-3..3..0.25", "x=0..0.3..0.1", "x=1..100")
+# A few ulps of a power, amplified by the rest of the expression
+RELATIVE_TOLERANCE = 1e-12
+
+
+def solve(calculator: Calculator, query: str) -> float | None:
+    try:
+        return calculator.solve_sync(query)
+    except (CalcError, ArithmeticError, TypeError):
+        return None
+
+
+def same(value: float | None, expected: float | None) -> bool:
+    if value is None or expected is None:
+        return value is expected
+    if math.isnan(value) or math.isnan(expected):
+        return math.isnan(value) and math.isnan(expected)
+    return math.isclose(value, expected, rel_tol=RELATIVE_TOLERANCE)
+
+
+def random_power(rng: random.Random) -> str:
+    base = rng.choice((*NUMBERS, "-2", "-0.5", "0"))
+    return f"{base}^{rng.choice(EXPONENTS)}{rng.choice(ACTIONS)}{rng.choice(NUMBERS)}"
+
+
+def check_many(calculator: Calculator, queries: list[str]) -> int:
+    results = calculator.solve_many(queries)
+    mismatches = 0
+    for query, value in zip(queries, results):
+        expected = solve(calculator, query)
+        if not same(value, expected):
+            mismatches += 1
+            print(f"MISMATCH {query!r}: solve_many {value} / solve_sync {expected}")
+    return mismatches
+
+
+def check_sweeps(calculator: Calculator) -> int:
+    mismatches = 0
+    for expression in SWEEP_EXPRESSIONS:
+        for range_query in SWEEP_RANGES:
+            try:
+                sweep = calculator.solve_sweep(f"{expression};{range_query}")
+            except CalcError:
+                # Ranges whose results would exceed the cost limits are rejected as a whole
+                continue
+            for point, value, failed in zip(
+                    sweep.points.tolist(), sweep.result.values.tolist(), sweep.result.failed.tolist()
+            ):
+                expected = solve(calculator, expression.replace("x", f"({point!r})"))
+                if not same(None if failed else value, expected):
+                    mismatches += 1
+                    print(f"MISMATCH {expression!r} at x={point!r}: sweep {value} / solve_sync {expected}")
+    return mismatches
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="NumPy evaluation equivalence check")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--size", type=int, default=200, help="Queries per corpus")
+    args = parser.parse_args()
+
+    log.remove()
+    # Seeded so runs are reproducible, not used for security
+    rng = random.Random(args.seed)  # nosec B311
+    queries = [query for corpus in generate_corpus(args.seed, args.size).values() for query in corpus]
+    queries += [random_power(rng) for _ in range(args.size * 10)]
+    calculator = Calculator(PARENTHESES_LIMIT, result_bits_limit=RESULT_BITS_LIMIT)
+
+    mismatches = check_many(calculator, queries) + check_sweeps(calculator)
+    if mismatches:
+        print(f"{mismatches} mismatches")
+        sys.exit(1)
+    print(f"All {len(queries)} batch results and sweep points match the scalar engine")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,58 +1,191 @@
 import asyncio
+import os
+import signal
 import sys
+import typing as tp
+from contextlib import contextmanager
+from tempfile import TemporaryDirectory
 
-import sentry_sdk
 import uvloop
-from aiogram import Bot, Dispatcher
+from aiogram import Bot, Dispatcher, F
+from aiogram.client.telegram import PRODUCTION, TelegramAPIServer
 from aiogram.filters import Command
+from aiogram.webhook.aiohttp_server import (SimpleRequestHandler,
+                                            setup_application)
+from aiohttp import web
 from loguru import logger as log
-from prometheus_client import start_http_server
+from prometheus_client import REGISTRY, CollectorRegistry, start_http_server
 
 from calculator_bot import entrypoints
-from calculator_bot.config.settings import init_settings, Settings
+from calculator_bot.config.settings import (ApplicationSettings, Settings,
+                                            TelegramModes, TelegramSettings,
+                                            init_settings)
 from calculator_bot.libs.doppler import set_env_vars
 from calculator_bot.libs.logging import setup_logger
+from calculator_bot.libs.profiling import SlowQueryLog, start_debug_server
+from calculator_bot.libs.sentry import init_sentry
+from calculator_bot.libs.shared_cache import SharedResultCache
+from calculator_bot.libs.telegram_session import (PooledAiohttpSession,
+                                                  RequestTimingMiddleware)
+from calculator_bot.supervisor import (Supervisor, init_multiprocess_metrics,
+                                       multiprocess_registry)
+
+
+def setup_metrics(
+        metrics_port: int | None,
+        registry: CollectorRegistry = REGISTRY,
+        profiling: bool = False,
+        slow_queries: SlowQueryLog | None = None,
+) -> None:
+    if not metrics_port:
+        return
+
+    # Debug endpoints share the port, the plain prometheus server is kept when there is nothing to debug
+    if profiling or slow_queries is not None:
+        log.info(f"Starting metrics and debug server on port {metrics_port}")
+        start_debug_server("localhost", metrics_port, registry, slow_queries, profiling)
+    else:
+        log.info(f"Starting metrics server on port {metrics_port}")
+        start_http_server(addr="localhost", port=metrics_port, registry=registry)
 
 
-def setup_metrics(metrics_port: int | None) -> None:
-    if metrics_port:
-        log.info(f"Starting metrics server on port {metrics_port}")
-        start_http_server(addr="localhost", port=metrics_port)
+def worker_debug_port(settings: ApplicationSettings, worker_idx: int) -> int | None:
+    """Port of the debug endpoints of a worker, the ones after the metrics port; None without anything to debug.
+
+    The profiler and the slow query log only see the process they run in, so every worker serves its own.
+    """
+    if not settings.metrics_port or not (settings.profiling_enabled or settings.slow_query_threshold):
+        return None
+    return settings.metrics_port + 1 + worker_idx
 
 
 def setup_sentry(settings: Settings) -> None:
     if settings.sentry.dsn:
-        sentry_sdk.init(
+        init_sentry(
             dsn=settings.sentry.dsn,
             sample_rate=settings.sentry.sample_rate,
+            traces_sample_rate=settings.sentry.traces_sample_rate,
             environment=settings.application.release_stage,
             release=settings.application.version,
         )
 
-async def __main() -> bool:
-    set_env_vars(False)
-    settings = init_settings()
+
+@contextmanager
+def shared_result_cache(settings: ApplicationSettings) -> tp.Iterator[None]:
+    """Create the result table before the bot processes start, workers find it through the environment.
+
+    Without a configured path the table lives in a temporary directory. The snapshot is loaded into a new table
+    and written once the processes are stopped.
+    """
+    if not settings.shared_cache_slots:
+        yield
+        return
+
+    with TemporaryDirectory(prefix="calculator-bot-cache-") as temp_dir:
+        path = settings.shared_cache_path or os.path.join(temp_dir, "results")
+        # Outcomes computed under other limits or by another version must not be served
+        fingerprint = (
+            f"{settings.version}:{settings.parentheses_limit}:{settings.result_bits_limit}:"
+            f"{settings.operations_limit}"
+        ).encode()
+        loaded = SharedResultCache.create(
+            path, settings.shared_cache_slots, fingerprint, settings.shared_cache_snapshot
+        )
+        log.info(f"Shared result cache at {path}, {loaded} entries loaded from snapshot")
+        os.environ["CALC_SHARED_CACHE_PATH"] = settings.shared_cache_path = path
+        entrypoints.shared_cache.attach(path)
+        try:
+            yield
+        finally:
+            if settings.shared_cache_snapshot:
+                entrypoints.shared_cache.save_snapshot(settings.shared_cache_snapshot)
+                log.info(f"Saved shared result cache snapshot to {settings.shared_cache_snapshot}")
+            entrypoints.shared_cache.close()
+
+
+def create_bot(settings: TelegramSettings) -> Bot:
+    session = PooledAiohttpSession(
+        limit=settings.connection_limit,
+        keepalive_timeout=settings.keepalive_timeout,
+        api=TelegramAPIServer.from_base(settings.api_server) if settings.api_server else PRODUCTION,
+    )
+    session.middleware(RequestTimingMiddleware(entrypoints.observe_telegram_request))
+    return Bot(token=settings.bot_api_token, session=session)
+
+
+async def run_webhook(
+        bot: Bot,
+        dispatcher: Dispatcher,
+        settings: TelegramSettings,
+        reuse_port: bool = False,
+        register_webhook: bool = True,
+) -> None:
+    # Updates are handled inside the webhook request, so handler answers go back in the HTTP response.
+    # With reuse_port every worker process listens on the same port and the kernel spreads connections between them
+    app = web.Application()
+    SimpleRequestHandler(
+        dispatcher, bot, handle_in_background=False, secret_token=settings.webhook_secret or None
+    ).register(app, path=settings.webhook_path)
+    setup_application(app, dispatcher, bot=bot)
+
+    if settings.webhook_url and register_webhook:
+        await bot.set_webhook(
+            settings.webhook_url,
+            secret_token=settings.webhook_secret or None,
+            allowed_updates=dispatcher.resolve_used_update_types(),
+        )
+
+    runner = web.AppRunner(app)
+    await runner.setup()
+    try:
+        await web.TCPSite(
+            runner, host=settings.webhook_host, port=settings.webhook_port, reuse_port=reuse_port
+        ).start()
+        log.info(f"Serving webhook on {settings.webhook_host}:{settings.webhook_port}{settings.webhook_path}")
+        await asyncio.Event().wait()
+    finally:
+        await runner.cleanup()
+
+
+async def __main(settings: Settings, worker_idx: int | None = None) -> bool:
     app_settings = settings.application
 
     setup_sentry(settings)
     setup_logger(settings.logstd)
-    setup_metrics(settings.application.metrics_port)
+    if worker_idx is not None and app_settings.shared_cache_slots and app_settings.shared_cache_path:
+        entrypoints.shared_cache.attach(app_settings.shared_cache_path)
+    if worker_idx is None:
+        setup_metrics(app_settings.metrics_port, profiling=app_settings.profiling_enabled,
+                      slow_queries=entrypoints.slow_queries)
+    elif (debug_port := worker_debug_port(app_settings, worker_idx)) is not None:
+        setup_metrics(debug_port, multiprocess_registry(), app_settings.profiling_enabled, entrypoints.slow_queries)
     log.info(f"Starting calculator-bot version {app_settings.version} in {app_settings.release_stage} environment")
 
-    bot = Bot(token=settings.telegram.bot_api_token)
+    bot = create_bot(settings.telegram)
     dispatcher = Dispatcher()
+    dispatcher.startup.register(entrypoints.on_startup)
+    dispatcher.shutdown.register(entrypoints.on_shutdown)
+    # Outer middlewares run before filters, so limited updates don't even reach command matching
+    dispatcher.message.outer_middleware(entrypoints.admission_middleware)
+    dispatcher.inline_query.outer_middleware(entrypoints.admission_middleware)
 
     dispatcher.message.register(entrypoints.ping_cmd, Command("ping"))
     dispatcher.message.register(entrypoints.start_cmd, Command("start"))
     dispatcher.message.register(entrypoints.help_cmd, Command("help"))
+    dispatcher.message.register(entrypoints.document_query, F.document)
     dispatcher.message.register(entrypoints.direct_query)
     dispatcher.inline_query.register(entrypoints.inline_query)
 
-    log.info("Connecting to TG API")
     try:
-        await dispatcher.start_polling(bot)
+        if settings.telegram.mode == TelegramModes.WEBHOOK:
+            await run_webhook(
+                bot, dispatcher, settings.telegram, reuse_port=worker_idx is not None, register_webhook=not worker_idx
+            )
+        else:
+            log.info("Connecting to TG API")
+            await dispatcher.start_polling(bot)
     except Exception as exc:  # pylint: disable=W0703
-        log.exception("Polling failed", exc)
+        log.exception(f"Serving updates in {settings.telegram.mode} mode failed", exc)
         return False
     return True
 
@@ -61,9 +194,48 @@ def setup_asyncio() -> None:
     uvloop.install()
 
 
+def stop_on_sigterm() -> None:
+    # SIGTERM (the supervisor, docker stop) becomes KeyboardInterrupt, so the webhook server shuts down like on Ctrl+C
+    signal.signal(signal.SIGTERM, signal.default_int_handler)
+
+
+def run_worker(worker_idx: int) -> None:
+    stop_on_sigterm()
+    setup_asyncio()
+    try:
+        asyncio.run(__main(init_settings(), worker_idx))
+    except KeyboardInterrupt:
+        pass
+
+
+def supervise(settings: Settings) -> bool:
+    if settings.telegram.mode != TelegramModes.WEBHOOK:
+        raise RuntimeError("Multiple workers are only supported in webhook mode")
+
+    setup_logger(settings.logstd)
+    with TemporaryDirectory(prefix="calculator-bot-metrics-") as temp_dir, shared_result_cache(settings.application):
+        registry = init_multiprocess_metrics(settings.application.metrics_multiproc_dir or temp_dir)
+        setup_metrics(settings.application.metrics_port, registry)
+        debug_ports = [worker_debug_port(settings.application, idx) for idx in range(settings.application.workers)]
+        if debug_ports[0] is not None:
+            log.info(f"Debug endpoints of the workers are served on ports {debug_ports[0]}-{debug_ports[-1]}")
+        log.info(f"Starting {settings.application.workers} workers")
+        return Supervisor(settings.application.workers, run_worker).run()
+
+
 def main() -> bool:
+    set_env_vars(False)
+    settings = init_settings()
+    if settings.application.workers > 1:
+        return supervise(settings)
+
+    stop_on_sigterm()
     setup_asyncio()
-    return asyncio.run(__main())
+    with shared_result_cache(settings.application):
+        try:
+            return asyncio.run(__main(settings))
+        except KeyboardInterrupt:
+            return True
 
 
 if __name__ == "__main__":
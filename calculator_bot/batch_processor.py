@@ -0,0 +1,166 @@
+import asyncio
+import codecs
+import typing as tp
+from functools import partial
+
+from prometheus_client import Counter
+
+from calculator_bot.libs.const.messages import (BATCH_TRUNCATED_TEMPLATE,
+                                                BUSY_MESSAGE)
+from calculator_bot.query_processor import (QueryProcessor, QueryResult,
+                                            UpdateTypes)
+
+BATCH_LINES_METRIC = Counter("calc_batch_lines", "Lines of batches by how they were answered", ["event"])
+# Telegram rejects longer message texts
+MESSAGE_LIMIT = 4096
+# Sub-expression values kept per batch, the mapping starts over once it grows larger
+GROUP_VALUES_LIMIT = 65536
+
+ChunkResults = list[QueryResult]
+Schedule = tp.Callable[[tp.Callable[[], tp.Awaitable[ChunkResults]]], tp.Awaitable[ChunkResults | None]]
+
+
+class BatchLineEvents:
+    EVALUATED = "evaluated"
+    DUPLICATE = "duplicate"
+    SKIPPED = "skipped"
+    SHED = "shed"
+
+
+class BatchProcessor:
+    """Processes batches of queries, one per line, with `QueryProcessor`.
+
+    Lines are read lazily and processed in chunks of `chunk_size`, at most `concurrency` of them at once. A line
+    repeated within the batch is processed once, and parenthesised sub-expressions are computed once for the whole
+    batch (see `Calculator.run_shared`). Results come in the order of the lines; lines after the first
+    `lines_limit` (0 means unlimited) aren't read, a last error result tells about them.
+
+    With `schedule`, e.g. a work queue, every chunk is evaluated through it, so a batch holds a slot only while
+    it computes, not while its lines are read or its results sent. A chunk `schedule` drops (returns None) ends
+    the batch with an error result.
+    """
+
+    def __init__(
+            self,
+            query_processor: QueryProcessor,
+            chunk_size: int = 256,
+            concurrency: int = 4,
+            lines_limit: int = 0,
+            schedule: Schedule | None = None,
+    ) -> None:
+        self.chunk_size = max(chunk_size, 1)
+        self.concurrency = max(concurrency, 1)
+        self.lines_limit = lines_limit
+        self._query_processor = query_processor
+        self._schedule = schedule
+
+    async def process(self, lines: tp.AsyncIterable[str]) -> tp.AsyncIterator[QueryResult]:
+        results: dict[str, QueryResult] = {}
+        group_values: dict[str, float] = {}
+        truncated = False
+        async for chunk, truncated in self._read_chunks(lines):
+            pending = [query for query in dict.fromkeys(chunk) if query not in results]
+            BATCH_LINES_METRIC.labels(event=BatchLineEvents.EVALUATED).inc(len(pending))
+            BATCH_LINES_METRIC.labels(event=BatchLineEvents.DUPLICATE).inc(len(chunk) - len(pending))
+            chunk_results = await self._run_chunk(pending, group_values)
+            if chunk_results is None:
+                BATCH_LINES_METRIC.labels(event=BatchLineEvents.SHED).inc(len(pending))
+                yield QueryResult(query="", result="", message=BUSY_MESSAGE, error=True)
+                return
+
+            results.update(zip(pending, chunk_results))
+            for query in chunk:
+                yield results[query]
+
+            if len(group_values) > GROUP_VALUES_LIMIT:
+                group_values.clear()
+
+        if truncated:
+            BATCH_LINES_METRIC.labels(event=BatchLineEvents.SKIPPED).inc()
+            yield QueryResult(
+                query="",
+                result="",
+                message=BATCH_TRUNCATED_TEMPLATE.format(limit=self.lines_limit),
+                error=True,
+            )
+
+    async def _read_chunks(self, lines: tp.AsyncIterable[str]) -> tp.AsyncIterator[tuple[list[str], bool]]:
+        """Yield non-empty stripped lines in chunks, with a flag telling that lines over the limit were left."""
+        chunk: list[str] = []
+        count = 0
+        async for line in lines:
+            query = line.strip()
+            if not query:
+                continue
+            if self.lines_limit and count == self.lines_limit:
+                yield chunk, True
+                return
+
+            chunk.append(query)
+            count += 1
+            if len(chunk) == self.chunk_size:
+                yield chunk, False
+                chunk = []
+
+        if chunk:
+            yield chunk, False
+
+    async def _run_chunk(self, queries: list[str], group_values: dict[str, float]) -> ChunkResults | None:
+        if not queries:
+            return []
+        if self._schedule is None:
+            return await self._process_chunk(queries, group_values)
+        return await self._schedule(partial(self._process_chunk, queries, group_values))
+
+    async def _process_chunk(self, queries: list[str], group_values: dict[str, float]) -> ChunkResults:
+        if self.concurrency == 1:
+            return [await self._process_query(query, group_values) for query in queries]
+
+        semaphore = asyncio.Semaphore(self.concurrency)
+
+        async def process(query: str) -> QueryResult:
+            async with semaphore:
+                return await self._process_query(query, group_values)
+
+        return await asyncio.gather(*map(process, queries))
+
+    async def _process_query(self, query: str, group_values: dict[str, float]) -> QueryResult:
+        return await self._query_processor.process(query, UpdateTypes.BATCH, group_values=group_values)
+
+
+async def iter_lines(text: str) -> tp.AsyncIterator[str]:
+    for line in text.splitlines():
+        yield line
+
+
+async def decode_lines(chunks: tp.AsyncIterable[bytes], encoding: str = "utf-8") -> tp.AsyncIterator[str]:
+    """Split a stream of encoded text into lines, holding no more than a chunk and the current line."""
+    decoder = codecs.getincrementaldecoder(encoding)(errors="replace")
+    tail = ""
+    async for chunk in chunks:
+        *lines, tail = (tail + decoder.decode(chunk)).split("\n")
+        for line in lines:
+            yield line
+
+    tail += decoder.decode(b"", final=True)
+    if tail:
+        yield tail
+
+
+async def pack_messages(texts: tp.AsyncIterable[str], limit: int = MESSAGE_LIMIT) -> tp.AsyncIterator[str]:
+    """Join texts with newlines into messages of at most `limit` characters, longer texts are split."""
+    message = ""
+    async for text in texts:
+        if message and len(message) + 1 + len(text) <= limit:
+            message = f"{message}\n{text}"
+            continue
+
+        if message:
+            yield message
+        while len(text) > limit:
+            yield text[:limit]
+            text = text[limit:]
+        message = text
+
+    if message:
+        yield message
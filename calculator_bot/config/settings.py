@@ -3,44 +3,155 @@ from dataclasses import dataclass
 from calculator_bot.config.env_loader import load_setting
 
 
+class TelegramModes:
+    POLLING = "polling"
+    WEBHOOK = "webhook"
+
+
+# One field per environment variable, grouped by the prefix of their names
 @dataclass
-class ApplicationSettings:
+class ApplicationSettings:  # pylint: disable=R0902
+    admission_concurrency: int
+    admission_global_burst: float
+    admission_global_rate: float
+    admission_user_burst: float
+    admission_user_rate: float
+    admission_users: int
+    batch_chunk_size: int
+    batch_concurrency: int
+    batch_document_max_bytes: int
+    batch_lines_limit: int
+    compiled_cache_size: int
+    inline_cache_time: int
+    inline_cache_time_error: int
+    inline_cache_time_expensive: int
+    inline_debounce: float
+    inline_expensive_seconds: float
+    inline_session_max_bytes: int | None
+    inline_session_size: int
+    inline_session_ttl: float | None
+    metrics_multiproc_dir: str | None
     metrics_port: int | None
+    operations_limit: int
     parentheses_limit: int
+    process_pool_fast_path_size: int
+    process_pool_timeout: float
+    process_pool_workers: int
+    queue_concurrency: int
+    queue_direct_deadline: float
+    queue_inline_deadline: float
+    queue_size: int
+    profiling_enabled: bool
     release_stage: str
+    result_bits_limit: int
+    result_cache_max_bytes: int | None
+    result_cache_size: int
+    result_cache_ttl: float | None
+    shared_cache_path: str | None
+    shared_cache_slots: int
+    shared_cache_snapshot: str | None
+    slice_operations: int
+    slice_seconds: float
+    slow_query_log_size: int
+    slow_query_threshold: float
+    sweep_points_limit: int
     version: str
+    workers: int
 
 
 @dataclass
 class LogStdSettings:
     log_format: str
     log_level: str
+    queue_size: int
     rich_exceptions: bool
+    sample_rate: float
 
 
 @dataclass
 class TelegramSettings:
+    api_server: str
     bot_api_token: str
+    connection_limit: int
+    keepalive_timeout: float
+    mode: str
+    webhook_host: str
+    webhook_path: str
+    webhook_port: int
+    webhook_secret: str
+    webhook_url: str
 
 
 @dataclass
 class SentrySettings:
     dsn: str
     sample_rate: float
+    traces_sample_rate: float
 
 
 def init_application_settings() -> ApplicationSettings:
     return ApplicationSettings(
+        admission_concurrency=load_setting("CALC_ADMISSION_CONCURRENCY", int, 0),
+        admission_global_burst=load_setting("CALC_ADMISSION_GLOBAL_BURST", float, 1000.0),
+        admission_global_rate=load_setting("CALC_ADMISSION_GLOBAL_RATE", float, 0.0),
+        admission_user_burst=load_setting("CALC_ADMISSION_USER_BURST", float, 30.0),
+        admission_user_rate=load_setting("CALC_ADMISSION_USER_RATE", float, 0.0),
+        admission_users=load_setting("CALC_ADMISSION_USERS", int, 100000),
+        batch_chunk_size=load_setting("CALC_BATCH_CHUNK_SIZE", int, 256),
+        batch_concurrency=load_setting("CALC_BATCH_CONCURRENCY", int, 4),
+        batch_document_max_bytes=load_setting("CALC_BATCH_DOCUMENT_MAX_BYTES", int, 1024 * 1024),
+        batch_lines_limit=load_setting("CALC_BATCH_LINES_LIMIT", int, 10000),
+        compiled_cache_size=load_setting("CALC_COMPILED_CACHE_SIZE", int, 1024),
+        inline_cache_time=load_setting("CALC_INLINE_CACHE_TIME", int, 300),
+        inline_cache_time_error=load_setting("CALC_INLINE_CACHE_TIME_ERROR", int, 10),
+        inline_cache_time_expensive=load_setting("CALC_INLINE_CACHE_TIME_EXPENSIVE", int, 3600),
+        inline_debounce=load_setting("CALC_INLINE_DEBOUNCE", float, 0.0),
+        inline_expensive_seconds=load_setting("CALC_INLINE_EXPENSIVE_SECONDS", float, 0.01),
+        inline_session_max_bytes=load_setting("CALC_INLINE_SESSION_MAX_BYTES", int, 4 * 1024 * 1024),
+        inline_session_size=load_setting("CALC_INLINE_SESSION_SIZE", int, 4096),
+        inline_session_ttl=load_setting("CALC_INLINE_SESSION_TTL", float, 30.0),
+        metrics_multiproc_dir=load_setting("PROMETHEUS_MULTIPROC_DIR", str, None),
         metrics_port=load_setting("APP_METRICS_PORT", int, None),
+        operations_limit=load_setting("CALC_OPERATIONS_LIMIT", int, 0),
         parentheses_limit=load_setting("CALC_PARENTHESES_LIMIT", int, 100),
+        process_pool_fast_path_size=load_setting("CALC_PROCESS_POOL_FAST_PATH_SIZE", int, 16),
+        process_pool_timeout=load_setting("CALC_PROCESS_POOL_TIMEOUT", float, 2.0),
+        process_pool_workers=load_setting("CALC_PROCESS_POOL_WORKERS", int, 0),
+        queue_concurrency=load_setting("CALC_QUEUE_CONCURRENCY", int, 0),
+        queue_direct_deadline=load_setting("CALC_QUEUE_DIRECT_DEADLINE", float, 0.0),
+        queue_inline_deadline=load_setting("CALC_QUEUE_INLINE_DEADLINE", float, 1.0),
+        queue_size=load_setting("CALC_QUEUE_SIZE", int, 1000),
+        profiling_enabled=load_setting("APP_PROFILING_ENABLED", lambda x: bool(int(x)), 0),
         release_stage=load_setting("DOPPLER_CONFIG", str, "local"),
+        result_bits_limit=load_setting("CALC_RESULT_BITS_LIMIT", int, 1024),
+        result_cache_max_bytes=load_setting("CALC_RESULT_CACHE_MAX_BYTES", int, 16 * 1024 * 1024),
+        result_cache_size=load_setting("CALC_RESULT_CACHE_SIZE", int, 4096),
+        result_cache_ttl=load_setting("CALC_RESULT_CACHE_TTL", float, None),
+        shared_cache_path=load_setting("CALC_SHARED_CACHE_PATH", str, None),
+        shared_cache_slots=load_setting("CALC_SHARED_CACHE_SLOTS", int, 0),
+        shared_cache_snapshot=load_setting("CALC_SHARED_CACHE_SNAPSHOT", str, None),
+        slice_operations=load_setting("CALC_SLICE_OPERATIONS", int, 1000),
+        slice_seconds=load_setting("CALC_SLICE_SECONDS", float, 0.002),
+        slow_query_log_size=load_setting("CALC_SLOW_QUERY_LOG_SIZE", int, 100),
+        slow_query_threshold=load_setting("CALC_SLOW_QUERY_THRESHOLD", float, 0.0),
+        sweep_points_limit=load_setting("CALC_SWEEP_POINTS_LIMIT", int, 100000),
         version="2.0.2",
+        workers=load_setting("APP_WORKERS", int, 1),
     )
 
 
 def init_telegram_settings() -> TelegramSettings:
     return TelegramSettings(
+        api_server=load_setting("TG_API_SERVER", str, ""),
         bot_api_token=load_setting("TG_BOT_API_TOKEN"),
+        connection_limit=load_setting("TG_CONNECTION_LIMIT", int, 100),
+        keepalive_timeout=load_setting("TG_KEEPALIVE_TIMEOUT", float, 15.0),
+        mode=load_setting("TG_MODE", str, TelegramModes.POLLING),
+        webhook_host=load_setting("TG_WEBHOOK_HOST", str, "localhost"),
+        webhook_path=load_setting("TG_WEBHOOK_PATH", str, "/webhook"),
+        webhook_port=load_setting("TG_WEBHOOK_PORT", int, 8080),
+        webhook_secret=load_setting("TG_WEBHOOK_SECRET", str, ""),
+        webhook_url=load_setting("TG_WEBHOOK_URL", str, ""),
     )
 
 
@@ -48,6 +159,7 @@ def init_sentry_settings() -> SentrySettings:
     return SentrySettings(
         dsn=load_setting("SENTRY_DSN", str, ""),
         sample_rate=load_setting("SENTRY_SAMPLE_RATE", float, 1.0),
+        traces_sample_rate=load_setting("SENTRY_TRACES_SAMPLE_RATE", float, 0.0),
     )
 
 
@@ -59,7 +171,9 @@ def init_logstd_settings() -> LogStdSettings:
             str,
             "{time:YYYY-mm-dd HH:mm:ss.SSS} | pid:{process} | {level} | {message}"
         ),
+        queue_size=load_setting("LOG_QUEUE_SIZE", int, 10000),
         rich_exceptions=load_setting("LOG_RICH_EXCEPTIONS", lambda x: bool(int(x)), 0),
+        sample_rate=load_setting("LOG_SAMPLE_RATE", float, 10.0),
     )
 
 
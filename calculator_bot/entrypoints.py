@@ -1,46 +1,282 @@
-from uuid import uuid4
+import hashlib
+import typing as tp
+from functools import partial
+from time import monotonic
 
+from aiogram import Bot
+from aiogram.methods import AnswerInlineQuery, SendMessage
 from aiogram.types import (InlineQuery, InlineQueryResultArticle,
                            InputTextMessageContent, Message)
+from prometheus_client import Counter, Histogram
 
+from calculator_bot.batch_processor import (BatchProcessor, decode_lines,
+                                            iter_lines, pack_messages)
 from calculator_bot.config.settings import init_application_settings
-from calculator_bot.libs.const.messages import (HELP_MESSAGE,
+from calculator_bot.libs.admission import AdmissionMiddleware
+from calculator_bot.libs.calculator import Calculator
+from calculator_bot.libs.calculator.pool import ProcessEvaluator
+from calculator_bot.libs.coalescing import LatestOnlyCoalescer
+from calculator_bot.libs.const.messages import (BUSY_MESSAGE,
+                                                DOCUMENT_TOO_LARGE_TEMPLATE,
+                                                DOCUMENT_TYPE_MESSAGE,
+                                                HELP_MESSAGE,
                                                 META_MESSAGE_TEMPLATE,
+                                                RATE_LIMITED_MESSAGE,
                                                 WELCOME_MESSAGE)
-from calculator_bot.query_processor import QueryProcessor
+from calculator_bot.libs.profiling import SlowQueryLog
+from calculator_bot.libs.work_queue import DeadlineQueue
+from calculator_bot.query_processor import (QueryProcessor, QueryResult,
+                                            UpdateTypes, init_compiled_cache,
+                                            init_inline_sessions,
+                                            init_result_cache,
+                                            init_shared_cache)
+
+# Documents are downloaded and decoded by chunks of this size, never as a whole
+DOCUMENT_CHUNK_SIZE = 64 * 1024
+DOCUMENT_TIMEOUT = 30
+# Direct messages start before inline queries waiting in the work queue, batches come last
+QUEUE_PRIORITIES = {UpdateTypes.DIRECT: 0, UpdateTypes.INLINE: 1, UpdateTypes.BATCH: 2}
+
+RT = tp.TypeVar("RT")
+
+
+class InlineAnswerKinds:
+    VALUE = "value"
+    EXPENSIVE = "expensive"
+    ERROR = "error"
+    EMPTY = "empty"
+    TRANSIENT = "transient"
+
+
+INLINE_SKIPPED_METRIC = Counter(
+    "calc_inline_query_skipped", "Inline queries dropped because a newer query from the same user arrived"
+)
+# Telegram answers repeated inline queries from its cache, the fewer of them reach the bot the better it works
+INLINE_RECEIVED_METRIC = Counter("calc_inline_query_received", "Inline queries which reached the handler")
+INLINE_ANSWER_METRIC = Counter(
+    "calc_inline_answer", "Inline answers by the kind which decided how long Telegram may cache them", ["kind"]
+)
+TELEGRAM_REQUEST_SEC_METRIC = Histogram(
+    "calc_telegram_request_seconds",
+    "Time spent on outgoing Bot API calls, answers returned in webhook responses are not included",
+    ["method", "ok"],
+    buckets=(0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, float("inf")),
+)
 
 app_settings = init_application_settings()
+compiled_cache = init_compiled_cache(app_settings.compiled_cache_size)
+result_cache = init_result_cache(
+    app_settings.result_cache_size,
+    app_settings.result_cache_ttl,
+    app_settings.result_cache_max_bytes,
+)
+# Stays empty until the app attaches it to the table the bot processes of the host share
+shared_cache = init_shared_cache()
+inline_coalescer: LatestOnlyCoalescer[int] = LatestOnlyCoalescer(
+    app_settings.inline_debounce, on_skip=INLINE_SKIPPED_METRIC.inc
+)
+slow_queries = (
+    SlowQueryLog(app_settings.slow_query_log_size, app_settings.slow_query_threshold)
+    if app_settings.slow_query_threshold else None
+)
+work_queue = (
+    DeadlineQueue(app_settings.queue_concurrency, app_settings.queue_size)
+    if app_settings.queue_concurrency else None
+)
+# Seconds an update may wait for its evaluation, a later answer isn't worth computing
+queue_deadlines = {
+    UpdateTypes.DIRECT: app_settings.queue_direct_deadline,
+    UpdateTypes.INLINE: app_settings.queue_inline_deadline,
+}
+# Seconds Telegram may serve an inline answer from its cache. Timeouts and failures may pass on retry, so they
+# are never cached
+inline_cache_times = {
+    InlineAnswerKinds.VALUE: app_settings.inline_cache_time,
+    InlineAnswerKinds.EXPENSIVE: app_settings.inline_cache_time_expensive,
+    InlineAnswerKinds.ERROR: app_settings.inline_cache_time_error,
+    InlineAnswerKinds.EMPTY: app_settings.inline_cache_time_error,
+    InlineAnswerKinds.TRANSIENT: 0,
+}
+process_evaluator = (
+    ProcessEvaluator(app_settings.process_pool_workers, app_settings.process_pool_timeout)
+    if app_settings.process_pool_workers else None
+)
+admission_middleware = AdmissionMiddleware(
+    user_rate=app_settings.admission_user_rate,
+    user_burst=app_settings.admission_user_burst,
+    global_rate=app_settings.admission_global_rate,
+    global_burst=app_settings.admission_global_burst,
+    concurrency=app_settings.admission_concurrency,
+    maxsize=app_settings.admission_users,
+    reject_message=RATE_LIMITED_MESSAGE,
+)
+
+query_processor = QueryProcessor(
+    app_settings.parentheses_limit,
+    compiled_cache=compiled_cache,
+    result_cache=result_cache,
+    process_evaluator=process_evaluator,
+    fast_path_size=app_settings.process_pool_fast_path_size,
+    result_bits_limit=app_settings.result_bits_limit,
+    operations_limit=app_settings.operations_limit,
+    sweep_points_limit=app_settings.sweep_points_limit,
+    sweep_timeout=app_settings.process_pool_timeout,
+    slice_operations=app_settings.slice_operations,
+    slice_seconds=app_settings.slice_seconds,
+    inline_sessions=init_inline_sessions(
+        app_settings.inline_session_size, app_settings.inline_session_ttl, app_settings.inline_session_max_bytes
+    ) if app_settings.inline_session_size else None,
+    slow_queries=slow_queries,
+    shared_cache=shared_cache,
+)
+batch_processor = BatchProcessor(
+    query_processor,
+    app_settings.batch_chunk_size,
+    app_settings.batch_concurrency,
+    app_settings.batch_lines_limit,
+    # Chunks wait in the queue one by one, so direct messages get ahead of large batches between their chunks
+    schedule=lambda fn: queued(UpdateTypes.BATCH, fn),
+)
+
+
+def observe_telegram_request(method: str, seconds: float, ok: bool) -> None:
+    TELEGRAM_REQUEST_SEC_METRIC.labels(method=method, ok=ok).observe(seconds)
+
+
+async def queued(
+        update_type: str,
+        fn: tp.Callable[[], tp.Awaitable[RT]],
+        received: float | None = None,
+) -> RT | None:
+    """Run `fn` through the work queue, None means it was shed. The deadline counts from `received`, or from now."""
+    if work_queue is None:
+        return await fn()
+
+    timeout = queue_deadlines.get(update_type)
+    deadline = (received or monotonic()) + timeout if timeout else None
+    return await work_queue.run(fn, update_type, QUEUE_PRIORITIES[update_type], deadline)
+
+
+async def on_startup() -> None:
+    if process_evaluator is not None:
+        await process_evaluator.start()
+
+
+async def on_shutdown() -> None:
+    if process_evaluator is not None:
+        process_evaluator.shutdown()
 
 
-async def ping_cmd(message: Message) -> None:
+# Handlers return the answer method instead of calling it: in webhook mode it is sent back in the webhook
+# response, saving a request to the Bot API, and in polling mode the dispatcher calls it
+async def ping_cmd(message: Message) -> SendMessage:
     meta_msg = META_MESSAGE_TEMPLATE.format(version=app_settings.version)
     response = f"{WELCOME_MESSAGE}\n\n{meta_msg}"
-    await message.answer(response)
+    return message.answer(response)
 
 
-async def start_cmd(message: Message) -> None:
+async def start_cmd(message: Message) -> SendMessage:
     meta_msg = META_MESSAGE_TEMPLATE.format(version=app_settings.version)
     response = f"{WELCOME_MESSAGE}\n\n{HELP_MESSAGE}\n\n{meta_msg}"
-    await message.answer(response)
+    return message.answer(response)
 
 
-async def help_cmd(message: Message) -> None:
+async def help_cmd(message: Message) -> SendMessage:
     meta_msg = META_MESSAGE_TEMPLATE.format(version=app_settings.version)
     response = f"{HELP_MESSAGE}\n---\n{meta_msg}"
-    await message.answer(response)
+    return message.answer(response)
 
 
-async def direct_query(message: Message) -> None:
-    query_result = await QueryProcessor(app_settings.parentheses_limit).process(message.text)
-    await message.reply(query_result.message)
+async def direct_query(message: Message) -> SendMessage:
+    text = message.text or ""
+    if "\n" in text.strip():
+        return await answer_batch(message, iter_lines(text))
 
+    query_result = await queued(UpdateTypes.DIRECT, partial(query_processor.process, text, UpdateTypes.DIRECT))
+    if query_result is None:
+        return message.reply(BUSY_MESSAGE)
+    return message.reply(query_result.message)
 
-async def inline_query(query: InlineQuery) -> None:
-    query_result = await QueryProcessor(app_settings.parentheses_limit).process(query.query)
 
+async def document_query(message: Message, bot: Bot) -> SendMessage:
+    document = message.document
+    if document is None or not (document.mime_type or "").startswith("text/"):
+        return message.reply(DOCUMENT_TYPE_MESSAGE)
+    if document.file_size and document.file_size > app_settings.batch_document_max_bytes:
+        return message.reply(DOCUMENT_TOO_LARGE_TEMPLATE.format(limit=app_settings.batch_document_max_bytes // 1024))
+
+    file = await bot.get_file(document.file_id)
+    if file.file_path is None:
+        # The Bot API gives no path to files it can't download, which are larger than our limit anyway
+        return message.reply(DOCUMENT_TOO_LARGE_TEMPLATE.format(limit=app_settings.batch_document_max_bytes // 1024))
+    return await answer_batch(message, decode_lines(read_document(bot, file.file_path)))
+
+
+async def answer_batch(message: Message, lines: tp.AsyncIterable[str]) -> SendMessage:
+    # Full messages are sent as soon as they are ready, the last one is returned like any other answer
+    texts = (query_result.message async for query_result in batch_processor.process(lines))
+    answer: SendMessage | None = None
+    async for text in pack_messages(texts):
+        if answer is not None:
+            await answer
+        answer = message.reply(text)
+    return answer or message.reply(DOCUMENT_TYPE_MESSAGE)
+
+
+async def read_document(bot: Bot, file_path: str) -> tp.AsyncIterator[bytes]:
+    api = bot.session.api
+    if api.is_local:
+        with open(api.wrap_local_file.to_local(file_path), "rb") as document:
+            while chunk := document.read(DOCUMENT_CHUNK_SIZE):
+                yield chunk
+        return
+
+    async for chunk in bot.session.stream_content(
+            api.file_url(bot.token, file_path), timeout=DOCUMENT_TIMEOUT, chunk_size=DOCUMENT_CHUNK_SIZE
+    ):
+        yield chunk
+
+
+async def inline_query(query: InlineQuery) -> AnswerInlineQuery | None:
+    INLINE_RECEIVED_METRIC.inc()
+    # Telegram sends a query per keystroke, only the latest one from a user is worth answering
+    return await inline_coalescer.run(query.from_user.id, partial(answer_inline_query, query, monotonic()))
+
+
+async def answer_inline_query(query: InlineQuery, received: float | None = None) -> AnswerInlineQuery | None:
+    query_result = await queued(
+        UpdateTypes.INLINE,
+        partial(query_processor.process, query.query, UpdateTypes.INLINE, query.from_user.id),
+        received,
+    )
+    if query_result is None:
+        # Too late to be of use, the user has typed on since
+        return None
+
+    kind = inline_answer_kind(query_result)
+    INLINE_ANSWER_METRIC.labels(kind=kind).inc()
     result = InlineQueryResultArticle(
-        id=uuid4().hex,
+        id=inline_result_id(query_result),
         title=query_result.result,
         input_message_content=InputTextMessageContent(message_text=query_result.message),
     )
-    await query.answer(results=[result], cache_time=0)
+    # Answers don't depend on the user, so Telegram may serve one to everybody sending the same query
+    return query.answer(results=[result], cache_time=inline_cache_times[kind], is_personal=False)
+
+
+def inline_answer_kind(query_result: QueryResult) -> str:
+    if not query_result.query:
+        return InlineAnswerKinds.EMPTY
+    if not query_result.cacheable:
+        return InlineAnswerKinds.TRANSIENT
+    if query_result.error:
+        return InlineAnswerKinds.ERROR
+    if query_result.seconds >= app_settings.inline_expensive_seconds:
+        return InlineAnswerKinds.EXPENSIVE
+    return InlineAnswerKinds.VALUE
+
+
+def inline_result_id(query_result: QueryResult) -> str:
+    """Same id for the same outcome of a query however it's spelled, within the 64 bytes Telegram allows."""
+    key = f"{Calculator.sanitize(query_result.query)}\n{query_result.result}"
+    return hashlib.blake2b(key.encode(), digest_size=16).hexdigest()
@@ -0,0 +1,121 @@
+import typing as tp
+from collections import OrderedDict
+from time import monotonic
+
+from aiogram import BaseMiddleware
+from aiogram.types import InlineQuery, Message, TelegramObject, User
+from prometheus_client import Counter
+
+KT = tp.TypeVar("KT")
+
+ADMISSION_REJECTED_METRIC = Counter(
+    "calc_admission_rejected", "Updates rejected by rate limits before reaching handlers", ["update_type", "reason"]
+)
+
+
+class RejectReasons:
+    CONCURRENCY = "concurrency"
+    GLOBAL_RATE = "global_rate"
+    USER_RATE = "user_rate"
+
+
+class TokenBuckets(tp.Generic[KT]):
+    """Token buckets refilled with `rate` tokens a second and holding up to `burst` tokens, one per key.
+
+    At most `maxsize` buckets are kept, the least recently used one is dropped first; a dropped key starts over
+    with a full bucket, which only an idle key can get. A rate of 0 lets everything through.
+    """
+
+    def __init__(self, rate: float, burst: float, maxsize: int = 1) -> None:
+        self.rate = rate
+        self.burst = max(burst, 1)
+        self.maxsize = maxsize
+        self._buckets: OrderedDict[KT, tuple[float, float]] = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._buckets)
+
+    def allow(self, key: KT) -> bool:
+        if not self.rate:
+            return True
+
+        now = monotonic()
+        tokens, updated = self._buckets.pop(key, (self.burst, now))
+        tokens = min(self.burst, tokens + (now - updated) * self.rate)
+        allowed = tokens >= 1
+        self._buckets[key] = (tokens - 1 if allowed else tokens, now)
+        if len(self._buckets) > self.maxsize:
+            self._buckets.popitem(last=False)
+        return allowed
+
+
+class AdmissionMiddleware(BaseMiddleware):
+    """Outer middleware admitting messages and inline queries before any handler runs.
+
+    A user gets `user_rate` updates a second with bursts of `user_burst`, everyone together `global_rate` with
+    bursts of `global_burst`, and a user can't have more than `concurrency` messages in handlers at once. Inline
+    queries aren't capped: a newer one supersedes the running one (see `LatestOnlyCoalescer`), so the cap would
+    reject the one query worth answering.
+    Rejected inline queries are dropped quietly; rejected messages are answered with `reject_message`, at most once
+    per `notice_interval` seconds per user so a flood doesn't turn into a flood of answers.
+    Rejections are counted by update type and `RejectReasons`. Rates and concurrency of 0 disable their checks.
+    """
+
+    def __init__(
+            self,
+            user_rate: float,
+            user_burst: float,
+            global_rate: float = 0,
+            global_burst: float = 1,
+            concurrency: int = 0,
+            maxsize: int = 100000,
+            reject_message: str = "",
+            notice_interval: float = 10.0,
+    ) -> None:
+        self.concurrency = concurrency
+        self.reject_message = reject_message
+        self._user_buckets: TokenBuckets[int] = TokenBuckets(user_rate, user_burst, maxsize)
+        self._global_bucket: TokenBuckets[None] = TokenBuckets(global_rate, global_burst)
+        self._notices: TokenBuckets[int] = TokenBuckets(1 / notice_interval if notice_interval else 0, 1, maxsize)
+        # Entries are removed once a user has nothing in handlers, so there are no more than running messages
+        self._running: dict[int, int] = {}
+
+    async def __call__(
+            self,
+            handler: tp.Callable[[TelegramObject, dict[str, tp.Any]], tp.Awaitable[tp.Any]],
+            event: TelegramObject,
+            data: dict[str, tp.Any],
+    ) -> tp.Any:
+        user: User | None = data.get("event_from_user")
+        if user is None:
+            return await handler(event, data)
+
+        reason = self._check(event, user.id)
+        if reason is not None:
+            return self._reject(event, user.id, reason)
+        if not isinstance(event, Message):
+            return await handler(event, data)
+
+        self._running[user.id] = self._running.get(user.id, 0) + 1
+        try:
+            return await handler(event, data)
+        finally:
+            running = self._running.pop(user.id) - 1
+            if running:
+                self._running[user.id] = running
+
+    def _check(self, event: TelegramObject, user_id: int) -> str | None:
+        if self.concurrency and isinstance(event, Message) and self._running.get(user_id, 0) >= self.concurrency:
+            return RejectReasons.CONCURRENCY
+        if not self._user_buckets.allow(user_id):
+            return RejectReasons.USER_RATE
+        if not self._global_bucket.allow(None):
+            return RejectReasons.GLOBAL_RATE
+        return None
+
+    def _reject(self, event: TelegramObject, user_id: int, reason: str) -> tp.Any:
+        update_type = "inline" if isinstance(event, InlineQuery) else "direct"
+        ADMISSION_REJECTED_METRIC.labels(update_type=update_type, reason=reason).inc()
+        if isinstance(event, Message) and self.reject_message and self._notices.allow(user_id):
+            return event.reply(self.reject_message)
+        return None
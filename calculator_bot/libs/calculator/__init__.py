@@ -1,7 +1,14 @@
 from calculator_bot.libs.calculator.calculator import Calculator
 from calculator_bot.libs.calculator.errors import IncorrectQueryError
+from calculator_bot.libs.calculator.models import (CalcContext,
+                                                   CompiledExpression,
+                                                   ExpressionCost, ParseState)
 
 __all__ = (
+    "CalcContext",
     "Calculator",
+    "CompiledExpression",
+    "ExpressionCost",
     "IncorrectQueryError",
+    "ParseState",
 )
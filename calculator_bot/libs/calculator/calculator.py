@@ -1,175 +1,225 @@
+import typing as tp
 from asyncio import sleep
+from time import perf_counter
 
 from calculator_bot.libs.calculator import errors
-from calculator_bot.libs.calculator.const import (CALC_DIGIT_SYMBOLS,
-                                                  CalcActions)
-from calculator_bot.libs.calculator.models import (CalcQueryAction,
-                                                   CalcQueryDigit)
+from calculator_bot.libs.calculator.compiler import compile_query
+from calculator_bot.libs.calculator.const import CalcStages
+from calculator_bot.libs.calculator.incremental import (TEXT_LIMIT, advance,
+                                                        compile_from)
+from calculator_bot.libs.calculator.interpreter import run_program, run_shared
+from calculator_bot.libs.calculator.models import (CalcContext,
+                                                   CompiledExpression,
+                                                   ExpressionCost, ParseState)
+from calculator_bot.libs.lru import LRUCache
+
+if tp.TYPE_CHECKING:
+    from calculator_bot.libs.calculator.sweep import SweepQuery, SweepResult
 
 
 class Calculator:
-    def __init__(self, parentheses_limit: int = 0) -> None:
-        self.query = self.query_origin = None
+    """Stateless engine: per-call state lives in `CalcContext`, so a single instance may be shared between tasks
+    and threads. Thread safety of a shared `cache` is up to the cache, `LRUCache` locks itself.
+    """
+    run_program = staticmethod(run_program)
+    run_shared = staticmethod(run_shared)
+
+    def __init__(
+            self,
+            parentheses_limit: int = 0,
+            cache: LRUCache[str, CompiledExpression] | None = None,
+            result_bits_limit: int = 0,
+            operations_limit: int = 0,
+            slice_operations: int = 0,
+            slice_seconds: float = 0,
+            on_slice: tp.Callable[[float], None] | None = None,
+    ) -> None:
         self.parentheses_limit = parentheses_limit
+        self.cache = cache
+        self.result_bits_limit = result_bits_limit
+        self.operations_limit = operations_limit
+        self.slice_operations = slice_operations
+        self.slice_seconds = slice_seconds
+        self.on_slice = on_slice
 
     async def solve(self, query: str) -> float:
-        self.query_origin = query
-        self.query = self._sanitize(query)
-        self._validate_query(self.query)
-
-        await self.solve_groups()
-        return float(self.query)
-
-    async def solve_groups(self, start: int | None = None) -> int | None:
-        query_start = cursor = start or 0
-        query_len = len(self.query)
-        await sleep(0)
-        while cursor < query_len:
-
-            if self.query[cursor] == "(":
-                cursor = await self.solve_groups(cursor + 1)
-                query_len = len(self.query)
-                continue
-
-            if self.query[cursor] == ")":
-                group_result = str(
-                    await self.solve_group(self.query[query_start:cursor])
-                )
-                self.query = (
-                    self.query[: query_start - 1]
-                    + group_result
-                    + self.query[cursor + 1:]
-                )
-                return query_start + len(group_result) - 1
-
-            cursor += 1
-
-        self.query = (
-                self.query[: query_start]
-                + str(await self.solve_group(self.query[query_start:cursor]))
-                + self.query[cursor:]
-        )
-        return cursor
-
-    async def solve_group(self, query: str) -> CalcQueryDigit:  # pylint: disable=R0912  # noqa: C901
-        digits = []
-        actions = []
-        action = digit = ""
-        element_start = None
-        query_len = len(query)
-
-        await sleep(0)
-        for idx in range(query_len):
-            current_element = query[idx]
-            next_element = "" if idx == query_len - 1 else query[idx + 1]
-            if not any((digit, action)):
-                element_start = idx
-
-            if self.is_action(current_element):
-                if (idx == 0 or action) and current_element == "-" and next_element.isdigit():
-
-                    if action:
-                        complete_action = self.store_action(
-                            action, next_element, element_start, idx - 1
-                        )
-                        if complete_action:
-                            actions.append(complete_action)
-                            action = ""
-
-                    element_start = idx
-                    digit += current_element
-                else:
-                    action += current_element
-
-            elif self.is_digit(current_element):
-                if all((current_element == '.', '.' in digit)):
-                    raise errors.UnknownQueryElementError("Number cannot contain more than one point")
-                digit += current_element
-
-            else:
-                raise errors.UnknownQueryElementError(f"Cannot parse symbol '{current_element}' at position {idx}")
-
-            if action:
-                complete_action = self.store_action(action, next_element, element_start, idx)
-                if complete_action:
-                    actions.append(complete_action)
-                    action = ""
-
-            elif digit and not self.is_digit(next_element):
-                digits.append(CalcQueryDigit(digit, element_start, idx))
-                digit = ""
-
-        if len(actions) != len(digits) - 1:
-            raise errors.IncorrectQueryError(
-                f"Incorrect amount of digits and actions. Actions: {len(actions)}, digits: {len(digits)}"
-            )
-
-        return await self.solve_group_query(digits, actions)
-
-    @classmethod
-    async def solve_group_query(cls, digits: list[CalcQueryDigit], actions: list[CalcQueryAction]) -> CalcQueryDigit:
-        for action in sorted(actions, reverse=True):
-            used_digits = []
-            used_digits_num = 0
+        return await self.evaluate(self.prepare(query))
+
+    def solve_sync(self, query: str) -> float:
+        return self.evaluate_sync(self.prepare(query))
+
+    def prepare(self, query: str, context: CalcContext | None = None) -> CompiledExpression:
+        """Sanitize and compile a query, filling `context` when the caller wants to inspect the call."""
+        if context is None:
+            context = CalcContext(query_origin=query)
+        started = perf_counter()
+        context.query = self.sanitize(query)
+        context.record(CalcStages.SANITIZE, started)
+        if context.parse_state is None:
+            context.expression = self.compile(context.query, context=context)
+        else:
+            context.expression = self._compile_incremental(context.query, context)
+        return context.expression
+
+    def solve_many(self, queries: tp.Iterable[str]) -> list[float | None]:
+        """Solve a batch of queries with NumPy, None marks queries which are incorrect or fail to evaluate."""
+        # NumPy is imported on first use, plain queries never need it
+        from calculator_bot.libs.calculator.vectorized import \
+            solve_many  # pylint: disable=C0415
+        return solve_many(self, queries)
+
+    def solve_sweep(self, query: str, points_limit: int = 0) -> "SweepResult":
+        """Solve `expression; x=start..stop[..step]` for every value of `x` with NumPy."""
+        return self.evaluate_sweep(self.prepare_sweep(query, points_limit))
+
+    def prepare_sweep(self, query: str, points_limit: int = 0) -> "SweepQuery":
+        """Sanitize and compile a sweep query, its operations count once per value of the variable."""
+        from calculator_bot.libs.calculator.sweep import \
+            prepare_sweep  # pylint: disable=C0415
+
+        return prepare_sweep(self, self.sanitize(query), points_limit)
 
-            for idx, digit in enumerate(digits):
-                if any((digit.end + 1 == action.start, digit.start - 1 == action.end)):
-                    used_digits.append(idx)
-                    used_digits_num += 1
-
-                if used_digits_num == 2:
-                    break
-
-            result = cls.solve_single_query([digits[x] for x in used_digits], action)
-            digits[used_digits[0]] = result
-            digits.pop(used_digits[-1])
-
-            # This is a workaround for asyncio.sleep(0) to allow other tasks to run
-            await sleep(0)
+    @staticmethod
+    def evaluate_sweep(sweep: "SweepQuery", deadline: float | None = None) -> "SweepResult":
+        """Evaluate a prepared sweep, stopping past the `time.monotonic` `deadline`; picklable for worker processes."""
+        from calculator_bot.libs.calculator.sweep import \
+            evaluate_sweep  # pylint: disable=C0415
 
-        return digits[0]
+        return evaluate_sweep(sweep, deadline)
 
     @staticmethod
-    def solve_single_query(digits: list[CalcQueryDigit], action: CalcQueryAction) -> CalcQueryDigit:
-        return CalcQueryDigit(action.callback(*digits), start=digits[0].start, end=digits[-1].end)
+    def sanitize(query: str) -> str:
+        return query.replace(",", ".").replace(" ", "").replace("**", "^")
 
-    @classmethod
-    def store_action(cls, element, next_element, start, end) -> CalcQueryAction | None:
-        if not cls.is_action(next_element):
+    def compile(
+            self,
+            query: str,
+            variables: tp.Mapping[str, tuple[float, float]] | None = None,
+            context: CalcContext | None = None,
+    ) -> CompiledExpression:
+        """Compile a sanitized query, reusing the cached expression when there is one.
+
+        The cache must only be shared between calculators with the same `parentheses_limit`. Queries with
+        `variables` (names mapped to the range of their values) are never cached.
+        """
+        if variables:
+            expression = self._compile(query, variables, context)
+        elif self.cache is None:
+            expression = self._compile(query, context=context)
+        else:
+            expression = self.cache.get_or_set(query, lambda: self._compile(query, context=context))
+
+        started = perf_counter()
+        self.validate_cost(expression.cost)
+        if context is not None:
+            context.record(CalcStages.VALIDATE, started)
+        return expression
+
+    async def evaluate(
+            self,
+            expression: CompiledExpression,
+            variables: tp.Mapping[str, float] | None = None,
+            group_values: dict[str, float] | None = None,
+    ) -> float:
+        """Execute the program, yielding to the event loop once a slice uses up its budget.
+
+        A slice ends after `slice_operations` actions or `slice_seconds` of work, whichever comes first (0 disables
+        a limit), so a query which fits into one budget runs without a single event loop round trip. The duration
+        of every slice is reported to `on_slice`. With `group_values` the program runs with `run_shared`.
+        """
+        if group_values is None:
+            steps = self.run_program(expression, variables)
+        else:
+            steps = self.run_shared(expression, group_values)
+        operations = 0
+        slice_started = perf_counter()
+        while True:
             try:
-                return CalcQueryAction(element, start, end, CalcActions.PRIORITY_MAPPING.value[element])
-            except KeyError:
-                raise errors.UnknownQueryElementError(f"Unknown action symbol: {element}")
+                next(steps)
+            except StopIteration as stop:
+                self._end_slice(slice_started)
+                return stop.value
+
+            operations += 1
+            if (
+                (self.slice_operations and operations >= self.slice_operations)
+                or (self.slice_seconds and perf_counter() - slice_started >= self.slice_seconds)
+            ):
+                self._end_slice(slice_started)
+                await sleep(0)
+                operations = 0
+                slice_started = perf_counter()
 
-        return None
-
-    @staticmethod
-    def is_action(value: str) -> bool:
-        if value in CalcActions.SYMBOLS_LIST.value:
-            return True
-        return False
-
-    @staticmethod
-    def is_digit(value: str | None) -> bool:
-        if value in CALC_DIGIT_SYMBOLS:
-            return True
-        return False
+    @classmethod
+    def evaluate_sync(cls, expression: CompiledExpression, variables: tp.Mapping[str, float] | None = None) -> float:
+        steps = cls.run_program(expression, variables)
+        while True:
+            try:
+                next(steps)
+            except StopIteration as stop:
+                return stop.value
+
+    def _end_slice(self, slice_started: float) -> None:
+        if self.on_slice is not None:
+            self.on_slice(perf_counter() - slice_started)
+
+    def _compile(
+            self,
+            query: str,
+            variables: tp.Mapping[str, tuple[float, float]] | None = None,
+            context: CalcContext | None = None,
+    ) -> CompiledExpression:
+        started = perf_counter()
+        self._validate_query(query)
+        if context is not None:
+            started = context.record(CalcStages.VALIDATE, started)
+
+        expression = compile_query(query, variables)
+        if context is not None:
+            context.record(CalcStages.PARSE, started)
+        return expression
+
+    def _compile_incremental(self, query: str, context: CalcContext) -> CompiledExpression:
+        """Compile a query continuing `context.parse_state`, leaving the furthest state reached in the context."""
+        state = context.parse_state
+        if state is None or not query.startswith(state.prefix):
+            state = ParseState()
+        if len(query) - state.cursor > TEXT_LIMIT:
+            return self.compile(query, context=context)
+
+        # Parentheses are only balanced once the query is complete, so the state moves on before they are checked
+        started = perf_counter()
+        context.parse_state = state = advance(state, query)
+        started = context.record(CalcStages.PARSE, started)
+        self._validate_query(query, state)
+        started = context.record(CalcStages.VALIDATE, started)
+
+        expression = compile_from(state, query)
+        started = context.record(CalcStages.PARSE, started)
+        self.validate_cost(expression.cost)
+        context.record(CalcStages.VALIDATE, started)
+        return expression
+
+    def validate_cost(self, cost: ExpressionCost) -> None:
+        if self.operations_limit and cost.operations > self.operations_limit:
+            raise errors.QueryCostExceededError(f"Max amount of operations exceeded: {self.operations_limit}", cost)
+        if self.result_bits_limit and cost.result_bits > self.result_bits_limit:
+            raise errors.QueryCostExceededError(
+                f"Estimated result size of {cost.result_bits:.0f} bits exceeds {self.result_bits_limit}", cost
+            )
 
-    @staticmethod
-    def _sanitize(query: str) -> str:
-        return query.replace(",", ".").replace(" ", "").replace("**", "^")
+    def _validate_query(self, query: str, state: ParseState | None = None) -> None:
+        open_parentheses = close_parentheses = start = 0
+        if state is not None:
+            # Parentheses before the state's cursor are already counted by the state
+            open_parentheses, close_parentheses, start = state.open_parentheses, state.close_parentheses, state.cursor
 
-    def _validate_query(self, query: str) -> None:
-        open_parentheses = close_parentheses = 0
-        for symbol in query:
-            if symbol == "(":
-                open_parentheses += 1
-                if self.parentheses_limit and open_parentheses > self.parentheses_limit:
-                    raise errors.IncorrectQueryError(
-                        f"Max amount of parentheses exceeded: {self.parentheses_limit}"
-                    )
-            elif symbol == ")":
-                close_parentheses += 1
+        open_parentheses += query.count("(", start)
+        close_parentheses += query.count(")", start)
+        if self.parentheses_limit and open_parentheses > self.parentheses_limit:
+            raise errors.IncorrectQueryError(
+                f"Max amount of parentheses exceeded: {self.parentheses_limit}"
+            )
 
         if open_parentheses != close_parentheses:
             raise errors.IncorrectQueryError(
@@ -0,0 +1,186 @@
+import typing as tp
+from array import array
+
+from calculator_bot.libs.calculator import errors
+from calculator_bot.libs.calculator.const import (OPCODE_ACTION, OPCODE_NEGATE,
+                                                  OPCODE_NUMBER,
+                                                  OPCODE_VARIABLE, CalcSymbols)
+from calculator_bot.libs.calculator.cost import CostEstimator
+from calculator_bot.libs.calculator.lexer import tokenize
+from calculator_bot.libs.calculator.models import (CalcToken,
+                                                   CompiledExpression,
+                                                   CompilerState, ParseState,
+                                                   Program)
+
+GROUP_OPEN = CalcSymbols.GROUP_OPEN
+GROUP_CLOSE = CalcSymbols.GROUP_CLOSE
+ACTION = CalcSymbols.ACTION
+VARIABLE = CalcSymbols.VARIABLE
+
+
+# One attribute per program column next to the state of the open group, `feed` runs once per token
+class ExpressionCompiler:  # pylint: disable=R0902
+    """Shunting-yard compiler turning a token stream into a postfix program.
+
+    Actions wait on a per-group stack until an action of the same or lower priority arrives, so equal priorities
+    keep their left-to-right order. A negated group or variable is followed by a negation instruction.
+    """
+
+    def __init__(self, variables: tp.Collection[str] = ()) -> None:
+        self.variables = tuple(variables)
+        self.kinds: "array[int]" = array("b")
+        self.values: "array[float]" = array("d")
+        self.operators: "array[int]" = array("h")
+        self.starts: "array[int]" = array("i")
+        self.ends: "array[int]" = array("i")
+        self.groups: list[tuple[CalcToken | None, list[CalcToken], int, int]] = []
+        self.group: CalcToken | None = None
+        self.pending_actions: list[CalcToken] = []
+        self.digits = self.actions = 0
+        self.depth = 0
+        # First instruction of every open group and the spans of the closed ones, see `Program.groups`
+        self.group_firsts: list[int] = []
+        self.group_spans: "array[int]" = array("i")
+        self.estimator = CostEstimator()
+        # Instructions at the start of the program already accounted for by `estimator`
+        self.resumed_size = 0
+
+    @classmethod
+    def resume(cls, state: ParseState) -> "ExpressionCompiler":
+        """Continue compiling from a saved state, its evaluated operands become the first instructions."""
+        compiler = cls()
+        saved = state.compiler
+        compiler.groups = [(group, list(pending), digits, actions) for group, pending, digits, actions in saved.groups]
+        compiler.group = saved.group
+        compiler.pending_actions = list(saved.pending_actions)
+        compiler.digits, compiler.actions, compiler.depth = saved.digits, saved.actions, saved.depth
+        # Groups opened before the state have their instructions evaluated already, they get no span
+        compiler.group_firsts = [-1] * len(compiler.groups)
+
+        size = len(state.operands)
+        compiler.kinds.extend([OPCODE_NUMBER] * size)
+        compiler.values.extend(state.operands)
+        compiler.operators.extend([-1] * size)
+        compiler.starts.extend([0] * size)
+        compiler.ends.extend([0] * size)
+        compiler.estimator = CostEstimator(state.cost_operands, state.operations, state.result_bits)
+        compiler.resumed_size = size
+        return compiler
+
+    def save(self) -> CompilerState:
+        return CompilerState(
+            groups=tuple(
+                (group, tuple(pending), digits, actions) for group, pending, digits, actions in self.groups
+            ),
+            group=self.group,
+            pending_actions=tuple(self.pending_actions),
+            digits=self.digits,
+            actions=self.actions,
+            depth=self.depth,
+        )
+
+    def feed(self, token: CalcToken) -> None:
+        kind = token.kind
+        if kind is ACTION:
+            self._push_action(token)
+
+        elif kind is GROUP_OPEN:
+            self._expect_digit(token)
+            self.groups.append((self.group, self.pending_actions, self.digits, self.actions))
+            self.group_firsts.append(len(self.kinds))
+            self.depth = max(self.depth, len(self.groups))
+            self.group, self.pending_actions, self.digits, self.actions = token, [], 0, 0
+
+        elif kind is GROUP_CLOSE:
+            self._close_group(token)
+
+        elif kind is VARIABLE:
+            self._expect_digit(token)
+            self._emit(token, OPCODE_VARIABLE, self.variables.index(token.name))
+            if token.negative:
+                self._emit(token, OPCODE_NEGATE)
+            self.digits += 1
+
+        else:
+            self._expect_digit(token)
+            self._emit(token, OPCODE_NUMBER)
+            self.digits += 1
+
+    def finish(
+            self,
+            query: str,
+            variables: tp.Mapping[str, tuple[float, float]] | None = None,
+    ) -> CompiledExpression:
+        if self.group is not None:
+            raise errors.IncorrectQueryError("Amount of open parentheses doesn't match closing ones")
+
+        self._flush_group()
+        program = self.program()
+        self.estimator.feed(program, variables, self.resumed_size)
+        return CompiledExpression(query=query, program=program, cost=self.estimator.cost(), depth=self.depth)
+
+    def program(self) -> Program:
+        return Program(
+            kinds=self.kinds,
+            values=self.values,
+            operators=self.operators,
+            starts=self.starts,
+            ends=self.ends,
+            variables=self.variables,
+            groups=self.group_spans,
+        )
+
+    def _emit(self, token: CalcToken, kind: int, operator: int | None = None) -> None:
+        self.kinds.append(kind)
+        self.values.append(token.value)
+        self.operators.append(token.operator if operator is None else operator)
+        self.starts.append(token.start)
+        self.ends.append(token.end)
+
+    def _push_action(self, token: CalcToken) -> None:
+        if self.digits != self.actions + 1:
+            raise errors.IncorrectQueryError(f"Unexpected action '{token.symbol}' at position {token.start}")
+
+        priority = token.priority
+        pending_actions = self.pending_actions
+        while pending_actions and pending_actions[-1].priority >= priority:
+            self._emit(pending_actions.pop(), OPCODE_ACTION)
+        pending_actions.append(token)
+        self.actions += 1
+
+    def _close_group(self, token: CalcToken) -> None:
+        group = self.group
+        if group is None:
+            raise errors.IncorrectQueryError(f"Unexpected closing parenthesis at position {token.start}")
+
+        self._flush_group()
+        first = self.group_firsts.pop()
+        if first >= 0:
+            self.group_spans.extend((first, len(self.kinds), group.end + 1, token.start))
+        if group.negative:
+            self._emit(group._replace(end=token.end), OPCODE_NEGATE)
+
+        self.group, self.pending_actions, self.digits, self.actions = self.groups.pop()
+        self.digits += 1
+
+    def _flush_group(self) -> None:
+        if self.actions != self.digits - 1:
+            raise errors.IncorrectQueryError(
+                f"Incorrect amount of digits and actions. Actions: {self.actions}, digits: {self.digits}"
+            )
+
+        while self.pending_actions:
+            self._emit(self.pending_actions.pop(), OPCODE_ACTION)
+
+    def _expect_digit(self, token: CalcToken) -> None:
+        if self.digits != self.actions:
+            raise errors.IncorrectQueryError(f"Unexpected number at position {token.start}")
+
+
+def compile_query(query: str, variables: tp.Mapping[str, tuple[float, float]] | None = None) -> CompiledExpression:
+    """Compile a sanitized query; `variables` maps allowed variable names to the range of their values."""
+    compiler = ExpressionCompiler(variables or ())
+    for token in tokenize(query, variables or ()):
+        compiler.feed(token)
+
+    return compiler.finish(query, variables)
@@ -1,7 +1,18 @@
 import operator
+import typing as tp
 from enum import Enum
 
 CALC_DIGIT_SYMBOLS = {str(x) for x in range(10)}.union(".")
+# Separates an expression from the range of its variable in sweep queries
+SWEEP_SEPARATOR = ";"
+
+
+def real_power(base: tp.Any, exponent: tp.Any) -> tp.Any:
+    """`operator.pow` which refuses to leave real numbers, e.g. for `(-8)^(1/3)`."""
+    result = base ** exponent
+    if isinstance(result, complex):
+        raise TypeError(f"Complex result of {base} ^ {exponent}")
+    return result
 
 
 class CalcActions(Enum):
@@ -17,7 +28,7 @@ class CalcActions(Enum):
         MULTIPLY: operator.mul,
         DIVISION: operator.truediv,
         FLOOR_DIVISION: operator.floordiv,
-        EXPONENT: operator.pow,
+        EXPONENT: real_power,
     }
     PRIORITY_MAPPING = {
         SUMMARIZE: 1,
@@ -34,3 +45,46 @@ class CalcActions(Enum):
         DIVISION,
         EXPONENT
     )
+
+
+# Actions are referenced by these small ids in compiled programs, the tables below are indexed by them
+ACTION_IDS = {symbol: action_id for action_id, symbol in enumerate(CalcActions.PRIORITY_MAPPING.value)}
+ACTION_SYMBOLS = tuple(ACTION_IDS)
+ACTION_CALLBACKS = tuple(CalcActions.CALLBACK_MAPPING.value[symbol] for symbol in ACTION_SYMBOLS)
+ACTION_PRIORITIES = tuple(CalcActions.PRIORITY_MAPPING.value[symbol] for symbol in ACTION_SYMBOLS)
+DIFFERENCE_ID = ACTION_IDS[CalcActions.DIFFERENCE.value]
+MULTIPLY_ID = ACTION_IDS[CalcActions.MULTIPLY.value]
+EXPONENT_ID = ACTION_IDS[CalcActions.EXPONENT.value]
+DIVISION_IDS = (ACTION_IDS[CalcActions.DIVISION.value], ACTION_IDS[CalcActions.FLOOR_DIVISION.value])
+
+# Kinds of compiled program instructions, plain ints to keep the evaluation loop free of Enum lookups
+OPCODE_NUMBER = 0
+OPCODE_VARIABLE = 1
+OPCODE_ACTION = 2
+OPCODE_NEGATE = 3
+
+
+class CalcStages:
+    SANITIZE = "sanitize"
+    VALIDATE = "validate"
+    PARSE = "parse"
+    EVALUATE = "evaluate"
+    FORMAT = "format"
+
+
+class CalcSymbols(Enum):
+    DIGIT = "digit"
+    POINT = "point"
+    ACTION = "action"
+    VARIABLE = "variable"
+    GROUP_OPEN = "("
+    GROUP_CLOSE = ")"
+
+
+CALC_SYMBOL_CLASSES = {
+    **{symbol: CalcSymbols.DIGIT for symbol in CALC_DIGIT_SYMBOLS - {"."}},
+    ".": CalcSymbols.POINT,
+    **{symbol: CalcSymbols.ACTION for symbol in CalcActions.SYMBOLS_LIST.value},
+    "(": CalcSymbols.GROUP_OPEN,
+    ")": CalcSymbols.GROUP_CLOSE,
+}
@@ -0,0 +1,142 @@
+import typing as tp
+from itertools import islice
+from math import copysign, log2
+
+from calculator_bot.libs.calculator.const import (DIFFERENCE_ID, DIVISION_IDS,
+                                                  EXPONENT_ID, MULTIPLY_ID,
+                                                  OPCODE_ACTION, OPCODE_NUMBER,
+                                                  OPCODE_VARIABLE)
+from calculator_bot.libs.calculator.models import ExpressionCost, Program
+
+# Larger estimates are reported as this value, they are rejected by any sane limit anyway
+MAX_ESTIMATED_BITS = 2.0 ** 20
+# |b| <= 2 ** 64 already makes any base other than +-1 overflow, there is no need to track more
+MAX_EXPONENT_BITS = 64
+
+Bounds = tuple[float, float, int]
+
+
+def estimate_cost(
+        program: Program,
+        variables: tp.Mapping[str, tuple[float, float]] | None = None,
+) -> ExpressionCost:
+    """Bound the size of every value a postfix program produces, without evaluating it.
+
+    Each operand is tracked as log2 bounds plus a sign: `high` for how large `|x|` can get, `low` for how close
+    to zero a non-zero `|x|` can get, and the sign when it is known (0 otherwise). That bounds `^` chains and
+    products as well as division and negative exponents. The estimate is an upper bound for everything except
+    cancellation in `+`/`-`. Variables are bounded by the `(lowest, highest)` range of their values.
+    """
+    estimator = CostEstimator()
+    estimator.feed(program, variables)
+    return estimator.cost()
+
+
+class CostEstimator:
+    """Running `estimate_cost`, which can be saved between instructions and continued later."""
+
+    def __init__(self, operands: tp.Iterable[Bounds] = (), operations: int = 0, result_bits: float = 0.0) -> None:
+        self.operands = list(operands)
+        self.operations = operations
+        self.result_bits = result_bits
+
+    def feed(
+            self,
+            program: Program,
+            variables: tp.Mapping[str, tuple[float, float]] | None = None,
+            start: int = 0,
+    ) -> None:
+        """Account for the instructions of `program` from `start` on."""
+        operands = self.operands
+        result_bits = self.result_bits
+        operations = self.operations
+
+        for kind, value, operator in islice(zip(program.kinds, program.values, program.operators), start, None):
+            if kind == OPCODE_NUMBER:
+                operands.append(_digit_bounds(value))
+
+            elif kind == OPCODE_ACTION:
+                right = operands.pop()
+                operands[-1] = _action_bounds(operator, operands[-1], right)
+                result_bits = max(result_bits, operands[-1][0])
+                operations += 1
+
+            elif kind == OPCODE_VARIABLE:
+                lowest, highest = variables[program.variables[operator]] if variables else (0.0, 0.0)
+                operands.append(_range_bounds(lowest, highest))
+
+            else:
+                operands[-1] = _negated_bounds(operands[-1])
+
+        self.result_bits = result_bits
+        self.operations = operations
+
+    def cost(self) -> ExpressionCost:
+        result_bits = self.result_bits
+        if self.operands:
+            result_bits = max(result_bits, self.operands[-1][0])
+        return ExpressionCost(operations=self.operations, result_bits=min(result_bits, MAX_ESTIMATED_BITS))
+
+
+def _action_bounds(action: int, left: Bounds, right: Bounds) -> Bounds:
+    left_high, left_low, left_sign = left
+    right_high, right_low, right_sign = right
+
+    if action == EXPONENT_ID:
+        return _power_bounds(left, right)
+
+    if action == MULTIPLY_ID:
+        return left_high + right_high, left_low + right_low, left_sign * right_sign
+
+    if action in DIVISION_IDS:
+        return left_high + right_low, left_low + right_high, left_sign * right_sign
+
+    if action == DIFFERENCE_ID:
+        right_sign = -right_sign
+    return _sum_bits(left_high, right_high), max(left_low, right_low), left_sign if left_sign == right_sign else 0
+
+
+def _sum_bits(left_high: float, right_high: float) -> float:
+    # log2(2 ** a + 2 ** b), a flat sum of n terms grows by log2(n) bits rather than by a bit per term
+    high, low = max(left_high, right_high), min(left_high, right_high)
+    if high == low:
+        # Also keeps inf bounds from turning into nan
+        return high + 1
+    return high + log2(1 + 2.0 ** (low - high))
+
+
+def _power_bounds(left: Bounds, right: Bounds) -> Bounds:
+    left_high, left_low, left_sign = left
+    right_high, _, right_sign = right
+    exponent = 2.0 ** min(right_high, MAX_EXPONENT_BITS)
+    if right_sign > 0:
+        high, low = exponent * left_high, exponent * left_low
+    elif right_sign < 0:
+        high, low = exponent * left_low, exponent * left_high
+    else:
+        high = low = exponent * max(left_high, left_low)
+    return high, low, 1 if left_sign > 0 else 0
+
+
+def _negated_bounds(bounds: Bounds) -> Bounds:
+    high, low, sign = bounds
+    return high, low, -sign
+
+
+def _range_bounds(lowest: float, highest: float) -> Bounds:
+    high = _digit_bounds(max(abs(lowest), abs(highest)))[0]
+    if lowest > 0 or highest < 0:
+        _, low, sign = _digit_bounds(min(abs(lowest), abs(highest)))
+        return high, low, sign
+    # The range crosses zero, the smallest non-zero value is unknown
+    return high, high, 0
+
+
+def _digit_bounds(value: float) -> Bounds:
+    magnitude = abs(value)
+    sign = int(copysign(1, value)) if magnitude else 0
+    if magnitude >= 1:
+        return log2(magnitude), 0.0, sign
+    if magnitude > 0:
+        return 0.0, -log2(magnitude), sign
+    return 0.0, 0.0, sign
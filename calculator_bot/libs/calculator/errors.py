@@ -1,3 +1,9 @@
+import typing as tp
+
+if tp.TYPE_CHECKING:
+    from calculator_bot.libs.calculator.models import ExpressionCost
+
+
 class CalcError(Exception):
     ...
 
@@ -8,3 +14,13 @@ class IncorrectQueryError(CalcError):
 
 class UnknownQueryElementError(CalcError):
     ...
+
+
+class EvaluationTimeoutError(CalcError):
+    ...
+
+
+class QueryCostExceededError(CalcError):
+    def __init__(self, message: str, cost: "ExpressionCost") -> None:
+        super().__init__(message)
+        self.cost = cost
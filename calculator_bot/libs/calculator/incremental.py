@@ -0,0 +1,103 @@
+"""Incremental compilation for queries which grow one keystroke at a time, like inline queries.
+
+A `ParseState` remembers how far a query was compiled and evaluated. When the next query extends it, only the
+appended text is tokenized and compiled, closed groups and other completed sub-expressions are reused as values.
+"""
+from array import array
+
+from calculator_bot.libs.calculator import errors
+from calculator_bot.libs.calculator.compiler import ExpressionCompiler
+from calculator_bot.libs.calculator.const import CalcSymbols
+from calculator_bot.libs.calculator.cost import CostEstimator
+from calculator_bot.libs.calculator.interpreter import run_program
+from calculator_bot.libs.calculator.lexer import tokenize
+from calculator_bot.libs.calculator.models import (CalcToken,
+                                                   CompiledExpression,
+                                                   ExpressionCost, ParseState,
+                                                   Program)
+
+# Operand tokens end where the next symbol starts, parentheses don't depend on what follows
+OPERANDS = (CalcSymbols.DIGIT, CalcSymbols.VARIABLE)
+# Longest text after the state compiled incrementally. The completed part is evaluated at once, outside of the
+# budgeted evaluation slices, so longer (pasted) text takes the regular path
+TEXT_LIMIT = 64
+# Approximate bytes held per saved token: the token tuple, its evaluated value and cost bounds
+TOKEN_SIZE = 160
+
+
+def advance(state: ParseState, query: str) -> ParseState:
+    """Move the state to the last token of `query` which appended text can't change, evaluating what it completes.
+
+    The state stays where it is when the query fails before that token, compiling it from the state raises again.
+    """
+    compiler = ExpressionCompiler.resume(state)
+    checkpoint = None
+    try:
+        for token in tokenize(query, cursor=state.cursor, group_start=state.group_start):
+            compiler.feed(token)
+            if _is_checkpoint(token, query):
+                checkpoint = token, compiler.save(), len(compiler.kinds)
+    except errors.CalcError:
+        pass
+    if checkpoint is None:
+        return state
+
+    token, saved, size = checkpoint
+    program = compiler.program()
+    columns: tuple["array[int]", ...] = (program.kinds, program.operators, program.starts, program.ends)
+    for column in columns:
+        del column[size:]
+    del program.values[size:]
+    operands = _evaluate(query, program)
+    if operands is None:
+        return state
+
+    estimator = CostEstimator(state.cost_operands, state.operations, state.result_bits)
+    estimator.feed(program, start=len(state.operands))
+    cursor = token.end + 1
+    return ParseState(
+        # The symbol at the cursor ends the last operand, it has to stay the same as well
+        prefix=query[:cursor + 1],
+        cursor=cursor,
+        group_start=token.kind is CalcSymbols.GROUP_OPEN,
+        open_parentheses=state.open_parentheses + query.count("(", state.cursor, cursor),
+        close_parentheses=state.close_parentheses + query.count(")", state.cursor, cursor),
+        compiler=saved,
+        operands=tuple(operands),
+        cost_operands=tuple(estimator.operands),
+        operations=estimator.operations,
+        result_bits=estimator.result_bits,
+    )
+
+
+def compile_from(state: ParseState, query: str) -> CompiledExpression:
+    """Compile a query starting with `state.prefix`, only the text after the state's cursor is read."""
+    compiler = ExpressionCompiler.resume(state)
+    for token in tokenize(query, cursor=state.cursor, group_start=state.group_start):
+        compiler.feed(token)
+    return compiler.finish(query)
+
+
+def weigh_parse_state(state: ParseState) -> int:
+    """Rough size of a state in bytes, every saved operand, action or group is counted as a token."""
+    saved = state.compiler
+    tokens = len(state.operands) + len(saved.pending_actions) + sum(len(group[1]) + 1 for group in saved.groups)
+    return len(state.prefix) + TOKEN_SIZE * tokens
+
+
+def _evaluate(query: str, program: Program) -> list[float] | None:
+    operands: list[float] = []
+    # Nothing is emitted yet when the query starts with parentheses
+    if not program.kinds:
+        return operands
+    try:
+        for _ in run_program(CompiledExpression(query, program, ExpressionCost(0, 0)), operands=operands):
+            pass
+    except (ArithmeticError, TypeError):
+        # Evaluation fails for the whole query as well, once its cost is checked
+        return None
+    return operands
+
+
+def _is_checkpoint(token: CalcToken, query: str) -> bool:
+    return token.kind is not CalcSymbols.ACTION and (token.kind not in OPERANDS or token.end + 1 < len(query))
@@ -0,0 +1,114 @@
+"""Interpreter of compiled postfix programs, shared by `Calculator` and incremental compilation."""
+import typing as tp
+
+from calculator_bot.libs.calculator.const import (ACTION_CALLBACKS,
+                                                  OPCODE_ACTION, OPCODE_NUMBER,
+                                                  OPCODE_VARIABLE)
+from calculator_bot.libs.calculator.models import CompiledExpression
+
+
+def run_program(
+        expression: CompiledExpression,
+        variables: tp.Mapping[str, float] | None = None,
+        operands: list[float] | None = None,
+) -> tp.Generator[None, None, float]:
+    """Execute the postfix program, pausing after every action so the caller decides when to yield.
+
+    Operands are plain floats, no objects are allocated per instruction besides the intermediate results. A
+    caller interested in the whole stack of intermediate results passes its own `operands` list.
+    """
+    program = expression.program
+    if operands is None:
+        operands = []
+    push = operands.append
+    pop = operands.pop
+    for kind, value, operator in zip(program.kinds, program.values, program.operators):
+        if kind == OPCODE_NUMBER:
+            push(value)
+
+        elif kind == OPCODE_ACTION:
+            right = pop()
+            operands[-1] = ACTION_CALLBACKS[operator](operands[-1], right)
+            yield
+
+        elif kind == OPCODE_VARIABLE:
+            push(variables[program.variables[operator]] if variables else 0.0)
+
+        else:
+            operands[-1] = -operands[-1]
+
+    return float(operands[0])
+
+
+def run_shared(
+        expression: CompiledExpression,
+        group_values: dict[str, float],
+) -> tp.Generator[None, None, float]:
+    """`run_program` for a program without variables which shares parenthesised sub-expressions.
+
+    A group whose text is in `group_values` is replaced by its value without running its instructions, values
+    of the other groups are stored there once computed. Queries of a batch sharing the mapping compute every
+    distinct group once, with the same instructions and results as `run_program`.
+    """
+    kinds, values, operators = expression.program.kinds, expression.program.values, expression.program.operators
+    starting = _group_texts(expression)
+    ending: dict[int, list[str]] = {}
+
+    operands: list[float] = []
+    push = operands.append
+    pop = operands.pop
+    idx = 0
+    size = len(kinds)
+    while idx < size:
+        if idx in ending:
+            _store_groups(ending.pop(idx), operands[-1], group_values)
+        jump = _reuse_group(starting.get(idx, ()), group_values, ending, push)
+        if jump:
+            idx = jump
+            continue
+
+        kind = kinds[idx]
+        if kind == OPCODE_NUMBER:
+            push(values[idx])
+        elif kind == OPCODE_ACTION:
+            right = pop()
+            operands[-1] = ACTION_CALLBACKS[operators[idx]](operands[-1], right)
+            yield
+        else:
+            operands[-1] = -operands[-1]
+        idx += 1
+
+    _store_groups(ending.pop(size, ()), operands[-1], group_values)
+    return float(operands[0])
+
+
+def _group_texts(expression: CompiledExpression) -> dict[int, list[tuple[int, str]]]:
+    """Ends and texts of the groups by their first instruction."""
+    # Outer groups close after the inner ones, reversed they come first among groups sharing the first instruction
+    starting: dict[int, list[tuple[int, str]]] = {}
+    groups = expression.program.groups
+    for idx in range(len(groups) - 4, -1, -4):
+        first, end, text_start, text_end = groups[idx:idx + 4]
+        starting.setdefault(first, []).append((end, expression.query[text_start:text_end]))
+    return starting
+
+
+def _store_groups(texts: tp.Iterable[str], value: float, group_values: dict[str, float]) -> None:
+    for text in texts:
+        group_values[text] = value
+
+
+def _reuse_group(
+        groups: tp.Iterable[tuple[int, str]],
+        group_values: dict[str, float],
+        ending: dict[int, list[str]],
+        push: tp.Callable[[float], None],
+) -> int:
+    """Push the value of the outermost known group and return where it ends, 0 when none of them is known."""
+    for end, text in groups:
+        value = group_values.get(text)
+        if value is not None:
+            push(value)
+            return end
+        ending.setdefault(end, []).append(text)
+    return 0
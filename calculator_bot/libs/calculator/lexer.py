@@ -0,0 +1,136 @@
+import typing as tp
+
+from calculator_bot.libs.calculator import errors
+from calculator_bot.libs.calculator.const import (ACTION_IDS,
+                                                  CALC_SYMBOL_CLASSES,
+                                                  CalcActions, CalcSymbols)
+from calculator_bot.libs.calculator.models import CalcToken
+
+# Enum members looked up once, attribute access on an Enum class is slow in the lexer loop
+DIGIT = CalcSymbols.DIGIT
+POINT = CalcSymbols.POINT
+ACTION = CalcSymbols.ACTION
+VARIABLE = CalcSymbols.VARIABLE
+GROUP_OPEN = CalcSymbols.GROUP_OPEN
+GROUP_CLOSE = CalcSymbols.GROUP_CLOSE
+MINUS = CalcActions.DIFFERENCE.value
+
+NUMBER_SYMBOLS = (DIGIT, POINT)
+SIGNED_SYMBOLS = (DIGIT, GROUP_OPEN, VARIABLE)
+
+
+def tokenize(
+        query: str,
+        variables: tp.Collection[str] = (),
+        cursor: int = 0,
+        group_start: bool = True,
+) -> tp.Iterator[CalcToken]:
+    """Read a sanitized query once, yielding numbers, actions, parentheses and variables in order.
+
+    A minus sign becomes part of the following number (or negates the following group or variable) when it starts
+    a group or directly follows another action, e.g. `-2`, `2*-3` or `2^-(1+1)`. Letters are only accepted as
+    names from `variables`. Reading may continue at `cursor` right after an operand or a parenthesis, with
+    `group_start` telling whether that was an opening parenthesis.
+    """
+    query_len = len(query)
+
+    while cursor < query_len:
+        symbol_class = _classify(query, cursor, variables)
+
+        if symbol_class is GROUP_CLOSE:
+            yield CalcToken(GROUP_CLOSE, cursor, cursor)
+            cursor += 1
+            group_start = False
+            continue
+
+        if symbol_class is ACTION:
+            action, action_end, signed = _scan_action(query, cursor, group_start, variables)
+            if action:
+                yield _make_action(action, cursor, cursor + len(action) - 1)
+
+            cursor = action_end
+            group_start = False
+            if not signed:
+                continue
+            start = cursor - 1
+        else:
+            start = cursor
+
+        operand = _scan_operand(query, start, cursor, variables)
+        yield operand
+        cursor = operand.end + 1
+        group_start = operand.kind is GROUP_OPEN
+
+
+def _scan_action(query: str, cursor: int, group_start: bool, variables: tp.Collection[str]) -> tuple[str, int, bool]:
+    """Actions at `cursor` and the position after them, without the last minus sign when it signs the operand."""
+    query_len = len(query)
+    action_end = cursor + 1
+    while action_end < query_len and CALC_SYMBOL_CLASSES.get(query[action_end]) is ACTION:
+        action_end += 1
+
+    action = query[cursor:action_end]
+    signed = (
+        action[-1] == MINUS
+        and (group_start or len(action) > 1)
+        and action_end < query_len
+        and _symbol_class(query[action_end], variables) in SIGNED_SYMBOLS
+    )
+    return (action[:-1] if signed else action), action_end, signed
+
+
+def _symbol_class(symbol: str, variables: tp.Collection[str]) -> CalcSymbols | None:
+    symbol_class = CALC_SYMBOL_CLASSES.get(symbol)
+    if symbol_class is None and variables and symbol.isalpha():
+        return VARIABLE
+    return symbol_class
+
+
+def _classify(query: str, position: int, variables: tp.Collection[str]) -> CalcSymbols:
+    symbol_class = _symbol_class(query[position], variables)
+    if symbol_class is None:
+        raise errors.UnknownQueryElementError(f"Cannot parse symbol '{query[position]}' at position {position}")
+    return symbol_class
+
+
+def _scan_operand(query: str, start: int, cursor: int, variables: tp.Collection[str]) -> CalcToken:
+    """Read a number, variable or opening parenthesis at `cursor`, negated when `start` points at a minus sign."""
+    if query[cursor] == "(":
+        return CalcToken(GROUP_OPEN, start, cursor, negative=start != cursor)
+    if query[cursor].isalpha():
+        return _scan_variable(query, start, cursor, variables)
+    return _scan_digit(query, start, cursor)
+
+
+def _scan_variable(query: str, start: int, cursor: int, variables: tp.Collection[str]) -> CalcToken:
+    name_start = cursor
+    while cursor < len(query) and query[cursor].isalpha():
+        cursor += 1
+
+    name = query[name_start:cursor]
+    if name not in variables:
+        raise errors.UnknownQueryElementError(f"Unknown variable '{name}' at position {name_start}")
+    return CalcToken(VARIABLE, start, cursor - 1, name=name, negative=start != name_start)
+
+
+def _scan_digit(query: str, start: int, cursor: int) -> CalcToken:
+    query_len = len(query)
+    has_point = False
+    while cursor < query_len and CALC_SYMBOL_CLASSES.get(query[cursor]) in NUMBER_SYMBOLS:
+        if query[cursor] == ".":
+            if has_point:
+                raise errors.UnknownQueryElementError("Number cannot contain more than one point")
+            has_point = True
+        cursor += 1
+
+    try:
+        return CalcToken(DIGIT, start, cursor - 1, value=float(query[start:cursor]))
+    except ValueError:
+        raise errors.UnknownQueryElementError(f"Cannot parse number '{query[start:cursor]}' at position {start}")
+
+
+def _make_action(action: str, start: int, end: int) -> CalcToken:
+    try:
+        return CalcToken(ACTION, start, end, operator=ACTION_IDS[action])
+    except KeyError:
+        raise errors.UnknownQueryElementError(f"Unknown action symbol: {action}")
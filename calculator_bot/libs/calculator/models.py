@@ -1,29 +1,117 @@
-from calculator_bot.libs.calculator.const import CalcActions
+import typing as tp
+from array import array
+from dataclasses import dataclass, field
+from time import perf_counter
 
+from calculator_bot.libs.calculator.const import (ACTION_PRIORITIES,
+                                                  ACTION_SYMBOLS, CalcSymbols)
 
-class CalcQueryAction(str):
-    def __new__(cls, value, start, end, priority):
-        cls = str.__new__(CalcQueryAction, value)
-        cls.start = start
-        cls.end = end
-        cls.priority = priority
-        cls.callback = CalcActions.CALLBACK_MAPPING.value[value]
-        return cls
 
-    def __lt__(self, value: "CalcQueryAction") -> bool:
-        return self.priority < value.priority
+class CalcToken(tp.NamedTuple):
+    """Lexer output: a number, variable, action or parenthesis of the sanitized query.
 
-    def __gt__(self, value: "CalcQueryAction") -> bool:
-        return self.priority > value.priority
+    `operator` holds the action id (see `const.ACTION_IDS`), `negative` marks `-(` and `-x`.
+    """
+    kind: CalcSymbols
+    start: int
+    end: int
+    value: float = 0.0
+    operator: int = -1
+    name: str = ""
+    negative: bool = False
 
-    def __eq__(self, value: "CalcQueryAction") -> bool:
-        return self.priority == value.priority
+    @property
+    def priority(self) -> int:
+        return ACTION_PRIORITIES[self.operator]
 
+    @property
+    def symbol(self) -> str:
+        return ACTION_SYMBOLS[self.operator] if self.operator >= 0 else self.name
 
-class CalcQueryDigit(float):
-    def __new__(cls, value, start, end):
-        super(CalcQueryDigit, cls).__new__(cls, value)
-        cls = float.__new__(CalcQueryDigit, value)
-        cls.start = start
-        cls.end = end
-        return cls
+
+@dataclass(frozen=True, eq=False)
+class Program:
+    """Postfix program stored column-wise, one entry per instruction in every array.
+
+    `kinds` holds `const.OPCODE_*` values. `operators` holds the action id for actions and the index in
+    `variables` for variables, `values` holds numbers. `starts`/`ends` point back into the query. `groups` holds
+    four ints per parenthesised sub-expression, `first, end, text_start, text_end`: instructions `[first, end)`
+    compute the value inside the parentheses, `query[text_start:text_end]` is its text.
+    """
+    kinds: "array[int]"
+    values: "array[float]"
+    operators: "array[int]"
+    starts: "array[int]"
+    ends: "array[int]"
+    variables: tuple[str, ...] = ()
+    groups: "array[int]" = field(default_factory=lambda: array("i"))
+
+    def __len__(self) -> int:
+        return len(self.kinds)
+
+
+@dataclass(frozen=True)
+class ExpressionCost:
+    operations: int
+    result_bits: float
+
+
+@dataclass(frozen=True)
+class CompiledExpression:
+    """Sanitized query compiled into a postfix program, safe to evaluate any number of times."""
+    query: str
+    program: Program
+    cost: ExpressionCost
+    depth: int = 0
+
+
+@dataclass(frozen=True)
+class CompilerState:
+    """Compiler position between two tokens: enclosing groups and the actions still waiting for an operand."""
+    groups: tuple[tuple[CalcToken | None, tuple[CalcToken, ...], int, int], ...] = ()
+    group: CalcToken | None = None
+    pending_actions: tuple[CalcToken, ...] = ()
+    digits: int = 0
+    actions: int = 0
+    depth: int = 0
+
+
+@dataclass(frozen=True)
+class ParseState:
+    """Progress through a sanitized query, saved after a token that no appended text can change.
+
+    A query starting with `prefix` continues from `cursor`: completed sub-expressions are already evaluated into
+    `operands` (with `cost_operands` as their cost bounds), so only the text after `cursor` is compiled.
+    """
+    prefix: str = ""
+    cursor: int = 0
+    group_start: bool = True
+    open_parentheses: int = 0
+    close_parentheses: int = 0
+    compiler: CompilerState = CompilerState()
+    operands: tuple[float, ...] = ()
+    cost_operands: tuple[tuple[float, float, int], ...] = ()
+    operations: int = 0
+    result_bits: float = 0.0
+
+
+@dataclass
+class CalcContext:
+    """State of a single `Calculator` call, so one calculator instance can serve concurrent calls.
+
+    `timings` collects seconds spent per stage (see `CalcStages`). With `parse_state` set the query is compiled
+    incrementally from it, and the state reached is stored back even when compiling fails. `group_values` maps the
+    text of parenthesised sub-expressions to their values, shared between the calls of a batch.
+    """
+    query_origin: str
+    query: str = ""
+    expression: CompiledExpression | None = None
+    timings: dict[str, float] = field(default_factory=dict)
+    parse_state: ParseState | None = None
+    group_values: dict[str, float] | None = None
+
+    def record(self, stage: str, started: float) -> float:
+        """Add the time passed since `started` to the stage and return the current time."""
+        now = perf_counter()
+        self.timings[stage] = self.timings.get(stage, 0.0) + now - started
+        return now
@@ -0,0 +1,109 @@
+import asyncio
+import multiprocessing
+import os
+import signal
+import typing as tp
+from concurrent.futures import Future, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from dataclasses import dataclass
+
+from calculator_bot.libs.calculator import errors
+from calculator_bot.libs.calculator.calculator import Calculator
+from calculator_bot.libs.calculator.models import CompiledExpression
+
+RT = tp.TypeVar("RT")
+
+
+@dataclass(eq=False)
+class _Worker:
+    executor: ProcessPoolExecutor
+    pid: int
+    expired: bool = False
+
+
+class ProcessEvaluator:
+    """Evaluates compiled expressions in warm worker processes with a hard wall-clock deadline.
+
+    Every worker is a single-process executor, so a worker that misses the deadline is killed without touching
+    evaluations running in the other ones, and is replaced in the background. A caller which stops waiting
+    (e.g. a superseded inline query) leaves its job running, the worker returns to the pool once the job is done.
+    """
+
+    def __init__(self, workers: int, timeout: float) -> None:
+        self.workers = workers
+        self.timeout = timeout
+        self._idle: asyncio.Queue[_Worker] = asyncio.Queue()
+        self._all: set[_Worker] = set()
+        self._started = False
+
+    async def start(self) -> None:
+        if self._started:
+            return
+
+        self._started = True
+        for worker in await asyncio.gather(*(self._spawn() for _ in range(self.workers))):
+            self._idle.put_nowait(worker)
+
+    async def evaluate(self, expression: CompiledExpression) -> float:
+        return await self.run(Calculator.evaluate_sync, expression)
+
+    async def run(self, fn: tp.Callable[..., RT], *args: tp.Any) -> RT:
+        """Call a picklable `fn` in a worker under the same deadline as an evaluation."""
+        await self.start()
+        worker = await self._idle.get()
+        loop = asyncio.get_running_loop()
+
+        job = worker.executor.submit(fn, *args)
+        deadline = loop.call_later(self.timeout, self._expire, worker, job)
+        job.add_done_callback(lambda _: loop.call_soon_threadsafe(self._release, worker, job, deadline))
+        try:
+            return await asyncio.wrap_future(job)
+        except BrokenProcessPool:
+            if worker.expired:
+                raise errors.EvaluationTimeoutError(f"Evaluation exceeded {self.timeout} seconds")
+            raise
+
+    def shutdown(self) -> None:
+        self._started = False
+        for worker in self._all:
+            worker.executor.shutdown(wait=False, cancel_futures=True)
+        self._all.clear()
+
+    async def _spawn(self) -> _Worker:
+        executor = ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context("spawn"))
+        pid = await asyncio.get_running_loop().run_in_executor(executor, os.getpid)
+        worker = _Worker(executor=executor, pid=pid)
+        self._all.add(worker)
+        return worker
+
+    def _expire(self, worker: _Worker, job: "Future[tp.Any]") -> None:
+        if job.done():
+            return
+
+        worker.expired = True
+        try:
+            os.kill(worker.pid, signal.SIGKILL)
+        except ProcessLookupError:
+            pass
+
+    def _release(self, worker: _Worker, job: "Future[tp.Any]", deadline: asyncio.TimerHandle) -> None:
+        deadline.cancel()
+        if not self._started:
+            return
+
+        broken = not job.cancelled() and isinstance(job.exception(), BrokenProcessPool)
+        if not worker.expired and not broken:
+            self._idle.put_nowait(worker)
+            return
+
+        self._all.discard(worker)
+        worker.executor.shutdown(wait=False, cancel_futures=True)
+        asyncio.ensure_future(self._spawn()).add_done_callback(self._on_spawned)
+
+    def _on_spawned(self, task: "asyncio.Future[_Worker]") -> None:
+        if task.cancelled():
+            return
+        if self._started:
+            self._idle.put_nowait(task.result())
+        else:
+            task.result().executor.shutdown(wait=False)
@@ -0,0 +1,83 @@
+import re
+import typing as tp
+from dataclasses import dataclass
+
+import numpy as np
+
+from calculator_bot.libs.calculator import errors
+from calculator_bot.libs.calculator.const import SWEEP_SEPARATOR
+from calculator_bot.libs.calculator.models import (CompiledExpression,
+                                                   ExpressionCost)
+from calculator_bot.libs.calculator.vectorized import (ArrayResult, FloatArray,
+                                                       evaluate_array)
+
+if tp.TYPE_CHECKING:
+    from calculator_bot.libs.calculator.calculator import Calculator
+
+# Relative to the step, a last point this close to the stop is still in range
+RANGE_EPSILON = 1e-9
+RANGE_PATTERN = re.compile(r"^([a-zA-Z]+)=(-?\d+(?:\.\d+)?)\.\.(-?\d+(?:\.\d+)?)(?:\.\.(\d+(?:\.\d+)?))?$")
+
+
+@dataclass(frozen=True)
+class SweepQuery:
+    variable: str
+    points: FloatArray
+    expression: CompiledExpression
+
+
+@dataclass(frozen=True)
+class SweepResult:
+    variable: str
+    points: FloatArray
+    result: ArrayResult
+
+
+def is_sweep(query: str) -> bool:
+    return SWEEP_SEPARATOR in query
+
+
+def solve_sweep(calculator: "Calculator", query: str, points_limit: int = 0) -> SweepResult:
+    """Evaluate a sanitized `expression;name=start..stop[..step]` query for every point of the range."""
+    return evaluate_sweep(prepare_sweep(calculator, query, points_limit))
+
+
+def prepare_sweep(calculator: "Calculator", query: str, points_limit: int = 0) -> SweepQuery:
+    """Compile a sanitized sweep query, charging its operations once per point to the calculator's limits."""
+    expression_query, _, range_query = query.partition(SWEEP_SEPARATOR)
+    variable, points = parse_range(range_query, points_limit)
+
+    expression = calculator.compile(expression_query, {variable: (float(points[0]), float(points[-1]))})
+    calculator.validate_cost(
+        ExpressionCost(operations=expression.cost.operations * len(points), result_bits=expression.cost.result_bits)
+    )
+    return SweepQuery(variable=variable, points=points, expression=expression)
+
+
+def evaluate_sweep(sweep: SweepQuery, deadline: float | None = None) -> SweepResult:
+    """Evaluate a prepared sweep, `deadline` is a `time.monotonic` timestamp as in `evaluate_array`."""
+    return SweepResult(
+        variable=sweep.variable,
+        points=sweep.points,
+        result=evaluate_array(
+            sweep.expression.program, len(sweep.points), variables={sweep.variable: sweep.points}, deadline=deadline
+        ),
+    )
+
+
+def parse_range(query: str, points_limit: int = 0) -> tuple[str, FloatArray]:
+    match = RANGE_PATTERN.match(query)
+    if match is None:
+        raise errors.IncorrectQueryError(f"Cannot parse variable range '{query}', expected 'x=1..10' or 'x=1..10..0.5'")
+
+    variable, start, stop, step = match.groups()
+    start_value, stop_value, step_value = float(start), float(stop), float(step or 1)
+    if step_value <= 0 or stop_value < start_value:
+        raise errors.IncorrectQueryError(f"Variable range '{query}' is empty")
+
+    # Rounding of the division must not lose the last point, e.g. 0.3 of 0..0.3..0.1
+    points = int((stop_value - start_value) / step_value + RANGE_EPSILON) + 1
+    if points_limit and points > points_limit:
+        raise errors.IncorrectQueryError(f"Max amount of variable values exceeded: {points_limit}")
+
+    return variable, start_value + np.arange(points, dtype=np.float64) * step_value
@@ -0,0 +1,137 @@
+import typing as tp
+from dataclasses import dataclass
+from time import monotonic
+
+import numpy as np
+
+from calculator_bot.libs.calculator.const import (ACTION_CALLBACKS,
+                                                  DIVISION_IDS, EXPONENT_ID,
+                                                  OPCODE_ACTION, OPCODE_NUMBER,
+                                                  OPCODE_VARIABLE, real_power)
+from calculator_bot.libs.calculator.errors import (CalcError,
+                                                   EvaluationTimeoutError)
+from calculator_bot.libs.calculator.models import Program
+
+if tp.TYPE_CHECKING:
+    from calculator_bot.libs.calculator.calculator import Calculator
+
+FloatArray = np.ndarray[tp.Any, np.dtype[np.float64]]
+BoolArray = np.ndarray[tp.Any, np.dtype[np.bool_]]
+Operand = FloatArray | np.float64
+
+
+@dataclass(frozen=True)
+class ArrayResult:
+    """Element-wise results; `failed` marks elements for which the scalar engine raises an error."""
+    values: FloatArray
+    failed: BoolArray
+
+
+def evaluate_array(
+        program: Program,
+        size: int,
+        variables: tp.Mapping[str, FloatArray] | None = None,
+        constants: tp.Sequence[FloatArray] | None = None,
+        deadline: float | None = None,
+) -> ArrayResult:
+    """Run a postfix program over arrays with the same callbacks as the scalar engine.
+
+    Variables are taken from `variables`; with `constants` given, the n-th number of the program is replaced by
+    the n-th array, so one program evaluates many queries of the same shape at once. NumPy returns inf/nan where
+    Python raises, so those elements are tracked in `failed` instead. Powers use `np.power`, which may round the
+    last bit differently from `pow`; only elements it leaves non-finite are redone by Python to tell the errors
+    apart. Past the `time.monotonic` `deadline` the evaluation stops with `EvaluationTimeoutError`.
+    """
+    operands: list[Operand] = []
+    failed = np.zeros(size, dtype=bool)
+    columns = iter(constants) if constants is not None else None
+
+    with np.errstate(all="ignore"):
+        for kind, value, operator in zip(program.kinds, program.values, program.operators):
+            if deadline is not None and monotonic() > deadline:
+                raise EvaluationTimeoutError("Evaluation exceeded its deadline")
+
+            if kind == OPCODE_NUMBER:
+                operands.append(next(columns) if columns is not None else np.float64(value))
+
+            elif kind == OPCODE_ACTION:
+                right = operands.pop()
+                operands[-1], action_failed = _apply_action(operator, operands[-1], right)
+                failed |= action_failed
+
+            elif kind == OPCODE_VARIABLE:
+                operands.append(variables[program.variables[operator]] if variables else np.zeros(size))
+
+            else:
+                operands[-1] = -operands[-1]
+
+    values = np.broadcast_to(np.asarray(operands[0], dtype=np.float64), (size,)).copy()
+    values[failed] = np.nan
+    return ArrayResult(values=values, failed=failed)
+
+
+def _apply_action(operator: int, left: Operand, right: Operand) -> tuple[Operand, BoolArray]:
+    if operator == EXPONENT_ID:
+        return _power_array(left, right)
+
+    result = ACTION_CALLBACKS[operator](left, right)
+    # ZeroDivisionError
+    return result, np.asarray(right == 0) if operator in DIVISION_IDS else np.asarray(False)
+
+
+def _power_array(base: Operand, exponent: Operand) -> tuple[Operand, BoolArray]:
+    values = np.atleast_1d(np.power(base, exponent))
+    # inf/nan is either a valid result or one of the errors of `real_power`, only Python tells them apart
+    suspect = ~np.isfinite(values)
+    if not suspect.any():
+        return values, np.asarray(False)
+
+    bases, exponents = np.broadcast_arrays(np.atleast_1d(base), np.atleast_1d(exponent))
+    retried, retried_failed = _POWER(bases[suspect], exponents[suspect])
+    values[suspect] = retried
+    failed = np.zeros(values.shape, dtype=bool)
+    failed[suspect] = retried_failed.astype(bool)
+    return values, failed
+
+
+def _power(base: float, exponent: float) -> tuple[float, bool]:
+    try:
+        return real_power(float(base), float(exponent)), False
+    except (ZeroDivisionError, OverflowError, TypeError):
+        return np.nan, True
+
+
+_POWER = np.frompyfunc(_power, 2, 2)
+
+
+def solve_many(calculator: "Calculator", queries: tp.Iterable[str]) -> list[float | None]:
+    """Solve many queries at once, None marks queries which are incorrect or fail to evaluate.
+
+    Queries that compile to the same program shape (e.g. `1+2` and `3+4`) are evaluated together, with every
+    number of the program turned into a column of values.
+    """
+    results: list[float | None] = []
+    shapes: dict[tuple[bytes, bytes], tuple[Program, list[int], list[FloatArray]]] = {}
+
+    for idx, query in enumerate(queries):
+        results.append(None)
+        try:
+            expression = calculator.prepare(query)
+        except CalcError:
+            continue
+
+        program = expression.program
+        kinds = np.frombuffer(program.kinds, dtype=np.int8)
+        _, indexes, rows = shapes.setdefault(
+            (program.kinds.tobytes(), program.operators.tobytes()), (program, [], [])
+        )
+        indexes.append(idx)
+        rows.append(np.frombuffer(program.values, dtype=np.float64)[kinds == OPCODE_NUMBER])
+
+    for program, indexes, rows in shapes.values():
+        constants = list(np.vstack(rows).T)
+        result = evaluate_array(program, len(indexes), constants=constants)
+        for idx, value, failed in zip(indexes, result.values.tolist(), result.failed.tolist()):
+            results[idx] = None if failed else value
+
+    return results
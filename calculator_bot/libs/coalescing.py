@@ -0,0 +1,48 @@
+import asyncio
+import typing as tp
+
+KT = tp.TypeVar("KT")
+RT = tp.TypeVar("RT")
+
+
+class LatestOnlyCoalescer(tp.Generic[KT]):
+    """Keeps at most one evaluation per key alive: a newer call cancels the one it supersedes.
+
+    Calls wait `debounce` seconds before starting, so bursts for the same key collapse into the last call without
+    doing any work for the earlier ones. `on_skip` is called for every superseded call.
+    """
+
+    def __init__(self, debounce: float = 0, on_skip: tp.Callable[[], None] | None = None) -> None:
+        self.debounce = debounce
+        self._on_skip = on_skip
+        self._tasks: dict[KT, asyncio.Future[tp.Any]] = {}
+
+    def __len__(self) -> int:
+        return len(self._tasks)
+
+    async def run(self, key: KT, fn: tp.Callable[[], tp.Awaitable[RT]]) -> RT | None:
+        """Run `fn` unless a newer call for the same key arrives first; return None if it was superseded."""
+        previous = self._tasks.get(key)
+        if previous is not None:
+            previous.cancel()
+
+        task = asyncio.ensure_future(self._run(fn))
+        self._tasks[key] = task
+        try:
+            return await task
+        except asyncio.CancelledError:
+            current_task = asyncio.current_task()
+            if current_task is not None and current_task.cancelling():
+                raise
+
+            if self._on_skip is not None:
+                self._on_skip()
+            return None
+        finally:
+            if self._tasks.get(key) is task:
+                del self._tasks[key]
+
+    async def _run(self, fn: tp.Callable[[], tp.Awaitable[RT]]) -> RT:
+        if self.debounce:
+            await asyncio.sleep(self.debounce)
+        return await fn()
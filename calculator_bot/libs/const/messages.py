@@ -3,9 +3,24 @@ HELP_MESSAGE = """I can solve simple math expressions, which consists of numbers
 +, -, *, /, //, **
 Example: 2 + 2 * 2 - (2 + 2) **2
 
+To calculate an expression for a range of values, name the variable after a semicolon:
+Example: x^2 + 3*x; x=1..100 or x^2; x=0..1..0.25
+
+Send several expressions, one per line, or a .txt document with them to calculate them all at once
+
 Also, I can solve expressions in inline mode
 Example: @easycalc_bot 2+2*2
 """
 
+RATE_LIMITED_MESSAGE = "Too many requests, please slow down a bit"
+BUSY_MESSAGE = "I'm too busy right now, please try again in a minute"
+BATCH_TRUNCATED_TEMPLATE = "Only the first {limit} lines are calculated"
+DOCUMENT_TOO_LARGE_TEMPLATE = "The document is too large, I calculate documents of up to {limit} KiB"
+DOCUMENT_TYPE_MESSAGE = "Send a plain text document with one expression per line"
+
+SWEEP_MESSAGE_TEMPLATE = """{query}
+Values: {points}, errors: {errors}
+Min: {min}, max: {max}, mean: {mean}"""
+
 META_MESSAGE_TEMPLATE = """I'm built from repository https://github.com/engineer-roman/calculator-telegram-bot
 My current version: {version}"""
@@ -1,26 +1,109 @@
+import hashlib
+import json
+import os
+import threading
+import time
 from os import environ, getenv
 
-from dopplersdk import DopplerSDK
+from loguru import logger as log
+
+# Default age after which a snapshot is refreshed, in seconds
+SNAPSHOT_TTL = 300.0
 
 
 def set_env_vars(doppler_required: bool) -> None:
+    """Export Doppler secrets as env variables.
+
+    With `DOPPLER_SNAPSHOT_PATH` set, the secrets are also stored in a local snapshot. Later starts take them from
+    the snapshot without a single request to Doppler, and a snapshot older than `DOPPLER_SNAPSHOT_TTL` seconds is
+    refreshed by a background thread, so deploys and crash loops don't wait for the Doppler API.
+    """
     token = getenv("DOPPLER_TOKEN")
     if not token:
         if doppler_required:
             raise RuntimeError("DOPPLER_TOKEN env variable is not set")
         return
 
+    snapshot_path = getenv("DOPPLER_SNAPSHOT_PATH")
+    if not snapshot_path:
+        environ.update(fetch_secrets(token))
+        return
+
+    ttl = float(getenv("DOPPLER_SNAPSHOT_TTL") or SNAPSHOT_TTL)
+    snapshot = load_snapshot(snapshot_path, token)
+    if snapshot is None:
+        secrets = fetch_secrets(token)
+        save_snapshot(snapshot_path, token, secrets)
+        fetched_at = time.time()
+    else:
+        fetched_at, secrets = snapshot
+    environ.update(secrets)
+
+    threading.Thread(
+        target=refresh_snapshot, args=(snapshot_path, token, ttl, fetched_at), name="doppler-snapshot", daemon=True
+    ).start()
+
+
+def fetch_secrets(token: str) -> dict[str, str]:
+    # Imported here as the SDK is only needed when there is no fresh snapshot
+    from dopplersdk import DopplerSDK  # pylint: disable=C0415
+
     doppler = DopplerSDK(token)
-    projects = doppler.projects.list()
-    if not projects.projects:
-        raise RuntimeError("No projects found in Doppler")
+    # The Doppler CLI exports the project and config it runs with, which saves two requests
+    project = getenv("DOPPLER_PROJECT")
+    config = getenv("DOPPLER_CONFIG")
+    if not project:
+        projects = doppler.projects.list()
+        if not projects.projects:
+            raise RuntimeError("No projects found in Doppler")
+        project = projects.projects[0]["id"]
 
-    project = projects.projects[0]["id"]
-    configs = doppler.configs.list(project)
-    if not configs.configs:
-        raise RuntimeError("No configs found in Doppler")
+    if not config:
+        configs = doppler.configs.list(project)
+        if not configs.configs:
+            raise RuntimeError("No configs found in Doppler")
+        config = configs.configs[0]["name"]
 
-    config = configs.configs[0]["name"]
     secrets = doppler.secrets.list(config, project)
-    for secret, secret_data in secrets.secrets.items():
-        environ[secret] = secret_data["computed"]
+    return {secret: secret_data["computed"] for secret, secret_data in secrets.secrets.items()}
+
+
+def load_snapshot(path: str, token: str) -> tuple[float, dict[str, str]] | None:
+    try:
+        with open(path, encoding="utf-8") as snapshot_file:
+            snapshot = json.load(snapshot_file)
+    except FileNotFoundError:
+        return None
+    except (OSError, ValueError) as exc:
+        log.warning(f"Ignoring unreadable Doppler snapshot {path}: {exc}")
+        return None
+
+    # A snapshot taken with another token may hold secrets of another project or config
+    if snapshot.get("token") != _token_digest(token):
+        return None
+    return snapshot["fetched_at"], snapshot["secrets"]
+
+
+def save_snapshot(path: str, token: str, secrets: dict[str, str]) -> None:
+    snapshot = {"token": _token_digest(token), "fetched_at": time.time(), "secrets": secrets}
+    temp_path = f"{path}.{os.getpid()}.tmp"
+    # Secrets are readable by the owner only, the rename replaces the old snapshot atomically
+    fd = os.open(temp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+    with os.fdopen(fd, "w", encoding="utf-8") as snapshot_file:
+        json.dump(snapshot, snapshot_file)
+    os.replace(temp_path, path)
+
+
+def refresh_snapshot(path: str, token: str, ttl: float, fetched_at: float) -> None:
+    while True:
+        time.sleep(max(fetched_at + ttl - time.time(), 0))
+        try:
+            save_snapshot(path, token, fetch_secrets(token))
+            log.info("Doppler snapshot refreshed, new secrets apply on the next start")
+        except Exception as exc:  # pylint: disable=W0703
+            log.warning(f"Failed to refresh Doppler snapshot, retrying in {ttl:.0f}s: {exc}")
+        fetched_at = time.time()
+
+
+def _token_digest(token: str) -> str:
+    return hashlib.sha256(token.encode()).hexdigest()
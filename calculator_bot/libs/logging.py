@@ -1,11 +1,28 @@
+import atexit
 import logging
+import queue
+import re
+import threading
+import typing as tp
 from sys import stdout
+from time import monotonic
 
 from loguru import logger  # pylint: disable=E0611
 from loguru._logger import Logger
+from prometheus_client import Counter
 
 from calculator_bot.config.settings import LogStdSettings
 
+# Format fields which need the caller of a standard logging record to be found
+CALLER_FIELDS_PATTERN = re.compile(r"{(name|module|function|line|file)\b")
+WRITE_BATCH = 256
+STOP_TIMEOUT = 5.0
+
+LOG_DROPPED_METRIC = Counter("calc_log_records_dropped", "Log records dropped because the log writer fell behind")
+LOG_SAMPLED_METRIC = Counter(
+    "calc_log_records_sampled", "Log records of expected errors skipped by rate limiting", ["key"]
+)
+
 
 class InterceptHandler(logging.Handler):
     loglevel_mapping = {
@@ -18,41 +35,138 @@ class InterceptHandler(logging.Handler):
         0: "NOTSET",
     }
 
+    def __init__(self, find_caller: bool = True) -> None:
+        super().__init__()
+        # Walking the stack is only worth it when the log format shows where a record comes from
+        self.find_caller = find_caller
+        self._log = logger.bind(request_id="app")
+        self._levels: dict[str, str] = {}
+
     def emit(self, record) -> None:  # type: ignore
-        try:
-            level = logger.level(record.levelname).name
-        except (AttributeError, ValueError):
-            level = self.loglevel_mapping[record.levelno]
+        level = self._levels.get(record.levelname)
+        if level is None:
+            try:
+                level = logger.level(record.levelname).name
+            except (AttributeError, ValueError):
+                level = self.loglevel_mapping[record.levelno]
+            self._levels[record.levelname] = level
 
-        frame = logging.currentframe()
         depth = 2
-        while frame.f_code.co_filename == logging.__file__:
-            frame = frame.f_back  # type: ignore
-            depth += 1
+        if self.find_caller:
+            frame = logging.currentframe()
+            while frame.f_code.co_filename == logging.__file__:
+                frame = frame.f_back  # type: ignore
+                depth += 1
 
-        log = logger.bind(request_id="app")
-        log.opt(
+        self._log.opt(
             depth=depth,
             exception=record.exc_info
         ).log(level, record.getMessage())
 
 
+class QueueSink:
+    """Loguru sink handing messages to a background writer thread.
+
+    At most `maxsize` messages wait for the writer, newer ones are dropped and counted, so a slow stdout never
+    blocks the event loop.
+    """
+
+    def __init__(self, stream: tp.TextIO, maxsize: int) -> None:
+        self._stream = stream
+        self._queue: queue.Queue[str | None] = queue.Queue(maxsize)
+        self._thread = threading.Thread(target=self._run, name="log-writer", daemon=True)
+        self._thread.start()
+
+    def write(self, message: str) -> None:
+        try:
+            self._queue.put_nowait(message)
+        except queue.Full:
+            LOG_DROPPED_METRIC.inc()
+
+    def stop(self) -> None:
+        """Write out the waiting messages, the writer is a daemon thread and would be killed with them at exit."""
+        if not self._thread.is_alive():
+            return
+        try:
+            self._queue.put(None, timeout=STOP_TIMEOUT)
+        except queue.Full:
+            return
+        self._thread.join(STOP_TIMEOUT)
+
+    def _run(self) -> None:
+        while True:
+            messages = [self._queue.get()]
+            while len(messages) < WRITE_BATCH:
+                try:
+                    messages.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+
+            stopped = None in messages
+            self._stream.write("".join(message for message in messages if message is not None))
+            self._stream.flush()
+            if stopped:
+                return
+
+
+class LogSampler:
+    """Rate limits records per message class with a token bucket.
+
+    Each class lets through `rate` records a second, with bursts of up to a second worth of records. Records over
+    the limit should be skipped by the caller and are counted. A rate of 0 lets everything through.
+    """
+
+    def __init__(self, rate: float = 0) -> None:
+        self.rate = rate
+        self._buckets: dict[str, tuple[float, float]] = {}
+
+    def allow(self, key: str) -> bool:
+        if not self.rate:
+            return True
+
+        now = monotonic()
+        burst = max(self.rate, 1)
+        tokens, updated = self._buckets.get(key, (burst, now))
+        tokens = min(burst, tokens + (now - updated) * self.rate)
+        if tokens < 1:
+            self._buckets[key] = (tokens, now)
+            LOG_SAMPLED_METRIC.labels(key=key).inc()
+            return False
+
+        self._buckets[key] = (tokens - 1, now)
+        return True
+
+
+# Shared by the modules logging expected errors, configured by `setup_logger`
+log_sampler = LogSampler()
+
+
 def setup_logger(config: LogStdSettings) -> Logger:
     replace_loggers = ("aiogram",)
 
     logger.remove()
+    sink: QueueSink | tp.TextIO = stdout
+    if config.queue_size:
+        sink = QueueSink(stdout, config.queue_size)
+        # Records of a failed start are the last ones and the most needed
+        atexit.register(sink.stop)
     logger.add(
-        stdout,
+        sink,
         level=config.log_level,
         format=config.log_format,
         diagnose=config.rich_exceptions,
     )
+    log_sampler.rate = config.sample_rate
 
-    logging.basicConfig(handlers=[InterceptHandler()], level=0)
+    # Records below the level are discarded by the standard logging before they are created
+    level = logger.level(config.log_level).no
+    find_caller = CALLER_FIELDS_PATTERN.search(config.log_format) is not None
+    logging.basicConfig(handlers=[InterceptHandler(find_caller)], level=level)
 
     for _log in replace_loggers:
         _logger = logging.getLogger(_log)
         _logger.propagate = False
-        _logger.handlers = [InterceptHandler()]
+        _logger.handlers = [InterceptHandler(find_caller)]
+        _logger.setLevel(level)
 
     return logger.bind(request_id=None, method=None)  # type: ignore
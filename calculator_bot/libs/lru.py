@@ -0,0 +1,114 @@
+import typing as tp
+from collections import OrderedDict
+from threading import Lock
+from time import monotonic
+
+KT = tp.TypeVar("KT")
+VT = tp.TypeVar("VT")
+
+
+class CacheEvents:
+    HIT = "hit"
+    MISS = "miss"
+    EVICTION = "eviction"
+    EXPIRATION = "expiration"
+
+
+class LRUCache(tp.Generic[KT, VT]):
+    """Bounded mapping which drops the least recently used entry once `maxsize` is reached.
+
+    Entries optionally expire `ttl` seconds after they were stored, and with `max_bytes` set the summed `weigh`
+    of all values is kept under that cap as well. `on_event` is called with one of `CacheEvents` on every lookup,
+    eviction and expiration, which is how callers export metrics without the cache depending on them.
+    A cache with `maxsize=0` stores nothing. Every operation holds a lock, so one cache can be shared between
+    threads; `get_or_set` runs the factory outside of it, concurrent misses may compute the same value twice.
+    """
+
+    def __init__(
+            self,
+            maxsize: int,
+            on_event: tp.Callable[[str], None] | None = None,
+            ttl: float | None = None,
+            max_bytes: int | None = None,
+            weigh: tp.Callable[[VT], int] | None = None,
+    ) -> None:
+        if max_bytes and weigh is None:
+            raise ValueError("max_bytes requires a weigh function")
+
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.size_bytes = 0
+        self._on_event = on_event
+        self._weigh = weigh
+        self._data: OrderedDict[KT, tuple[VT, float | None, int]] = OrderedDict()
+        self._lock = Lock()
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def get(self, key: KT) -> VT | None:
+        with self._lock:
+            try:
+                value, expires_at, _ = self._data[key]
+            except KeyError:
+                event = CacheEvents.MISS
+            else:
+                if expires_at is None or expires_at > monotonic():
+                    self._data.move_to_end(key)
+                    event = CacheEvents.HIT
+                else:
+                    self._pop(key)
+                    event = CacheEvents.EXPIRATION
+
+        if event == CacheEvents.HIT:
+            self._emit(event)
+            return value
+        if event == CacheEvents.EXPIRATION:
+            self._emit(event)
+        self._emit(CacheEvents.MISS)
+        return None
+
+    def set(self, key: KT, value: VT) -> None:
+        if not self.maxsize:
+            return
+
+        weight = self._weigh(value) if self.max_bytes and self._weigh is not None else 0
+        if self.max_bytes and weight > self.max_bytes:
+            return
+
+        evictions = 0
+        with self._lock:
+            if key in self._data:
+                self._pop(key)
+
+            expires_at = monotonic() + self.ttl if self.ttl else None
+            self._data[key] = (value, expires_at, weight)
+            self.size_bytes += weight
+
+            while len(self._data) > self.maxsize or (self.max_bytes and self.size_bytes > self.max_bytes):
+                self._pop(next(iter(self._data)))
+                evictions += 1
+
+        for _ in range(evictions):
+            self._emit(CacheEvents.EVICTION)
+
+    def get_or_set(self, key: KT, factory: tp.Callable[[], VT]) -> VT:
+        value = self.get(key)
+        if value is None:
+            value = factory()
+            self.set(key, value)
+        return value
+
+    def clear(self) -> None:
+        with self._lock:
+            self._data.clear()
+            self.size_bytes = 0
+
+    def _pop(self, key: KT) -> None:
+        _, _, weight = self._data.pop(key)
+        self.size_bytes -= weight
+
+    def _emit(self, event: str) -> None:
+        if self._on_event is not None:
+            self._on_event(event)
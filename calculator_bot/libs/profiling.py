@@ -0,0 +1,153 @@
+import json
+import sys
+import threading
+import time
+import typing as tp
+from collections import Counter, deque
+from dataclasses import asdict, dataclass, field
+from socketserver import ThreadingMixIn
+from urllib.parse import parse_qs
+from wsgiref.simple_server import WSGIRequestHandler, WSGIServer, make_server
+
+from prometheus_client import REGISTRY, CollectorRegistry, make_wsgi_app
+
+# Longest profile a single request may ask for, in seconds
+PROFILE_SECONDS_LIMIT = 60.0
+PROFILE_INTERVAL = 0.005
+
+WSGIResponse = tp.Iterable[bytes]
+StartResponse = tp.Callable[[str, list[tuple[str, str]]], tp.Any]
+
+
+@dataclass(frozen=True)
+class SlowQuery:
+    at: float
+    update_type: str
+    query: str
+    seconds: float
+    instructions: int = 0
+    operations: int = 0
+    depth: int = 0
+    timings: dict[str, float] = field(default_factory=dict)
+
+
+class SlowQueryLog:
+    """Ring buffer keeping the last `size` queries which took at least `threshold` seconds."""
+
+    def __init__(self, size: int, threshold: float) -> None:
+        self.threshold = threshold
+        self._queries: deque[SlowQuery] = deque(maxlen=size)
+
+    def __len__(self) -> int:
+        return len(self._queries)
+
+    def add(self, query: SlowQuery) -> None:
+        self._queries.append(query)
+
+    def entries(self) -> list[SlowQuery]:
+        return list(self._queries)
+
+
+class StackSampler:
+    """Sampling profiler: another thread reads the stack of `thread_id` every `interval` seconds.
+
+    The sampled thread isn't instrumented, so it only pays for the GIL the sampler takes. Stacks are counted in
+    the collapsed format flame graph tools read, one `outer;...;inner count` line per distinct stack.
+    """
+
+    def __init__(self, thread_id: int | None = None, interval: float = PROFILE_INTERVAL) -> None:
+        self.thread_id = thread_id if thread_id is not None else threading.main_thread().ident or 0
+        self.interval = interval
+        self._lock = threading.Lock()
+
+    def sample(self, seconds: float) -> Counter[str] | None:
+        """Sample for `seconds`, return None when another profile is running."""
+        stacks: Counter[str] = Counter()
+        # A with block would wait for the running profile, the lock is released in the finally below instead
+        if not self._lock.acquire(blocking=False):  # pylint: disable=R1732
+            return None
+        try:
+            deadline = time.monotonic() + seconds
+            while time.monotonic() < deadline:
+                frame = sys._current_frames().get(self.thread_id)  # pylint: disable=W0212
+                if frame is not None:
+                    stacks[self._collapse(frame)] += 1
+                time.sleep(self.interval)
+        finally:
+            self._lock.release()
+        return stacks
+
+    @staticmethod
+    def _collapse(frame: tp.Any) -> str:
+        names = []
+        while frame is not None:
+            names.append(f"{frame.f_globals.get('__name__', '?')}:{frame.f_code.co_name}")
+            frame = frame.f_back
+        return ";".join(reversed(names))
+
+
+def format_stacks(stacks: Counter[str]) -> str:
+    return "".join(f"{stack} {count}\n" for stack, count in stacks.most_common())
+
+
+class _ThreadingWSGIServer(ThreadingMixIn, WSGIServer):
+    daemon_threads = True
+
+
+class _SilentHandler(WSGIRequestHandler):
+    def log_message(self, format: str, *args: tp.Any) -> None:  # pylint: disable=W0622
+        pass
+
+
+def make_debug_app(
+        registry: CollectorRegistry,
+        slow_queries: SlowQueryLog | None,
+        sampler: StackSampler | None,
+) -> tp.Callable[[dict[str, tp.Any], StartResponse], WSGIResponse]:
+    """WSGI app serving metrics, plus `/debug/slow_queries` and, with a sampler, `/debug/profile?seconds=N`."""
+    metrics_app = make_wsgi_app(registry)
+
+    def app(environ: dict[str, tp.Any], start_response: StartResponse) -> WSGIResponse:
+        path = environ.get("PATH_INFO", "")
+        if path == "/debug/slow_queries":
+            entries = [asdict(query) for query in slow_queries.entries()] if slow_queries is not None else []
+            return _respond(start_response, "200 OK", json.dumps(entries), "application/json")
+
+        if path == "/debug/profile" and sampler is not None:
+            params = parse_qs(environ.get("QUERY_STRING", ""))
+            try:
+                seconds = float(params.get("seconds", ["10"])[0])
+            except ValueError:
+                return _respond(start_response, "400 Bad Request", "seconds must be a number\n")
+            stacks = sampler.sample(min(max(seconds, 0.0), PROFILE_SECONDS_LIMIT))
+            if stacks is None:
+                return _respond(start_response, "409 Conflict", "Another profile is running\n")
+            return _respond(start_response, "200 OK", format_stacks(stacks))
+
+        return metrics_app(environ, start_response)
+
+    return app
+
+
+def start_debug_server(
+        addr: str,
+        port: int,
+        registry: CollectorRegistry = REGISTRY,
+        slow_queries: SlowQueryLog | None = None,
+        profiling: bool = False,
+) -> None:
+    """Serve metrics and the debug endpoints from a daemon thread, in place of `prometheus_client` server."""
+    app = make_debug_app(registry, slow_queries, StackSampler() if profiling else None)
+    server = make_server(addr, port, app, _ThreadingWSGIServer, handler_class=_SilentHandler)
+    threading.Thread(target=server.serve_forever, name="debug-server", daemon=True).start()
+
+
+def _respond(
+        start_response: StartResponse,
+        status: str,
+        body: str,
+        content_type: str = "text/plain; charset=utf-8",
+) -> WSGIResponse:
+    data = body.encode()
+    start_response(status, [("Content-Type", content_type), ("Content-Length", str(len(data)))])
+    return [data]
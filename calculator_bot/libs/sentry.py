@@ -0,0 +1,52 @@
+"""Thin wrapper around sentry_sdk which imports it only once Sentry is enabled, keeping it out of the startup path.
+
+The SDK takes a hundred milliseconds to import, so every import below is deferred to the call needing it.
+"""
+import typing as tp
+from contextlib import AbstractContextManager, nullcontext
+
+if tp.TYPE_CHECKING:
+    from sentry_sdk.tracing import Span
+
+_enabled = False
+
+
+def init_sentry(**options: tp.Any) -> None:
+    global _enabled  # pylint: disable=W0603
+    import sentry_sdk  # pylint: disable=C0415
+
+    sentry_sdk.init(**options)
+    _enabled = True
+
+
+def tracing_enabled() -> bool:
+    if not _enabled:
+        return False
+
+    from sentry_sdk import Hub  # pylint: disable=C0415
+    from sentry_sdk.tracing_utils import \
+        has_tracing_enabled  # pylint: disable=C0415
+
+    client = Hub.current.client
+    return client is not None and has_tracing_enabled(client.options)
+
+
+def start_transaction(op: str, name: str) -> AbstractContextManager["Span"]:
+    from sentry_sdk import \
+        start_transaction as sentry_start_transaction  # pylint: disable=C0415
+
+    return sentry_start_transaction(op=op, name=name)
+
+
+def start_child_span(span: "Span | None", op: str) -> AbstractContextManager["Span | None"]:
+    if span is None:
+        return nullcontext()
+    return span.start_child(op=op)
+
+
+def capture_exception(exc: BaseException) -> None:
+    if _enabled:
+        from sentry_sdk import \
+            capture_exception as sentry_capture_exception  # pylint: disable=C0415
+
+        sentry_capture_exception(exc)
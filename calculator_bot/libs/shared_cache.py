@@ -0,0 +1,233 @@
+"""Query outcomes shared by the bot processes of one host through a memory mapped table.
+
+The table is a file of fixed size slots addressed by a 128-bit hash of the key, so any process mapping the file
+sees the others' entries. Readers take no locks: a slot carries a sequence number which is odd while the slot is
+written, a read is valid when the number is even and the same before and after it. A key lives in the
+`PROBE_LIMIT` slots following its hash, a full window evicts with the clock algorithm: hits set a reference bit,
+eviction clears them until it finds a slot without one. Slot `i` is guarded by byte `i % LOCK_STRIPES` of the
+file, a writer locks the bytes of every slot of the window in ascending order, so writers of overlapping windows
+never write a slot at once. These are `fcntl` locks, they exclude processes but not threads of one process.
+"""
+import fcntl
+import hashlib
+import mmap
+import os
+import struct
+import typing as tp
+
+from loguru import logger as log
+
+from calculator_bot.libs.lru import CacheEvents
+
+MAGIC = b"CALCRC01"
+# Magic, slot count, slot size and a fingerprint of the settings the outcomes were computed with
+HEADER = struct.Struct("<8sII16s")
+HEADER_SIZE = 64
+# Sequence number, outcome kind, reference bit, key hash and the value
+SLOT = struct.Struct("<IBB2x16sd")
+SEQ = struct.Struct("<I")
+REFERENCE_OFFSET = 5
+PROBE_LIMIT = 8
+LOCK_STRIPES = 64
+READ_RETRIES = 100
+EMPTY_KEY = bytes(16)
+
+
+class OutcomeKinds:
+    VALUE = 1
+    INCORRECT = 2
+    TOO_EXPENSIVE = 3
+    FAILED = 4
+
+
+class SharedResultCache:
+    """Cross-process cache of `(kind, value)` outcomes, one of `OutcomeKinds` and the result for `VALUE`.
+
+    The table file is made once with `create` by the process starting the others, every process then `attach`es
+    to it; until then the cache stays empty. `on_event` gets `CacheEvents` like `LRUCache` callers do.
+    """
+
+    def __init__(self, on_event: tp.Callable[[str], None] | None = None) -> None:
+        self.slots = 0
+        self._on_event = on_event
+        self._fd = -1
+        self._map: mmap.mmap | None = None
+
+    def __len__(self) -> int:
+        if self._map is None:
+            return 0
+        return sum(
+            1 for idx in range(self.slots) if SLOT.unpack_from(self._map, self._offset(idx))[3] != EMPTY_KEY
+        )
+
+    @classmethod
+    def create(cls, path: str, slots: int, fingerprint: bytes, snapshot_path: str | None = None) -> int:
+        """Make a table of `slots` at `path` warmed up from the snapshot, return the amount of entries loaded.
+
+        Outcomes depend on settings like the limits, `fingerprint` identifies them: a table already at `path` with
+        the same fingerprint and size is kept for the processes using it, a snapshot taken with another one is
+        ignored.
+        """
+        fingerprint = hashlib.blake2b(fingerprint, digest_size=16).digest()
+        header = HEADER.pack(MAGIC, slots, SLOT.size, fingerprint)
+        try:
+            with open(path, "rb") as table_file:
+                if table_file.read(HEADER.size) == header:
+                    return 0
+        except FileNotFoundError:
+            pass
+
+        temp_path = f"{path}.{os.getpid()}.tmp"
+        with open(temp_path, "wb") as table_file:
+            table_file.write(header.ljust(HEADER_SIZE, b"\0"))
+            table_file.truncate(HEADER_SIZE + slots * SLOT.size)
+        os.replace(temp_path, path)
+        return cls._load_snapshot(path, fingerprint, snapshot_path) if snapshot_path else 0
+
+    @classmethod
+    def _load_snapshot(cls, path: str, fingerprint: bytes, snapshot_path: str) -> int:
+        snapshot = _read_snapshot(snapshot_path, fingerprint)
+        if snapshot is None:
+            return 0
+
+        cache = cls()
+        cache.attach(path)
+        try:
+            # Entries are inserted one by one, so a snapshot of a table of another size fits as well
+            loaded = 0
+            for seq, kind, _, key_hash, value in SLOT.iter_unpack(snapshot):
+                if key_hash != EMPTY_KEY and not seq & 1:
+                    cache._store(key_hash, kind, value)
+                    loaded += 1
+            return loaded
+        finally:
+            cache.close()
+
+    def attach(self, path: str) -> None:
+        self._fd = os.open(path, os.O_RDWR)
+        self._map = mmap.mmap(self._fd, 0)
+        magic, self.slots, slot_size, _ = HEADER.unpack_from(self._map)
+        if magic != MAGIC or slot_size != SLOT.size:
+            self.close()
+            raise ValueError(f"{path} is not a result cache table")
+
+    def close(self) -> None:
+        if self._map is not None:
+            self._map.close()
+            os.close(self._fd)
+            self._map = None
+
+    def get(self, key: str) -> tuple[int, float] | None:
+        table = self._map
+        if table is None:
+            return None
+
+        key_hash = _hash(key)
+        start = _index(key_hash, self.slots)
+        for probe in range(PROBE_LIMIT):
+            offset = self._offset(start + probe)
+            slot = _read_slot(table, offset)
+            if slot is None or slot[2] == EMPTY_KEY:
+                break
+            if slot[2] == key_hash:
+                table[offset + REFERENCE_OFFSET] = 1
+                self._emit(CacheEvents.HIT)
+                return slot[0], slot[1]
+
+        self._emit(CacheEvents.MISS)
+        return None
+
+    def set(self, key: str, kind: int, value: float = 0.0) -> None:
+        if self._map is not None:
+            self._store(_hash(key), kind, value)
+
+    def save_snapshot(self, path: str) -> None:
+        """Copy the table to `path`, slots being written meanwhile are left out when the snapshot is loaded."""
+        if self._map is None:
+            return
+
+        temp_path = f"{path}.{os.getpid()}.tmp"
+        with open(temp_path, "wb") as snapshot_file:
+            snapshot_file.write(self._map)
+        os.replace(temp_path, path)
+
+    def _store(self, key_hash: bytes, kind: int, value: float) -> None:
+        table = self._map
+        if table is None:
+            return
+
+        start = _index(key_hash, self.slots)
+        stripes = sorted({(start + probe) % self.slots % LOCK_STRIPES for probe in range(PROBE_LIMIT)})
+        for stripe in stripes:
+            fcntl.lockf(self._fd, fcntl.LOCK_EX, 1, stripe)
+        try:
+            victim = self._find_slot(table, start, key_hash)
+            offset = self._offset(victim)
+            seq = SEQ.unpack_from(table, offset)[0] | 1
+            evicted = SLOT.unpack_from(table, offset)[3] not in (key_hash, EMPTY_KEY)
+            SEQ.pack_into(table, offset, seq)
+            SLOT.pack_into(table, offset, seq, kind, 0, key_hash, value)
+            SEQ.pack_into(table, offset, (seq + 1) & 0xFFFFFFFF)
+        finally:
+            for stripe in reversed(stripes):
+                fcntl.lockf(self._fd, fcntl.LOCK_UN, 1, stripe)
+        if evicted:
+            self._emit(CacheEvents.EVICTION)
+
+    def _find_slot(self, table: mmap.mmap, start: int, key_hash: bytes) -> int:
+        """Slot of the key, the first empty one or the clock victim among the slots the key may live in."""
+        for probe in range(PROBE_LIMIT):
+            slot_key = SLOT.unpack_from(table, self._offset(start + probe))[3]
+            if slot_key in (key_hash, EMPTY_KEY):
+                return start + probe
+
+        while True:
+            for probe in range(PROBE_LIMIT):
+                reference = self._offset(start + probe) + REFERENCE_OFFSET
+                if not table[reference]:
+                    return start + probe
+                table[reference] = 0
+
+    def _offset(self, idx: int) -> int:
+        return HEADER_SIZE + (idx % self.slots) * SLOT.size
+
+    def _emit(self, event: str) -> None:
+        if self._on_event is not None:
+            self._on_event(event)
+
+
+def _read_slot(table: mmap.mmap, offset: int) -> tuple[int, float, bytes] | None:
+    """Kind, value and key hash of a slot, None when it keeps being written."""
+    for _ in range(READ_RETRIES):
+        seq, kind, _, slot_key, value = SLOT.unpack_from(table, offset)
+        if not seq & 1 and SEQ.unpack_from(table, offset)[0] == seq:
+            return kind, value, slot_key
+    # Written all along, or left half written by a process which died
+    return None
+
+
+def _read_snapshot(path: str, fingerprint: bytes) -> bytes | None:
+    """Slots of the snapshot at `path`, None when there is none or it was taken with another fingerprint."""
+    try:
+        with open(path, "rb") as snapshot_file:
+            snapshot = snapshot_file.read()
+    except FileNotFoundError:
+        return None
+
+    magic, slots, slot_size, snapshot_fingerprint = HEADER.unpack_from(snapshot.ljust(HEADER.size, b"\0"))
+    if magic != MAGIC or slot_size != SLOT.size or snapshot_fingerprint != fingerprint:
+        log.warning(f"Ignoring result cache snapshot {path} taken with other settings")
+        return None
+
+    end = HEADER_SIZE + min(slots, (len(snapshot) - HEADER_SIZE) // SLOT.size) * SLOT.size
+    return snapshot[HEADER_SIZE:end]
+
+
+def _hash(key: str) -> bytes:
+    key_hash = hashlib.blake2b(key.encode(), digest_size=16).digest()
+    # The all-zero hash marks empty slots
+    return key_hash if key_hash != EMPTY_KEY else b"\1" + key_hash[1:]
+
+
+def _index(key_hash: bytes, slots: int) -> int:
+    return int.from_bytes(key_hash[:8], "little") % slots
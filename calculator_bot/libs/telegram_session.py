@@ -0,0 +1,43 @@
+import typing as tp
+from time import perf_counter
+
+from aiogram import Bot
+from aiogram.client.session.aiohttp import AiohttpSession
+from aiogram.client.session.middlewares.base import (BaseRequestMiddleware,
+                                                     NextRequestMiddlewareType)
+from aiogram.methods import Response, TelegramMethod
+from aiogram.methods.base import TelegramType
+
+
+class PooledAiohttpSession(AiohttpSession):
+    """Aiohttp session with a tunable connection pool for the calls that still go to the Bot API.
+
+    `limit` caps simultaneous connections (0 means unlimited) and `keepalive_timeout` controls how long idle
+    connections stay open for reuse.
+    """
+
+    def __init__(self, limit: int = 100, keepalive_timeout: float = 15.0, **kwargs: tp.Any) -> None:
+        super().__init__(**kwargs)
+        self._connector_init.update(limit=limit, keepalive_timeout=keepalive_timeout)
+
+
+class RequestTimingMiddleware(BaseRequestMiddleware):
+    """Reports the duration of every outgoing Bot API call to `on_request` as `(api_method, seconds, ok)`."""
+
+    def __init__(self, on_request: tp.Callable[[str, float, bool], None]) -> None:
+        self._on_request = on_request
+
+    async def __call__(
+            self,
+            make_request: NextRequestMiddlewareType[TelegramType],
+            bot: Bot,
+            method: TelegramMethod[TelegramType],
+    ) -> Response[TelegramType]:
+        started = perf_counter()
+        ok = False
+        try:
+            response = await make_request(bot, method)
+            ok = True
+            return response
+        finally:
+            self._on_request(method.__api_method__, perf_counter() - started, ok)
@@ -0,0 +1,142 @@
+import asyncio
+import heapq
+import itertools
+import typing as tp
+from time import monotonic
+
+from prometheus_client import Counter, Gauge, Histogram
+
+RT = tp.TypeVar("RT")
+
+QUEUE_DEPTH_METRIC = Gauge(
+    "calc_work_queue_depth", "Updates waiting in the work queue for an evaluation slot", multiprocess_mode="livesum"
+)
+QUEUE_WAIT_SEC_METRIC = Histogram(
+    "calc_work_queue_wait_seconds",
+    "Time updates wait in the work queue before their evaluation starts",
+    ["update_type"],
+    buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, float("inf")),
+)
+QUEUE_SHED_METRIC = Counter(
+    "calc_work_queue_shed", "Updates dropped by the work queue without an evaluation", ["update_type", "reason"]
+)
+
+
+class ShedReasons:
+    EXPIRED = "expired"
+    OVERFLOW = "overflow"
+
+
+class _Entry(tp.NamedTuple):
+    priority: int
+    deadline: float
+    seq: int
+    kind: str
+    enqueued_at: float
+    waiter: "asyncio.Future[bool]"
+
+
+class DeadlineQueue:
+    """Runs at most `concurrency` calls at once, the others wait in a queue of at most `maxsize` calls.
+
+    Waiting calls start by `priority` (lower first), then by the earliest deadline. A call whose deadline passes
+    while it waits is shed instead of started. A call arriving at a full queue takes the place of the queued call
+    with the lowest priority and the latest deadline when it outranks it, otherwise it is shed itself. Shed calls
+    return None. Shed calls and waits are counted by the `kind` of a call, which is the update type.
+    """
+
+    def __init__(self, concurrency: int, maxsize: int) -> None:
+        self.concurrency = max(concurrency, 1)
+        self.maxsize = maxsize
+        self._running = 0
+        self._queue: list[_Entry] = []
+        self._seq = itertools.count()
+
+    def __len__(self) -> int:
+        return len(self._queue)
+
+    async def run(
+            self,
+            fn: tp.Callable[[], tp.Awaitable[RT]],
+            kind: str,
+            priority: int = 0,
+            deadline: float | None = None,
+    ) -> RT | None:
+        """Run `fn` once a slot is free, `deadline` is a `time.monotonic()` value or None for no deadline."""
+        if self._running < self.concurrency and not self._queue:
+            self._running += 1
+            self._observe_wait(kind, 0.0)
+        elif not await self._wait(kind, priority, float("inf") if deadline is None else deadline):
+            return None
+
+        try:
+            return await fn()
+        finally:
+            self._release()
+
+    async def _wait(self, kind: str, priority: int, deadline: float) -> bool:
+        now = monotonic()
+        entry = _Entry(priority, deadline, next(self._seq), kind, now, asyncio.get_running_loop().create_future())
+        if self.maxsize and len(self._queue) >= self.maxsize and not self._make_room(entry, now):
+            self._shed(kind, ShedReasons.OVERFLOW)
+            return False
+
+        heapq.heappush(self._queue, entry)
+        self._observe_depth()
+        try:
+            return await entry.waiter
+        except asyncio.CancelledError:
+            if entry.waiter.done() and not entry.waiter.cancelled() and entry.waiter.result():
+                # The slot was handed over in the same loop iteration the caller got cancelled
+                self._release()
+            elif entry in self._queue:
+                self._queue.remove(entry)
+                heapq.heapify(self._queue)
+                self._observe_depth()
+            raise
+
+    def _make_room(self, entry: _Entry, now: float) -> bool:
+        """Shed expired calls, or the worst queued call when `entry` outranks it; False when there is no room."""
+        expired = [queued for queued in self._queue if queued.deadline <= now]
+        if not expired:
+            worst = max(self._queue)
+            if worst < entry:
+                return False
+            expired = [worst]
+
+        for queued in expired:
+            self._queue.remove(queued)
+            if not queued.waiter.done():
+                self._shed(queued.kind, ShedReasons.EXPIRED if queued.deadline <= now else ShedReasons.OVERFLOW)
+                queued.waiter.set_result(False)
+        heapq.heapify(self._queue)
+        return True
+
+    def _release(self) -> None:
+        self._running -= 1
+        now = monotonic()
+        while self._queue and self._running < self.concurrency:
+            entry = heapq.heappop(self._queue)
+            if entry.waiter.done():
+                # The caller got cancelled while waiting, there is nobody to hand the slot to
+                continue
+            if entry.deadline <= now:
+                self._shed(entry.kind, ShedReasons.EXPIRED)
+                entry.waiter.set_result(False)
+                continue
+
+            self._running += 1
+            self._observe_wait(entry.kind, now - entry.enqueued_at)
+            entry.waiter.set_result(True)
+        self._observe_depth()
+
+    @staticmethod
+    def _shed(kind: str, reason: str) -> None:
+        QUEUE_SHED_METRIC.labels(update_type=kind, reason=reason).inc()
+
+    @staticmethod
+    def _observe_wait(kind: str, seconds: float) -> None:
+        QUEUE_WAIT_SEC_METRIC.labels(update_type=kind).observe(seconds)
+
+    def _observe_depth(self) -> None:
+        QUEUE_DEPTH_METRIC.set(len(self._queue))
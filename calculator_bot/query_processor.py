@@ -1,68 +1,462 @@
+import asyncio
+import typing as tp
 from dataclasses import dataclass
+from functools import cache
+from sys import getsizeof
+from time import monotonic, perf_counter, time
 
 from loguru import logger as log
-from prometheus_client import Counter, Summary
-from sentry_sdk import capture_exception
+from prometheus_client import Counter, Histogram, Summary
 
-from calculator_bot.libs.calculator import Calculator, IncorrectQueryError
-from calculator_bot.libs.calculator.errors import UnknownQueryElementError
+from calculator_bot.libs.calculator import (CalcContext, Calculator,
+                                            CompiledExpression, ExpressionCost,
+                                            IncorrectQueryError, ParseState)
+from calculator_bot.libs.calculator.const import SWEEP_SEPARATOR, CalcStages
+from calculator_bot.libs.calculator.errors import (EvaluationTimeoutError,
+                                                   QueryCostExceededError,
+                                                   UnknownQueryElementError)
+from calculator_bot.libs.calculator.incremental import weigh_parse_state
+from calculator_bot.libs.calculator.pool import ProcessEvaluator
+from calculator_bot.libs.const.messages import SWEEP_MESSAGE_TEMPLATE
+from calculator_bot.libs.logging import log_sampler
+from calculator_bot.libs.lru import LRUCache
+from calculator_bot.libs.profiling import SlowQuery, SlowQueryLog
+from calculator_bot.libs.sentry import (capture_exception, start_child_span,
+                                        start_transaction, tracing_enabled)
+from calculator_bot.libs.shared_cache import OutcomeKinds, SharedResultCache
+
+if tp.TYPE_CHECKING:
+    # NumPy and Sentry are imported on first use, only type hints need them here
+    from sentry_sdk.tracing import Span
+
+    from calculator_bot.libs.calculator.sweep import SweepQuery, SweepResult
 
 QUERY_PROCESS_SEC_METRIC = Summary("calc_query_process_seconds", "Time spent calculating query")
 QUERY_COUNT_METRIC = Counter("calc_query", "Number of queries processed", ["error"])
+RESULT_CACHE_METRIC = Counter("calc_query_result_cache", "Query result cache events", ["event"])
+COMPILED_CACHE_METRIC = Counter("calc_compiled_cache", "Compiled expression cache events", ["event"])
+SLOW_QUERY_METRIC = Counter("calc_slow_query", "Queries recorded as slow", ["update_type"])
+INLINE_SESSION_METRIC = Counter("calc_inline_session", "Inline parse state store events", ["event"])
+SHARED_CACHE_METRIC = Counter("calc_shared_result_cache", "Result cache shared between processes events", ["event"])
+QUERY_COST_BITS_METRIC = Histogram(
+    "calc_query_estimated_result_bits",
+    "Estimated size of the largest value a query produces, in bits",
+    buckets=(8, 16, 32, 64, 128, 256, 512, 1024, 2048, 4096, 16384, float("inf")),
+)
+QUERY_COST_OPERATIONS_METRIC = Histogram(
+    "calc_query_operations",
+    "Amount of operations in a query",
+    buckets=(1, 2, 4, 8, 16, 32, 64, 128, 256, 1024, 4096, float("inf")),
+)
+EVALUATION_SLICE_SEC_METRIC = Histogram(
+    "calc_evaluation_slice_seconds",
+    "Time an evaluation runs without yielding to the event loop",
+    buckets=(0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, float("inf")),
+)
+QUERY_DURATION_SEC_METRIC = Histogram(
+    "calc_query_duration_seconds",
+    "Time spent processing a query, exemplars link to Sentry traces",
+    ["update_type"],
+    buckets=(0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.5, 1, 2.5, float("inf")),
+)
+QUERY_STAGE_SEC_METRIC = Histogram(
+    "calc_query_stage_seconds",
+    "Time spent in every stage of query processing",
+    ["stage", "update_type"],
+    buckets=(0.00001, 0.000025, 0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.005, 0.01, 0.1, 1, float("inf")),
+)
+QUERY_LENGTH_METRIC = Histogram(
+    "calc_query_length",
+    "Length of queries in characters",
+    ["update_type"],
+    buckets=(1, 2, 4, 8, 16, 32, 64, 128, 256, 512, 1024, 4096, float("inf")),
+)
+QUERY_DEPTH_METRIC = Histogram(
+    "calc_query_nesting_depth",
+    "Parentheses nesting depth of compiled queries",
+    ["update_type"],
+    buckets=(0, 1, 2, 3, 4, 6, 8, 12, 16, 32, 64, 128, float("inf")),
+)
+SWEEP_TABLE_SIZE = 10
+# Outcomes of user input like `1/0` or `(-8)^(1/3)`, as pure as results: logged sampled and cached
+EXPECTED_ERRORS = (
+    IncorrectQueryError, UnknownQueryElementError, QueryCostExceededError, ArithmeticError, TypeError
+)
+
+
+class UpdateTypes:
+    DIRECT = "direct"
+    INLINE = "inline"
+    BATCH = "batch"
+
+
+# Resolving label values takes a lock and a few microseconds, children are looked up once per label set instead
+@cache
+def _update_metric(metric: Histogram, update_type: str) -> Histogram:
+    return metric.labels(update_type=update_type)
+
+
+@cache
+def _stage_metric(stage: str, update_type: str) -> Histogram:
+    return QUERY_STAGE_SEC_METRIC.labels(stage=stage, update_type=update_type)
 
 
-@dataclass
+@dataclass(frozen=True)
 class QueryResult:
-    """Class to hold the results of a query."""
+    """Class to hold the results of a query.
+
+    `cacheable` results are pure outcomes of the query, they don't change on retry; `seconds` is the time their
+    processing took, cached copies keep it.
+    """
     query: str
     result: str
     message: str
     error: bool
+    cacheable: bool = False
+    seconds: float = 0.0
+
+
+def init_compiled_cache(size: int) -> LRUCache[str, CompiledExpression]:
+    return LRUCache(size, on_event=lambda event: COMPILED_CACHE_METRIC.labels(event=event).inc())
+
+
+def init_result_cache(size: int, ttl: float | None, max_bytes: int | None) -> LRUCache[str, QueryResult]:
+    return LRUCache(
+        size,
+        on_event=lambda event: RESULT_CACHE_METRIC.labels(event=event).inc(),
+        ttl=ttl,
+        max_bytes=max_bytes,
+        weigh=weigh_query_result,
+    )
+
+
+def init_inline_sessions(size: int, ttl: float | None, max_bytes: int | None) -> LRUCache[int, ParseState]:
+    return LRUCache(
+        size,
+        on_event=lambda event: INLINE_SESSION_METRIC.labels(event=event).inc(),
+        ttl=ttl,
+        max_bytes=max_bytes,
+        weigh=weigh_parse_state,
+    )
+
+
+def weigh_query_result(result: QueryResult) -> int:
+    return getsizeof(result.query) + getsizeof(result.result) + getsizeof(result.message)
+
+
+def init_shared_cache() -> SharedResultCache:
+    return SharedResultCache(on_event=lambda event: SHARED_CACHE_METRIC.labels(event=event).inc())
+
+
+def format_number(value: float) -> str:
+    result_str = str(value)
+    if result_str.endswith(".0"):
+        result_str = result_str[:-2]
+    return result_str
+
+
+def format_outcome(query: str, kind: int, value: float) -> tuple[str, str, bool]:
+    """Result line, message and error flag of an outcome, one of `OutcomeKinds`."""
+    if kind == OutcomeKinds.VALUE:
+        result_str = format_number(value)
+        return result_str, f"{query} = {result_str}", False
+    if kind == OutcomeKinds.TOO_EXPENSIVE:
+        return "Result: Query is too expensive", f"Query is too expensive: {query}", True
+    if kind == OutcomeKinds.FAILED:
+        return "Result: Error occurred :(", "An error occurred while processing the query", True
+    return "Result: Incorrect query", f"Incorrect query: {query}", True
 
 
 class QueryProcessor:
-    def __init__(self, parentheses_limit: int) -> None:
-        self._parentheses_limit = parentheses_limit
+    def __init__(
+            self,
+            parentheses_limit: int,
+            compiled_cache: LRUCache[str, CompiledExpression] | None = None,
+            result_cache: LRUCache[str, QueryResult] | None = None,
+            process_evaluator: ProcessEvaluator | None = None,
+            fast_path_size: int = 0,
+            result_bits_limit: int = 0,
+            operations_limit: int = 0,
+            sweep_points_limit: int = 0,
+            sweep_timeout: float = 0,
+            slice_operations: int = 0,
+            slice_seconds: float = 0,
+            inline_sessions: LRUCache[int, ParseState] | None = None,
+            slow_queries: SlowQueryLog | None = None,
+            shared_cache: SharedResultCache | None = None,
+    ) -> None:
+        # The calculator keeps no per-call state, one instance serves every query
+        self._calculator = Calculator(
+            parentheses_limit,
+            compiled_cache,
+            result_bits_limit,
+            operations_limit,
+            slice_operations,
+            slice_seconds,
+            EVALUATION_SLICE_SEC_METRIC.observe,
+        )
+        self._sweep_points_limit = sweep_points_limit
+        self._sweep_timeout = sweep_timeout
+        self._result_cache = result_cache
+        self._process_evaluator = process_evaluator
+        self._fast_path_size = fast_path_size
+        # Parse states of the last inline query per user, the next keystroke continues from them
+        self._inline_sessions = inline_sessions
+        self._slow_queries = slow_queries
+        # Outcomes keyed by the sanitized query, so other processes and spellings of a query find them too
+        self._shared_cache = shared_cache
 
     @QUERY_PROCESS_SEC_METRIC.time()
-    async def process(self, query: str) -> QueryResult:
+    async def process(
+            self,
+            query: str,
+            update_type: str = UpdateTypes.DIRECT,
+            session_key: int | None = None,
+            group_values: dict[str, float] | None = None,
+    ) -> QueryResult:
+        """Process a query, with `session_key` (a user id) it's compiled incrementally from the user's last query.
+
+        Queries of a batch pass the same `group_values` to share parenthesised sub-expressions, see `CalcContext`.
+        """
+        started = perf_counter()
+        if not tracing_enabled():
+            query_result = await self._process(query, update_type, session_key, group_values)
+            _update_metric(QUERY_DURATION_SEC_METRIC, update_type).observe(perf_counter() - started)
+            return query_result
+
+        with start_transaction(op="calc.query", name=f"{update_type} query") as transaction:
+            query_result = await self._process(query, update_type, session_key, group_values, transaction)
+
+        # Sampled queries carry their trace id, so a slow bucket in the histogram leads to the trace in Sentry
+        exemplar = {"trace_id": transaction.trace_id} if transaction.sampled else None
+        _update_metric(QUERY_DURATION_SEC_METRIC, update_type).observe(perf_counter() - started, exemplar)
+        return query_result
+
+    async def _process(
+            self,
+            query: str,
+            update_type: str,
+            session_key: int | None = None,
+            group_values: dict[str, float] | None = None,
+            span: "Span | None" = None,
+    ) -> QueryResult:
         if not query:
-            result_str = "Waiting for query"
-            message = "Empty query provided"
-            error = False
+            QUERY_COUNT_METRIC.labels(error=False).inc()
+            return QueryResult(query=query, result="Waiting for query", message="Empty query provided", error=False)
+
+        _update_metric(QUERY_LENGTH_METRIC, update_type).observe(len(query))
+        # Lines of a pasted batch would evict the results inline typing keeps hitting, they use the shared table only
+        result_cache = self._result_cache if update_type != UpdateTypes.BATCH else None
+        cached_result = result_cache.get(query) if result_cache is not None else None
+        if cached_result is not None:
+            QUERY_COUNT_METRIC.labels(error=cached_result.error).inc()
+            return cached_result
+
+        query_result = await self._solve(query, update_type, session_key, group_values, span)
+        QUERY_COUNT_METRIC.labels(error=query_result.error).inc()
+        if query_result.cacheable and result_cache is not None:
+            result_cache.set(query, query_result)
+        return query_result
+
+    async def _solve(
+            self,
+            query: str,
+            update_type: str,
+            session_key: int | None,
+            group_values: dict[str, float] | None,
+            span: "Span | None",
+    ) -> QueryResult:
+        started = perf_counter()
+        cacheable = False
+        context = CalcContext(
+            query_origin=query, parse_state=self._load_parse_state(session_key), group_values=group_values
+        )
+        try:
+            result_str, message, error = await self._process_query(query, context, span)
+            # Arithmetic is pure, so both results and "Incorrect query" outcomes can be reused
+            cacheable = True
+        except EvaluationTimeoutError as exc:
+            if log_sampler.allow(exc.__class__.__name__):
+                log.warning(f"Failed to process query '{query}' in time: {exc}")
+            result_str = "Result: Calculation takes too long"
+            message = f"Calculation takes too long: {query}"
+            error = True
+        except Exception as exc:  # pylint: disable=W0703
+            log.exception("Failed to process query", exc_info=exc)
+            capture_exception(exc)
+            result_str = "Result: Error occurred :("
+            message = "An error occurred while processing the query"
+            error = True
+        self._save_parse_state(session_key, context)
+        self._observe_context(context, update_type)
+        seconds = perf_counter() - started
+        if self._slow_queries is not None:
+            self._record_slow_query(self._slow_queries, context, update_type, seconds)
 
-        else:
-            try:
-                result_str, message, error = await self._process_query(query)
-            except Exception as exc:  # pylint: disable=W0703
-                log.exception("Failed to process query", exc_info=exc)
-                capture_exception(exc)
-                result_str = "Result: Error occurred :("
-                message = "An error occurred while processing the query"
-                error = True
-
-        QUERY_COUNT_METRIC.labels(error=error).inc()
         return QueryResult(
             query=query,
             result=result_str,
             message=message,
-            error=error
+            error=error,
+            cacheable=cacheable,
+            seconds=seconds,
         )
 
-    async def _process_query(self, query: str) -> tuple[str, str, bool]:
+    async def _process_query(
+            self,
+            query: str,
+            context: CalcContext,
+            span: "Span | None" = None,
+    ) -> tuple[str, str, bool]:
+        shared_key = None
         try:
-            result = await Calculator(self._parentheses_limit).solve(query)
-            result_str = str(result)
-
-            if result_str.endswith(".0"):
-                result_str = result_str[:-2]
-            message = f"{query} = {result_str}"
-            error = False
-
-        except (IncorrectQueryError, UnknownQueryElementError) as exc:
-            log.error(f"Failed to process query '{query}': {exc.__class__.__name__} - {exc}")
-            result_str = "Result: Incorrect query"
-            message = f"Incorrect query: {query}"
-            error = True
+            if SWEEP_SEPARATOR in query:
+                return await self._process_sweep(query, context, span)
+
+            shared_key, outcome = self._load_outcome(query)
+            if outcome is not None:
+                return format_outcome(query, *outcome)
+
+            result = await self._evaluate_query(query, context, span)
+            kind = OutcomeKinds.VALUE
+
+        except EXPECTED_ERRORS as exc:
+            kind, result = self._expected_outcome(query, exc), 0.0
+
+        if shared_key is not None:
+            self._save_outcome(shared_key, kind, result)
+        started = perf_counter()
+        formatted = format_outcome(query, kind, result)
+        if kind == OutcomeKinds.VALUE:
+            context.record(CalcStages.FORMAT, started)
+        return formatted
+
+    def _expected_outcome(self, query: str, exc: Exception) -> int:
+        error = f"{exc.__class__.__name__} - {exc}"
+        if isinstance(exc, QueryCostExceededError):
+            self._observe_cost(exc.cost)
+            kind, message = OutcomeKinds.TOO_EXPENSIVE, f"Rejected too expensive query '{query}': {exc}"
+        elif isinstance(exc, (IncorrectQueryError, UnknownQueryElementError)):
+            kind, message = OutcomeKinds.INCORRECT, f"Failed to process query '{query}': {error}"
+        else:
+            kind, message = OutcomeKinds.FAILED, f"Failed to calculate query '{query}': {error}"
+
+        # Garbage floods are expected, so these records are rate limited per error class
+        if log_sampler.allow(exc.__class__.__name__):
+            log.error(message)
+        return kind
+
+    async def _process_sweep(
+            self,
+            query: str,
+            context: CalcContext,
+            span: "Span | None" = None,
+    ) -> tuple[str, str, bool]:
+        with start_child_span(span, "calc.sweep"):
+            started = perf_counter()
+            sweep_query = self._calculator.prepare_sweep(query, self._sweep_points_limit)
+            started = context.record(CalcStages.PARSE, started)
+            sweep = await self._evaluate_sweep(sweep_query)
+            started = context.record(CalcStages.EVALUATE, started)
+            result_str, message = self._format_sweep(query, sweep)
+            context.record(CalcStages.FORMAT, started)
+        return result_str, message, False
+
+    async def _evaluate_sweep(self, sweep_query: "SweepQuery") -> "SweepResult":
+        """Evaluate a sweep off the event loop, under the deadline of the process pool when there's no pool."""
+        if self._process_evaluator is not None:
+            return await self._process_evaluator.run(Calculator.evaluate_sweep, sweep_query)
+
+        deadline = monotonic() + self._sweep_timeout if self._sweep_timeout else None
+        return await asyncio.to_thread(Calculator.evaluate_sweep, sweep_query, deadline)
+
+    async def _evaluate_query(self, query: str, context: CalcContext, span: "Span | None" = None) -> float:
+        calculator = self._calculator
+        with start_child_span(span, "calc.prepare"):
+            expression = calculator.prepare(query, context)
+        self._observe_cost(expression.cost)
+
+        with start_child_span(span, "calc.evaluate"):
+            started = perf_counter()
+            if self._process_evaluator is None or len(expression.program) <= self._fast_path_size:
+                result = await calculator.evaluate(expression, group_values=context.group_values)
+            else:
+                result = await self._process_evaluator.evaluate(expression)
+            context.record(CalcStages.EVALUATE, started)
+        return result
+
+    def _load_outcome(self, query: str) -> tuple[str | None, tuple[int, float] | None]:
+        """Shared cache key of a query and the outcome stored under it, both None without the cache."""
+        if self._shared_cache is None:
+            return None, None
+        shared_key = self._calculator.sanitize(query)
+        return shared_key, self._shared_cache.get(shared_key)
+
+    def _save_outcome(self, shared_key: str, kind: int, value: float) -> None:
+        if self._shared_cache is not None:
+            self._shared_cache.set(shared_key, kind, value)
+
+    def _load_parse_state(self, session_key: int | None) -> ParseState | None:
+        if session_key is None or self._inline_sessions is None:
+            return None
+        return self._inline_sessions.get(session_key) or ParseState()
+
+    def _save_parse_state(self, session_key: int | None, context: CalcContext) -> None:
+        # A state at the very start of a query saves nothing
+        if session_key is not None and self._inline_sessions is not None and context.parse_state:
+            if context.parse_state.cursor:
+                self._inline_sessions.set(session_key, context.parse_state)
+
+    @staticmethod
+    def _record_slow_query(slow_queries: SlowQueryLog, context: CalcContext, update_type: str, seconds: float) -> None:
+        if seconds < slow_queries.threshold:
+            return
+
+        SLOW_QUERY_METRIC.labels(update_type=update_type).inc()
+        expression = context.expression
+        slow_queries.add(SlowQuery(
+            at=time(),
+            update_type=update_type,
+            query=context.query or context.query_origin,
+            seconds=seconds,
+            instructions=len(expression.program) if expression is not None else 0,
+            operations=expression.cost.operations if expression is not None else 0,
+            depth=expression.depth if expression is not None else 0,
+            timings=dict(context.timings),
+        ))
+
+    @staticmethod
+    def _observe_context(context: CalcContext, update_type: str) -> None:
+        for stage, seconds in context.timings.items():
+            _stage_metric(stage, update_type).observe(seconds)
+        if context.expression is not None:
+            _update_metric(QUERY_DEPTH_METRIC, update_type).observe(context.expression.depth)
+
+    @staticmethod
+    def _format_sweep(query: str, sweep: "SweepResult") -> tuple[str, str]:
+        values = sweep.result.values[~sweep.result.failed]
+        if not values.size:
+            return "Result: no values", f"{query}\nEvery value of {sweep.variable} fails to calculate"
+
+        result_str = f"Result: min {format_number(values.min())}, max {format_number(values.max())}"
+        message = SWEEP_MESSAGE_TEMPLATE.format(
+            query=query,
+            points=len(sweep.points),
+            errors=int(sweep.result.failed.sum()),
+            min=format_number(values.min()),
+            max=format_number(values.max()),
+            mean=format_number(values.mean()),
+        )
+        if len(sweep.points) <= SWEEP_TABLE_SIZE:
+            rows = (
+                f"{sweep.variable}={format_number(point)}: {'error' if failed else format_number(value)}"
+                for point, value, failed in zip(sweep.points.tolist(), sweep.result.values.tolist(),
+                                                sweep.result.failed.tolist())
+            )
+            message = "\n".join((message, *rows))
+        return result_str, message
 
-        return result_str, message, error
+    @staticmethod
+    def _observe_cost(cost: ExpressionCost) -> None:
+        QUERY_COST_BITS_METRIC.observe(cost.result_bits)
+        QUERY_COST_OPERATIONS_METRIC.observe(cost.operations)
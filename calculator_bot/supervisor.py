@@ -0,0 +1,102 @@
+import multiprocessing
+import os
+import signal
+import typing as tp
+from multiprocessing.connection import wait
+from multiprocessing.process import BaseProcess
+from time import monotonic, sleep
+
+from loguru import logger as log
+from prometheus_client import CollectorRegistry, multiprocess
+
+# A worker dying faster than this after its start is restarted with a delay, so a broken setup doesn't spin
+MIN_WORKER_UPTIME = 5.0
+RESTART_DELAY = 1.0
+SHUTDOWN_TIMEOUT = 10.0
+
+
+def init_multiprocess_metrics(directory: str) -> CollectorRegistry:
+    """Switch prometheus_client in worker processes to multiprocess mode and return a registry aggregating them.
+
+    Must be called before workers are started: prometheus_client picks the value storage on import, and
+    workers inherit the directory through the environment.
+    """
+    os.environ["PROMETHEUS_MULTIPROC_DIR"] = directory
+    for file_name in os.listdir(directory):
+        if file_name.endswith(".db"):
+            os.remove(os.path.join(directory, file_name))
+
+    return multiprocess_registry()
+
+
+def multiprocess_registry() -> CollectorRegistry:
+    """Registry collecting the metrics of every worker from the directory set by `init_multiprocess_metrics`."""
+    registry = CollectorRegistry()
+    multiprocess.MultiProcessCollector(registry)
+    return registry
+
+
+class Supervisor:
+    """Runs `workers` copies of `target` in spawned processes, restarts the ones that die and stops all of them
+    on SIGINT/SIGTERM.
+    """
+
+    def __init__(self, workers: int, target: tp.Callable[[int], tp.Any]) -> None:
+        self.workers = workers
+        self.target = target
+        self._processes: dict[int, BaseProcess] = {}
+        self._started_at: dict[int, float] = {}
+        self._stopping = False
+
+    def run(self) -> bool:
+        signal.signal(signal.SIGINT, self._stop)
+        signal.signal(signal.SIGTERM, self._stop)
+
+        for worker_idx in range(self.workers):
+            self._start(worker_idx)
+
+        crashed = False
+        while not self._stopping:
+            wait([process.sentinel for process in self._processes.values()], timeout=1.0)
+            for worker_idx, process in list(self._processes.items()):
+                if process.is_alive() or self._stopping:
+                    continue
+
+                crashed = True
+                log.error(f"Worker {worker_idx} (pid {process.pid}) exited with code {process.exitcode}, restarting")
+                if process.pid is not None:
+                    multiprocess.mark_process_dead(process.pid)
+                if monotonic() - self._started_at[worker_idx] < MIN_WORKER_UPTIME:
+                    sleep(RESTART_DELAY)
+                self._start(worker_idx)
+
+        self._shutdown()
+        return not crashed
+
+    def _start(self, worker_idx: int) -> None:
+        process = multiprocessing.get_context("spawn").Process(
+            target=self.target, args=(worker_idx,), name=f"calculator-bot-worker-{worker_idx}"
+        )
+        process.start()
+        self._processes[worker_idx] = process
+        self._started_at[worker_idx] = monotonic()
+        log.info(f"Started worker {worker_idx} with pid {process.pid}")
+
+    def _stop(self, signum: int, _: tp.Any) -> None:
+        log.info(f"Received signal {signum}, stopping workers")
+        self._stopping = True
+
+    def _shutdown(self) -> None:
+        for process in self._processes.values():
+            if process.is_alive():
+                process.terminate()
+
+        deadline = monotonic() + SHUTDOWN_TIMEOUT
+        for worker_idx, process in self._processes.items():
+            process.join(max(deadline - monotonic(), 0))
+            if process.is_alive():
+                log.warning(f"Worker {worker_idx} did not stop in time, killing it")
+                process.kill()
+                process.join()
+            if process.pid is not None:
+                multiprocess.mark_process_dead(process.pid)
@@ -0,0 +1,63 @@
+import os
+import signal
+import socket
+import subprocess
+import sys
+import time
+from pathlib import Path
+
+from calculator_bot.libs.shared_cache import OutcomeKinds, SharedResultCache
+
+START_TIMEOUT = 30.0
+STOP_TIMEOUT = 10.0
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("localhost", 0))
+        return sock.getsockname()[1]
+
+
+def wait_for_port(process: subprocess.Popen[bytes], port: int) -> None:
+    deadline = time.monotonic() + START_TIMEOUT
+    while time.monotonic() < deadline:
+        assert process.poll() is None, "The bot exited before serving the webhook"
+        try:
+            socket.create_connection(("localhost", port), timeout=0.1).close()
+            return
+        except OSError:
+            time.sleep(0.1)
+    raise TimeoutError(f"The bot did not listen on port {port} in {START_TIMEOUT} seconds")
+
+
+def test_sigterm_saves_shared_cache_snapshot(tmp_path: Path) -> None:
+    table, snapshot, port = tmp_path / "results", tmp_path / "results.snapshot", free_port()
+    env = {
+        **os.environ,
+        "TG_BOT_API_TOKEN": "42:test",
+        "TG_MODE": "webhook",
+        "TG_WEBHOOK_PORT": str(port),
+        "CALC_SHARED_CACHE_SLOTS": "64",
+        "CALC_SHARED_CACHE_PATH": str(table),
+        "CALC_SHARED_CACHE_SNAPSHOT": str(snapshot),
+    }
+    env.pop("DOPPLER_TOKEN", None)
+    process = subprocess.Popen(
+        [sys.executable, "-m", "calculator_bot.app"], env=env, cwd=Path(__file__).parent.parent,
+    )
+    try:
+        wait_for_port(process, port)
+        cache = SharedResultCache()
+        cache.attach(str(table))
+        cache.set("2+2", OutcomeKinds.VALUE, 4.0)
+        cache.close()
+
+        process.send_signal(signal.SIGTERM)
+        process.wait(STOP_TIMEOUT)
+    finally:
+        process.kill()
+
+    restored = SharedResultCache()
+    restored.attach(str(snapshot))
+    assert restored.get("2+2") == (OutcomeKinds.VALUE, 4.0)
+    restored.close()
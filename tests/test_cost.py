@@ -0,0 +1,39 @@
+import pytest
+
+from calculator_bot.libs.calculator import Calculator
+from calculator_bot.libs.calculator.errors import QueryCostExceededError
+
+RESULT_BITS_LIMIT = 1024
+
+
+@pytest.fixture
+def calculator() -> Calculator:
+    return Calculator(parentheses_limit=100, result_bits_limit=RESULT_BITS_LIMIT)
+
+
+@pytest.mark.parametrize(
+    ("term", "action", "count", "expected"),
+    [("1", "+", 1101, 1101), ("1", "-", 2001, -1999), ("-1", "", 5001, -5001), ("0.5", "+", 3000, 1500)],
+)
+def test_flat_sum_grows_logarithmically(
+        calculator: Calculator, term: str, action: str, count: int, expected: float,
+) -> None:
+    query = action.join([term] * count)
+
+    assert calculator.prepare(query).cost.result_bits < 16
+    assert calculator.solve_sync(query) == expected
+
+
+@pytest.mark.parametrize("query", ["2^1000+2^1000", "2^1000-2^1000", "2^1000+1", "1+2^1000"])
+def test_sum_bound_covers_largest_term(calculator: Calculator, query: str) -> None:
+    assert calculator.prepare(query).cost.result_bits >= 1000
+
+
+def test_sum_of_equal_terms_adds_a_bit(calculator: Calculator) -> None:
+    assert calculator.prepare("2^1000+2^1000").cost.result_bits == pytest.approx(1001)
+
+
+@pytest.mark.parametrize("query", ["2^1023*2+2^1023", "2^1025+1", "9^9^9^9+9^9^9^9"])
+def test_sum_past_limit_is_rejected(calculator: Calculator, query: str) -> None:
+    with pytest.raises(QueryCostExceededError):
+        calculator.prepare(query)